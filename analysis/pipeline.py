@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: pipeline.py
+description: headless version of plots.ipynb for [arXiv/1701.05927]. Real and
+    generated jets are summarized a chunk at a time in worker processes
+    (observables through models/manifolds.py, average images, pixel
+    intensities), summaries are cached by the hash of their inputs, and the
+    mass, pT and tau21 plots, average images and EMD tables are made from
+    the summaries. Stages whose inputs haven't changed are skipped.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+from collections import deque
+import hashlib
+import json
+from multiprocessing import Pool
+import os
+import sys
+
+import numpy as np
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '..', 'models')
+sys.path.insert(0, MODELS_DIR)
+
+from accumulators import PIXEL_BINS
+from checkpoints import INDEX_FILE, SEPARATOR
+from evaluation import OBSERVABLES, jet_observables
+from networks.registry import MODELS
+from shards import ShardedDataset, is_sharded
+
+# the binning of the plots in plots.ipynb
+HIST_BINS = {
+    'mass': np.linspace(40, 120, 50),
+    'pt': np.linspace(200, 340, 50),
+    'tau21': np.linspace(0, 1, 50),
+}
+XLABELS = {
+    'mass': r'Discretized $m$ of Jet Image',
+    'pt': r'Discretized $p_T$ of Jet Image',
+    'tau21': r'Discretized $\tau_{21}$ of Jet Image',
+}
+CLASSES = ((1, 'signal', r"$W' \rightarrow WZ$", 'red'),
+           (0, 'background', 'QCD dijets', 'blue'))
+
+# observables are recomputed when the code computing them changes
+CODE_FILES = [os.path.join(MODELS_DIR, f) for f in
+              ('manifolds.py', 'evaluation.py', 'metrics.py')]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Make the paper plots and EMD tables for one or more '
+        'generator checkpoints, without a notebook. Reruns only what changed.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('generators', action='store', type=str, nargs='+',
+                        help='Generator weights written by train.py, or '
+                        "'<store>:<epoch>' of a checkpoint store")
+    parser.add_argument('--dataset', action='store', type=str,
+                        help='Real jets: HDF5 or Numpy file, or a directory '
+                        'written by shards.py. Defaults to the Zenodo dataset')
+    parser.add_argument('--model', '-m', action='store', type=str,
+                        default='lagan', help='Model architecture to use.',
+                        choices=MODELS)
+    parser.add_argument('--latent-size', action='store', type=int, default=200,
+                        help='size of random N(0, 1) latent space to sample')
+    parser.add_argument('--nb-points', action='store', type=int, default=20000,
+                        help='Number of real and of generated jets per sample')
+    parser.add_argument('--chunk-size', action='store', type=int, default=1000,
+                        help='Number of jets per chunk of work')
+    parser.add_argument('--nb-jobs', action='store', type=int, default=4,
+                        help='Number of worker processes')
+    parser.add_argument('--seed', action='store', type=int, default=0,
+                        help='Seed for the real sample and the generator inputs')
+    parser.add_argument('--bins', action='store', type=int, default=40,
+                        help='Histogram bins for the EMD')
+    parser.add_argument('--output-dir', '-o', action='store', type=str,
+                        default='analysis-output',
+                        help='Where plots, tables and the cache go')
+    parser.add_argument('--force', action='store_true',
+                        help='Rerun every stage, ignoring the cache')
+    return parser
+
+
+def fingerprint(path):
+    """
+    what identifies the contents of a file, of a sharded dataset, or of an
+    epoch of a checkpoint store ('<store>:<epoch>')
+    """
+    store, _, epoch = path.rpartition(SEPARATOR)
+    if store and os.path.isfile(os.path.join(store, INDEX_FILE)):
+        return fingerprint(os.path.join(store, INDEX_FILE)) + [int(epoch)]
+    if is_sharded(path):
+        path = os.path.join(path, 'index.json')
+    return [os.path.abspath(path), os.path.getsize(path),
+            os.path.getmtime(path)]
+
+
+def checkpoint_name(weights):
+    """
+    name of the plot directory and EMD table row of a checkpoint: its file
+    name and a hash of its full path, as every train.py run names its
+    checkpoints the same way
+    """
+    name = os.path.splitext(os.path.basename(weights))[0]
+    return '{}-{}'.format(name.replace(SEPARATOR, '_'), hashlib.md5(
+        os.path.abspath(weights).encode('utf-8')).hexdigest()[:8])
+
+
+def code_version():
+    md5 = hashlib.md5()
+    for filename in CODE_FILES:
+        with open(filename, 'rb') as f:
+            md5.update(f.read())
+    return md5.hexdigest()
+
+
+def stage_key(*inputs):
+    return hashlib.md5(json.dumps(inputs, sort_keys=True).encode('utf-8')
+                       ).hexdigest()[:16]
+
+
+class Cache(object):
+
+    """ stage results as .npz files, named by stage and the key of the inputs """
+
+    def __init__(self, directory, force=False):
+        self.directory = directory
+        self.force = force
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, stage, key):
+        return os.path.join(self.directory, '{}-{}.npz'.format(stage, key))
+
+    def get(self, stage, key):
+        path = self.path(stage, key)
+        if self.force or not os.path.isfile(path):
+            return None
+        with np.load(path) as f:
+            return {k: f[k] for k in f.files}
+
+    def put(self, stage, key, value):
+        # write then rename, so an interrupted run never leaves half a file
+        path = self.path(stage, key)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **value)
+        os.rename(path + '.tmp', path)
+        return value
+
+
+def summarize(images, labels):
+    """
+    Everything the plots need from a chunk of jets: observables, per class
+    image sums and counts, and the pixel intensity histogram
+    """
+    images = np.asarray(images, dtype=np.float64).reshape(-1, 25, 25)
+    labels = np.ravel(labels)
+    summary = jet_observables(images)
+    summary['signal'] = labels
+    summary['image_sum'] = np.array([images[labels == c].sum(axis=0)
+                                     for c in (0, 1)])
+    summary['count'] = np.array([np.sum(labels == c) for c in (0, 1)])
+    summary['pixels'] = np.histogram(images.ravel(), bins=PIXEL_BINS)[0]
+    return summary
+
+
+def merge(summaries):
+    merged = {}
+    for name in summaries[0]:
+        parts = [s[name] for s in summaries]
+        if name in OBSERVABLES or name == 'signal':
+            merged[name] = np.concatenate(parts)
+        else:
+            merged[name] = np.sum(parts, axis=0)
+    return merged
+
+
+def bounded_imap(pool, func, args, window):
+    """
+    pool.imap that keeps at most window chunks in flight, so chunks are only
+    loaded or generated as fast as they are summarized
+    """
+    pending = deque()
+    for a in args:
+        pending.append(pool.apply_async(func, a))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _summarize_rows(datafile, rows):
+    """
+    reads the given sorted rows of datafile (batches, for a sharded dataset)
+    and summarizes them
+    """
+    if is_sharded(datafile):
+        dataset = ShardedDataset(datafile)
+        images, labels = [np.concatenate(a) for a in zip(*dataset.iter_batches(rows))]
+        dataset.close()
+    else:
+        try:
+            import h5py
+            with h5py.File(datafile, 'r') as f:
+                images, labels = f['image'][rows], f['signal'][rows]
+        except IOError:
+            d = np.array(np.load(datafile, mmap_mode='r')[rows])
+            images, labels = d['image'], d['signal']
+
+    images = np.array(images)
+    images[images < 1e-3] = 0
+    return summarize(images, labels)
+
+
+def real_chunks(datafile, nb_points, chunk_size, seed):
+    """ (datafile, rows) of each chunk of a seeded random sample """
+    rng = np.random.RandomState(seed)
+    if is_sharded(datafile):
+        # whole batches, so every read is one chunk of a shard
+        dataset = ShardedDataset(datafile)
+        nb_batches = int(np.ceil(nb_points / dataset.batch_size))
+        rows = np.sort(rng.permutation(dataset.nb_batches)[:nb_batches])
+        per_chunk = max(chunk_size // dataset.batch_size, 1)
+    else:
+        try:
+            import h5py
+            with h5py.File(datafile, 'r') as f:
+                nb_rows = f['signal'].shape[0]
+        except IOError:
+            nb_rows = np.load(datafile, mmap_mode='r').shape[0]
+        rows = np.sort(rng.permutation(nb_rows)[:nb_points])
+        per_chunk = chunk_size
+
+    for start in range(0, rows.shape[0], per_chunk):
+        yield datafile, rows[start:start + per_chunk]
+
+
+def generated_chunks(generator, latent_size, nb_points, chunk_size, seed):
+    """ (images in GeV, labels) of each chunk of a seeded generated sample """
+    rng = np.random.RandomState(seed)
+    for start in range(0, nb_points, chunk_size):
+        n = min(chunk_size, nb_points - start)
+        labels = rng.randint(0, 2, n)
+        noise = rng.normal(0, 1, (n, latent_size))
+        images = generator.predict([noise, labels.reshape(-1, 1)],
+                                   verbose=False, batch_size=100)
+        yield 100 * images, labels
+
+
+def plot_distributions(real, generated, outdir):
+    import matplotlib.pyplot as plt
+
+    for name in OBSERVABLES:
+        bins = HIST_BINS[name]
+        plt.figure(figsize=(6, 6))
+        for c, _, label, color in CLASSES:
+            for sample, source, style in ((generated, 'generated', 'solid'),
+                                          (real, 'Pythia', 'dashed')):
+                x = sample[name][sample['signal'] == c]
+                # normalized by hand, for matplotlib with and without density=
+                plt.hist(x, bins=bins, histtype='step', color=color,
+                         linestyle=style, label='{} ({})'.format(source, label),
+                         weights=np.ones_like(x) / (max(len(x), 1) *
+                                                    (bins[1] - bins[0])))
+        plt.xlabel(XLABELS[name])
+        plt.ylabel(r'Units normalized to unit area')
+        plt.legend()
+        plt.savefig(os.path.join(outdir, '{}.pdf'.format(name)))
+        plt.close()
+
+
+def plot_images(real, generated, outdir):
+    import matplotlib.pyplot as plt
+    from matplotlib.cm import PRGn_r
+    from matplotlib.colors import LogNorm, Normalize
+
+    extent = [-1.25, 1.25, -1.25, 1.25]
+
+    def save(content, filename, title, norm, cmap=None, label=r'Pixel $p_T$ (GeV)'):
+        fig, ax = plt.subplots(figsize=(7, 6))
+        im = ax.imshow(content, interpolation='nearest', norm=norm,
+                       extent=extent, cmap=cmap)
+        cbar = plt.colorbar(im, fraction=0.05, pad=0.05)
+        cbar.set_label(label, y=0.85)
+        plt.xlabel(r'[Transformed] Pseudorapidity $(\eta)$')
+        plt.ylabel(r'[Transformed] Azimuthal Angle $(\phi)$')
+        plt.title(title)
+        plt.savefig(os.path.join(outdir, filename))
+        plt.close()
+
+    for c, name, label, _ in CLASSES:
+        averages = [s['image_sum'][c] / max(s['count'][c], 1)
+                    for s in (real, generated)]
+        for average, source in zip(averages, ('pythia', 'gan')):
+            save(average, 'avg_{}_{}.pdf'.format(source, name),
+                 'Average {} image ({})'.format(source, label),
+                 LogNorm(vmin=1e-6, vmax=300))
+
+        diff = averages[0] - averages[1]
+        extr = max(np.abs(diff).max(), 1e-6)
+        save(diff, 'avg_pythia-avg_gan_{}.pdf'.format(name),
+             'Difference between average Pythia image \n and average '
+             'generated image ({})'.format(label),
+             Normalize(vmin=-extr, vmax=extr), cmap=PRGn_r)
+
+    plt.figure(figsize=(6, 6))
+    for sample, source, color in ((real, 'Pythia', 'purple'),
+                                  (generated, 'GAN', 'green')):
+        plt.hist(PIXEL_BINS[:-1], bins=PIXEL_BINS, weights=sample['pixels'],
+                 histtype='step', label=source, color=color)
+    plt.xlabel('Pixel Intensity')
+    plt.ylabel('Number of Pixels')
+    plt.yscale('log')
+    plt.legend(loc='upper right')
+    plt.savefig(os.path.join(outdir, 'pixel_intensity.pdf'))
+    plt.close()
+
+
+def write_emd_table(rows, outdir):
+    with open(os.path.join(outdir, 'emd.json'), 'w') as f:
+        json.dump(rows, f, indent=2)
+
+    header = '{0:<40s} | {1:>8s} | {2:>8s} | {3:>8s}'.format(
+        'generator', *OBSERVABLES)
+    lines = [header, '-' * len(header)]
+    for row in rows:
+        lines.append('{0:<40s} | {1:>8.4f} | {2:>8.4f} | {3:>8.4f}'.format(
+            row['generator'], *[row[name] for name in OBSERVABLES]))
+    with open(os.path.join(outdir, 'emd.txt'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    print('\n'.join(lines))
+
+
+def is_done(directory, key):
+    """ whether the outputs in directory were made from inputs with key """
+    stamp = os.path.join(directory, '.key')
+    if not os.path.isfile(stamp):
+        return False
+    with open(stamp) as f:
+        return f.read() == key
+
+
+def mark_done(directory, key):
+    with open(os.path.join(directory, '.key'), 'w') as f:
+        f.write(key)
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+
+    import matplotlib
+    matplotlib.use('Agg')
+
+    # fork the workers before Keras is around
+    pool = Pool(results.nb_jobs)
+    window = 2 * results.nb_jobs
+
+    from data import get_datafile
+
+    cache = Cache(os.path.join(results.output_dir, 'cache'),
+                  force=results.force)
+    version = code_version()
+
+    # -- real sample
+    datafile = get_datafile(results.dataset)
+    real_key = stage_key('real', fingerprint(datafile), results.nb_points,
+                         results.seed, version)
+    real = cache.get('real', real_key)
+    if real is None:
+        print('[INFO] Summarizing {} real jets'.format(results.nb_points))
+        real = cache.put('real', real_key, merge(list(bounded_imap(
+            pool, _summarize_rows,
+            real_chunks(datafile, results.nb_points, results.chunk_size,
+                        results.seed),
+            window))))
+    else:
+        print('[INFO] Real jets: cached')
+
+    # -- generated samples, one per checkpoint
+    generator = None
+    emd_rows = []
+    for weights in results.generators:
+        name = checkpoint_name(weights)
+        gen_key = stage_key('generated', fingerprint(weights), results.model,
+                            results.latent_size, results.nb_points,
+                            results.seed, version)
+        generated = cache.get('generated', gen_key)
+
+        if generated is None:
+            print('[INFO] Summarizing {} jets from {}'.format(results.nb_points,
+                                                             weights))
+            if generator is None:
+                import keras.backend as K
+                K.set_image_dim_ordering('tf')
+                from networks.registry import build_network
+                generator = build_network(results.model, 'generator',
+                                          results.latent_size)
+            from checkpoints import load_weights
+            load_weights(generator, weights)
+            generated = cache.put('generated', gen_key, merge(list(bounded_imap(
+                pool, summarize,
+                generated_chunks(generator, results.latent_size,
+                                 results.nb_points, results.chunk_size,
+                                 results.seed),
+                window))))
+        else:
+            print('[INFO] {}: cached'.format(weights))
+
+        # -- EMD of every observable, the worse of the two classes
+        emd_key = stage_key('emd', real_key, gen_key, results.bins)
+        emd = cache.get('emd', emd_key)
+        if emd is None:
+            from metrics import calculate_metric
+            emd = cache.put('emd', emd_key, {
+                obs: np.array(calculate_metric(
+                    real[obs], real['signal'], generated[obs],
+                    generated['signal'], bins=results.bins))
+                for obs in OBSERVABLES
+            })
+        emd_rows.append(dict(generator=name, weights=weights,
+                             **{obs: float(emd[obs]) for obs in OBSERVABLES}))
+
+        # -- plots
+        plot_dir = os.path.join(results.output_dir, name)
+        plot_key = stage_key('plots', real_key, gen_key)
+        if results.force or not is_done(plot_dir, plot_key):
+            print('[INFO] Plotting {}'.format(name))
+            if not os.path.isdir(plot_dir):
+                os.makedirs(plot_dir)
+            plot_distributions(real, generated, plot_dir)
+            plot_images(real, generated, plot_dir)
+            mark_done(plot_dir, plot_key)
+
+    pool.close()
+    pool.join()
+
+    write_emd_table(emd_rows, results.output_dir)
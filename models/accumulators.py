@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: accumulators.py
+description: one-pass, mergeable per-class statistics of jet images (per-pixel
+    mean and variance, pixel intensity spectra, sparsity), fed a chunk at a
+    time from arrays, HDF5 files, sharded datasets or a generator
+"""
+
+from __future__ import division, print_function
+
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+
+from networks.registry import MODELS
+
+# pixel intensity bins, in GeV, as in analysis/plots.ipynb
+PIXEL_BINS = np.linspace(0, 300, 50)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Per-class, per-pixel statistics of real and generated jet '
+        'images in constant memory, and their difference images.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--dataset', action='store', type=str,
+                        help='Real jets: HDF5 file or a directory written by '
+                        'shards.py. Defaults to the Zenodo dataset')
+    parser.add_argument('--generator', action='store', type=str,
+                        help='Generator weights to compare with')
+    parser.add_argument('--model', '-m', action='store', type=str,
+                        default='lagan', help='Model architecture to use.',
+                        choices=MODELS)
+    parser.add_argument('--latent-size', action='store', type=int, default=200,
+                        help='size of random N(0, 1) latent space to sample')
+    parser.add_argument('--nb-points', action='store', type=int, default=100000,
+                        help='Number of jets to generate')
+    parser.add_argument('--chunk-size', action='store', type=int, default=10000,
+                        help='Number of jets per chunk')
+    parser.add_argument('--nb-jobs', action='store', type=int, default=1,
+                        help='Number of processes to read real jets with')
+    parser.add_argument('--output', '-o', action='store', type=str,
+                        default='image-statistics.npz',
+                        help='Where to save the statistics')
+    return parser
+
+
+class ImageStatistics(object):
+
+    """
+    Running statistics of (nb_images, rows, cols) images for each class:
+    per-pixel count, mean and sum of squared deviations (M2), a pixel
+    intensity histogram, how often each pixel is non-zero, and a histogram
+    of the number of non-zero pixels per image.
+
+    Chunks are folded in with the pairwise update of Chan et al., the same
+    formula merge uses to combine statistics from other processes, so the
+    result doesn't depend on how the images were chunked or split up.
+    """
+
+    def __init__(self, shape=(25, 25), classes=(0, 1), bins=PIXEL_BINS):
+        self.shape = tuple(shape)
+        self.classes = tuple(classes)
+        self.bins = np.asarray(bins, dtype=np.float64)
+
+        nb_classes, nb_pixels = len(self.classes), int(np.prod(self.shape))
+        self.count = np.zeros(nb_classes, dtype=np.int64)
+        self.mean = np.zeros((nb_classes, ) + self.shape)
+        self.m2 = np.zeros((nb_classes, ) + self.shape)
+        self.nonzero = np.zeros((nb_classes, ) + self.shape, dtype=np.int64)
+        # the last bin counts intensities above the last edge
+        self.spectrum = np.zeros((nb_classes, len(self.bins)), dtype=np.int64)
+        self.occupancy = np.zeros((nb_classes, nb_pixels + 1), dtype=np.int64)
+
+    def _combine(self, i, count, mean, m2):
+        total = self.count[i] + count
+        if total == 0:
+            return
+        delta = mean - self.mean[i]
+        self.mean[i] += delta * (count / total)
+        self.m2[i] += m2 + delta ** 2 * (self.count[i] * count / total)
+        self.count[i] = total
+
+    def update(self, images, labels):
+        """
+        Folds in a chunk of images, with labels either one class for the whole
+        chunk or an array of one class per image
+        """
+        images = np.asarray(images, dtype=np.float64).reshape((-1, ) + self.shape)
+        labels = np.broadcast_to(np.ravel(labels), (images.shape[0], ))
+
+        for i, c in enumerate(self.classes):
+            x = images[labels == c]
+            if x.shape[0] == 0:
+                continue
+            mean = x.mean(axis=0)
+            self._combine(i, x.shape[0], mean,
+                          np.square(x - mean).sum(axis=0))
+
+            nonzero = x != 0
+            self.nonzero[i] += nonzero.sum(axis=0)
+            self.occupancy[i] += np.bincount(
+                nonzero.reshape(x.shape[0], -1).sum(axis=1),
+                minlength=self.occupancy.shape[1])
+            self.spectrum[i] += np.bincount(
+                np.clip(np.searchsorted(self.bins, x[nonzero], side='right') - 1,
+                        0, len(self.bins) - 1),
+                minlength=len(self.bins))
+        return self
+
+    def merge(self, other):
+        """ folds in statistics accumulated elsewhere """
+        if (other.shape, other.classes) != (self.shape, self.classes) or \
+                not np.array_equal(other.bins, self.bins):
+            raise ValueError('Can only merge statistics with the same shape, '
+                             'classes and bins')
+        for i in range(len(self.classes)):
+            self._combine(i, other.count[i], other.mean[i], other.m2[i])
+        self.nonzero += other.nonzero
+        self.spectrum += other.spectrum
+        self.occupancy += other.occupancy
+        return self
+
+    def _index(self, c):
+        return self.classes.index(c)
+
+    def variance(self, c, ddof=1):
+        i = self._index(c)
+        return self.m2[i] / max(self.count[i] - ddof, 1)
+
+    def sparsity(self, c):
+        """ fraction of images in which each pixel is zero """
+        i = self._index(c)
+        return 1 - self.nonzero[i] / max(self.count[i], 1)
+
+    def difference(self, other, c):
+        """
+        mean image of self minus that of other for class c, and the same
+        difference in units of its standard error
+        """
+        i, j = self._index(c), other._index(c)
+        diff = self.mean[i] - other.mean[j]
+        error = np.sqrt(self.variance(c) / max(self.count[i], 1) +
+                        other.variance(c) / max(other.count[j], 1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return diff, np.where(error > 0, diff / error, 0)
+
+    def to_dict(self, prefix=''):
+        return {prefix + k: getattr(self, k) for k in
+                ('bins', 'count', 'mean', 'm2', 'nonzero', 'spectrum',
+                 'occupancy')}
+
+    @classmethod
+    def from_dict(cls, d, prefix='', classes=(0, 1)):
+        stats = cls(d[prefix + 'mean'].shape[1:], classes, d[prefix + 'bins'])
+        for k in ('count', 'mean', 'm2', 'nonzero', 'spectrum', 'occupancy'):
+            setattr(stats, k, np.array(d[prefix + k]))
+        return stats
+
+
+def iter_array(images, labels, chunk_size=10000):
+    for start in range(0, images.shape[0], chunk_size):
+        yield images[start:start + chunk_size], labels[start:start + chunk_size]
+
+
+def iter_file(datafile, chunk_size=10000, start=0, stop=None):
+    """
+    Chunks of rows [start, stop) of an HDF5 file or sharded dataset, with
+    unphysical values removed as in data.load_data
+    """
+    from shards import ShardedDataset, is_sharded
+
+    if is_sharded(datafile):
+        dataset = ShardedDataset(datafile)
+    else:
+        import h5py
+        dataset = h5py.File(datafile, 'r')
+
+    try:
+        if is_sharded(datafile):
+            read, nb_rows = dataset.read, len(dataset)
+        else:
+            read = lambda lo, hi: (dataset['image'][lo:hi],
+                                   dataset['signal'][lo:hi])
+            nb_rows = dataset['signal'].shape[0]
+
+        stop = nb_rows if stop is None else min(stop, nb_rows)
+        for lo in range(start, stop, chunk_size):
+            images, labels = read(lo, min(lo + chunk_size, stop))
+            images[images < 1e-3] = 0
+            yield images, labels
+    finally:
+        dataset.close()
+
+
+def iter_generator(generator, latent_size, nb_points, chunk_size=10000):
+    """ chunks of images in GeV from a Keras generator, with random classes """
+    for start in range(0, nb_points, chunk_size):
+        n = min(chunk_size, nb_points - start)
+        labels = np.random.randint(0, 2, n)
+        images = generator.predict(
+            [np.random.normal(0, 1, (n, latent_size)), labels.reshape(-1, 1)],
+            verbose=False, batch_size=100)
+        yield 100 * images, labels
+
+
+def accumulate(chunks, stats=None):
+    """ folds (images, labels) chunks into stats, a new ImageStatistics by default """
+    stats = ImageStatistics() if stats is None else stats
+    for images, labels in chunks:
+        stats.update(images, labels)
+    return stats
+
+
+def _accumulate_range(args):
+    datafile, start, stop, chunk_size = args
+    return accumulate(iter_file(datafile, chunk_size, start, stop))
+
+
+def accumulate_file(datafile, chunk_size=10000, nb_jobs=1):
+    """
+    Statistics of every image of datafile, with each of nb_jobs processes
+    reading its own contiguous range of rows
+    """
+    if nb_jobs <= 1:
+        return accumulate(iter_file(datafile, chunk_size))
+
+    from shards import ShardedDataset, is_sharded
+    if is_sharded(datafile):
+        nb_rows = len(ShardedDataset(datafile))
+    else:
+        import h5py
+        with h5py.File(datafile, 'r') as f:
+            nb_rows = f['signal'].shape[0]
+
+    edges = np.linspace(0, nb_rows, nb_jobs + 1).astype(int)
+    pool = Pool(nb_jobs)
+    try:
+        parts = pool.map(_accumulate_range,
+                         [(datafile, lo, hi, chunk_size)
+                          for lo, hi in zip(edges[:-1], edges[1:])])
+    finally:
+        pool.close()
+        pool.join()
+
+    stats = parts[0]
+    for part in parts[1:]:
+        stats.merge(part)
+    return stats
+
+
+def describe(stats, name):
+    for c, label in zip(stats.classes, ('background', 'signal')):
+        i = stats.classes.index(c)
+        nb_nonzero = np.dot(np.arange(stats.occupancy.shape[1]),
+                            stats.occupancy[i]) / max(stats.count[i], 1)
+        print('[INFO] {} {}: {} images, mean total pT {:.1f} GeV, '
+              '{:.1f} non-zero pixels per image'.format(
+                  name, label, stats.count[i], stats.mean[i].sum(), nb_nonzero))
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+
+    from data import get_datafile
+
+    datafile = get_datafile(results.dataset)
+    print('[INFO] Accumulating {}'.format(datafile))
+    real = accumulate_file(datafile, results.chunk_size, results.nb_jobs)
+    describe(real, 'real')
+    output = real.to_dict('real/')
+
+    if results.generator is not None:
+        import keras.backend as K
+        K.set_image_dim_ordering('tf')
+
+        from networks.registry import build_network
+
+        generator = build_network(results.model, 'generator',
+                                  results.latent_size)
+        from checkpoints import load_weights
+        load_weights(generator, results.generator)
+
+        print('[INFO] Accumulating {} generated jets'.format(results.nb_points))
+        generated = accumulate(iter_generator(
+            generator, results.latent_size, results.nb_points,
+            results.chunk_size))
+        describe(generated, 'generated')
+        output.update(generated.to_dict('generated/'))
+
+        for c, label in zip(real.classes, ('background', 'signal')):
+            diff, significance = real.difference(generated, c)
+            output['difference/' + label] = diff
+            output['significance/' + label] = significance
+            print('[INFO] {}: largest mean pixel difference {:.3g} GeV, '
+                  'largest significance {:.1f}'.format(
+                      label, np.abs(diff).max(), np.abs(significance).max()))
+
+    np.savez(results.output, **output)
+    print('[INFO] Saved to {}'.format(results.output))
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: autotune.py
+description: picks the training batch size and TensorFlow intra-op / inter-op
+    thread counts with the highest throughput for a model on this host, from
+    short timed trials in subprocesses under a memory ceiling. Decisions are
+    cached per model and host. Used by `train.py --autotune`.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+MODELS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.keras', 'lagan',
+                          'autotune.json')
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Time one training configuration (run by autotune()).',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--model', action='store', type=str, default='lagan')
+    parser.add_argument('--latent-size', action='store', type=int, default=200)
+    parser.add_argument('--minibatch-chunk-size', action='store', type=int,
+                        default=None)
+    parser.add_argument('--batch-size', action='store', type=int, default=100)
+    parser.add_argument('--intra-op-threads', action='store', type=int,
+                        default=0)
+    parser.add_argument('--inter-op-threads', action='store', type=int,
+                        default=0)
+    parser.add_argument('--nb-warmup', action='store', type=int, default=2)
+    parser.add_argument('--nb-steps', action='store', type=int, default=5)
+    return parser
+
+
+def set_threads(intra_op_threads, inter_op_threads):
+    """ gives Keras a TensorFlow session with these thread pools (0: default) """
+    import keras.backend as K
+    import tensorflow as tf
+
+    K.set_session(tf.Session(config=tf.ConfigProto(
+        intra_op_parallelism_threads=intra_op_threads,
+        inter_op_parallelism_threads=inter_op_threads
+    )))
+
+
+def _rss_mb(pid):
+    """ resident memory of a process in MB, from /proc (Linux only) """
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.
+    except IOError:
+        pass
+    return 0.
+
+
+def candidate_threads(nb_cpus=None):
+    """ (intra, inter) settings worth trying on a machine with nb_cpus cores """
+    nb_cpus = nb_cpus or multiprocessing.cpu_count()
+    intra = sorted(set([nb_cpus, max(nb_cpus // 2, 1), max(nb_cpus // 4, 1)]))
+    return [(a, b) for a in intra for b in (1, 2) if a * b <= nb_cpus]
+
+
+def run_trial(model, latent_size, minibatch_chunk_size, batch_size,
+              intra_op_threads, inter_op_threads, memory_mb, nb_steps=5,
+              timeout=600):
+    """
+    Times one configuration in a fresh process, killing it if it goes over
+    memory_mb of resident memory. Returns a dict with images_per_sec and
+    peak_rss_mb, or with an error.
+    """
+    command = [sys.executable, os.path.join(MODELS_DIR, 'autotune.py'),
+               '--model', model, '--latent-size', str(latent_size),
+               '--batch-size', str(batch_size),
+               '--intra-op-threads', str(intra_op_threads),
+               '--inter-op-threads', str(inter_op_threads),
+               '--nb-steps', str(nb_steps)]
+    if minibatch_chunk_size:
+        command += ['--minibatch-chunk-size', str(minibatch_chunk_size)]
+
+    trial = {'batch_size': batch_size, 'intra_op_threads': intra_op_threads,
+             'inter_op_threads': inter_op_threads}
+
+    with open(os.devnull, 'w') as devnull:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                   stderr=devnull, cwd=MODELS_DIR)
+    start = time.time()
+    while process.poll() is None:
+        if _rss_mb(process.pid) > memory_mb:
+            process.kill()
+            process.wait()
+            trial['error'] = 'over {:.0f} MB'.format(memory_mb)
+            return trial
+        if time.time() - start > timeout:
+            process.kill()
+            process.wait()
+            trial['error'] = 'timed out'
+            return trial
+        time.sleep(0.2)
+
+    output = process.stdout.read().decode('utf-8').strip().splitlines()
+    if process.returncode != 0 or not output:
+        trial['error'] = 'failed'
+        return trial
+
+    trial.update(json.loads(output[-1]))
+    if trial['peak_rss_mb'] > memory_mb:
+        trial['error'] = 'over {:.0f} MB'.format(memory_mb)
+    return trial
+
+
+def _cache_key(model, latent_size, minibatch_chunk_size, batch_sizes,
+               memory_mb):
+    return '|'.join(str(x) for x in (
+        model, socket.gethostname(), multiprocessing.cpu_count(), latent_size,
+        minibatch_chunk_size, ','.join(str(b) for b in sorted(batch_sizes)),
+        int(memory_mb)))
+
+
+def autotune(model, latent_size, minibatch_chunk_size, batch_sizes,
+             memory_mb, nb_steps=5, cache_file=CACHE_FILE, retune=False):
+    """
+    Returns the fastest of batch_sizes x candidate_threads() that fits in
+    memory_mb, as a dict with batch_size, intra_op_threads,
+    inter_op_threads, images_per_sec and the trials it was picked from.
+    The decision is cached per model, host and settings.
+    """
+    key = _cache_key(model, latent_size, minibatch_chunk_size, batch_sizes,
+                     memory_mb)
+    cache = {}
+    if os.path.isfile(cache_file):
+        with open(cache_file) as f:
+            cache = json.load(f)
+    if key in cache and not retune:
+        decision = dict(cache[key], cached=True)
+        return decision
+
+    trials = []
+    for batch_size in batch_sizes:
+        for intra, inter in candidate_threads():
+            trial = run_trial(model, latent_size, minibatch_chunk_size,
+                              batch_size, intra, inter, memory_mb, nb_steps)
+            trials.append(trial)
+            print('[INFO] autotune: batch size {}, {} intra-op / {} inter-op '
+                  'threads: {}'.format(
+                      batch_size, intra, inter,
+                      trial.get('error') or
+                      '{:.1f} images/sec, {:.0f} MB'.format(
+                          trial['images_per_sec'], trial['peak_rss_mb'])))
+
+    fits = [t for t in trials if 'error' not in t]
+    if not fits:
+        raise RuntimeError('No configuration fits in {:.0f} MB'.format(memory_mb))
+
+    best = max(fits, key=lambda t: t['images_per_sec'])
+    decision = dict(best, trials=trials, key=key,
+                    date=time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+    cache[key] = decision
+    if not os.path.isdir(os.path.dirname(cache_file)):
+        os.makedirs(os.path.dirname(cache_file))
+    with open(cache_file + '.tmp', 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.rename(cache_file + '.tmp', cache_file)
+
+    return dict(decision, cached=False)
+
+
+if __name__ == '__main__':
+
+    # one trial: the same iteration as train.py, on random data
+    results = get_parser().parse_args()
+
+    import keras.backend as K
+
+    K.set_image_dim_ordering('tf')
+    set_threads(results.intra_op_threads, results.inter_op_threads)
+
+    from networks.gan import build_gan
+    from networks.registry import builders
+
+    build_generator, build_discriminator = builders(results.model)
+    generator, discriminator, combined = build_gan(
+        build_generator, build_discriminator, results.latent_size, 0.0002,
+        0.5, minibatch_chunk_size=results.minibatch_chunk_size)
+
+    batch_size, latent_size = results.batch_size, results.latent_size
+    images = np.random.exponential(0.01, (batch_size, 25, 25, 1)).astype(np.float32)
+    labels = np.random.randint(0, 2, batch_size)
+
+    def iteration():
+        noise = np.random.normal(0, 1, (batch_size, latent_size))
+        generated = generator.predict([noise, labels.reshape(-1, 1)], verbose=0)
+        discriminator.train_on_batch(images, [np.ones(batch_size), labels])
+        discriminator.train_on_batch(generated, [np.zeros(batch_size), labels])
+        for _ in range(2):
+            combined.train_on_batch([noise, labels.reshape(-1, 1)],
+                                    [np.ones(batch_size), labels])
+
+    for _ in range(results.nb_warmup):
+        iteration()
+    start = time.time()
+    for _ in range(results.nb_steps):
+        iteration()
+    elapsed = time.time() - start
+
+    # ru_maxrss is in kilobytes on Linux
+    print(json.dumps({
+        'images_per_sec': results.nb_steps * batch_size / elapsed,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    }))
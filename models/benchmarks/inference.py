@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: inference.py
+description: checks that optimize_for_inference leaves the outputs of
+    every generator and discriminator in networks/ unchanged, with random
+    BatchNormalization statistics so the folding has something to fold, and
+    times the original against the optimized model. Exits 1 on a mismatch.
+    Run from models/ as `python -m benchmarks.inference`
+"""
+
+from __future__ import print_function
+
+import argparse
+import sys
+
+import numpy as np
+
+from networks.registry import MODELS
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Compare optimized inference models with the originals.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--models', action='store', type=str, nargs='+',
+                        default=list(MODELS), choices=MODELS)
+    parser.add_argument('--latent-size', action='store', type=int, default=200)
+    parser.add_argument('--nb-check', action='store', type=int, default=1000,
+                        help='Number of random inputs to compare on')
+    parser.add_argument('--batch-size', action='store', type=int, default=100)
+    parser.add_argument('--tolerance', action='store', type=float,
+                        default=1e-4, help='Largest difference to accept, '
+                        'relative to the largest output')
+    return parser
+
+
+def randomize_batchnorm(model, rng):
+    """
+    gives every BatchNormalization in model, nested ones included, random
+    scales, shifts and statistics, as a trained model would have
+    """
+    from keras.engine.topology import Container
+    from keras.layers import BatchNormalization
+
+    for layer in model.layers:
+        if isinstance(layer, Container):
+            randomize_batchnorm(layer, rng)
+        elif isinstance(layer, BatchNormalization):
+            gamma, beta, mean, var = layer.get_weights()
+            layer.set_weights([rng.uniform(0.5, 2, gamma.shape),
+                               rng.normal(0, 0.5, beta.shape),
+                               rng.normal(0, 0.5, mean.shape),
+                               rng.uniform(0.5, 2, var.shape)])
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+
+    import keras.backend as K
+
+    K.set_image_dim_ordering('tf')
+
+    from export import random_inputs, timed_predict
+    from networks.inference import optimize_for_inference
+    from networks.registry import build_network
+
+    rng = np.random.RandomState(0)
+
+    print('{0:<24s} | {1:>7s} | {2:>10s} | {3:>10s} | {4:>9s} |'.format(
+        'network', 'layers', 'original/s', 'folded/s', 'rel diff'))
+    print('-' * 74)
+
+    mismatches = []
+    for model_name in results.models:
+        for network in ('generator', 'discriminator'):
+            model = build_network(model_name, network, results.latent_size,
+                                  cache=False)
+            randomize_batchnorm(model, rng)
+            optimized = optimize_for_inference(model)
+
+            x = random_inputs(network, results.nb_check, results.latent_size)
+            y, t = timed_predict(model, x, results.batch_size)
+            y_opt, t_opt = timed_predict(optimized, x, results.batch_size)
+
+            diff = max(np.abs(a - b).max() / max(np.abs(a).max(), 1e-12)
+                       for a, b in zip(y, y_opt))
+            name = '{} {}'.format(model_name, network)
+            if not diff <= results.tolerance:
+                mismatches.append(name)
+            print('{0:<24s} | {1:>3d}=>{2:<3d} | {3:>10.0f} | {4:>10.0f} | '
+                  '{5:>9.2g} | {6}'.format(
+                      name, len(model.layers), len(optimized.layers),
+                      results.nb_check / t, results.nb_check / t_opt, diff,
+                      'ok' if diff <= results.tolerance else 'MISMATCH'))
+
+    if mismatches:
+        print('[ERROR] Optimized models differ from the originals: '
+              '{}'.format(', '.join(mismatches)))
+        sys.exit(1)
+    print('[INFO] All optimized models match the originals')
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: locally_connected.py
+description: per-layer benchmark of the stock LocallyConnected2D against
+    networks.ops.FastLocallyConnected2D, for every locally connected layer
+    shape used in networks/lagan.py. Run from models/ as
+    `python -m benchmarks.locally_connected`
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+import numpy as np
+
+# (name, input shape, nb_filter, nb_row, nb_col, subsample, bias)
+LAGAN_LAYERS = [
+    ('generator/block2', (18, 18, 64), 6, 5, 5, (1, 1), True),
+    ('generator/block3a', (28, 28, 6), 6, 3, 3, (1, 1), True),
+    ('generator/block3b', (26, 26, 6), 1, 2, 2, (1, 1), False),
+    ('discriminator/block2', (29, 29, 32), 8, 5, 5, (2, 2), True),
+    ('discriminator/block3', (17, 17, 8), 8, 5, 5, (1, 1), True),
+    ('discriminator/block4', (15, 15, 8), 8, 3, 3, (2, 2), True),
+]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Compare the stock and fast LocallyConnected2D layers.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--batch-size', action='store', type=int, default=100,
+                        help='batch size per update')
+    parser.add_argument('--nb-batches', action='store', type=int, default=20,
+                        help='Number of timed batches per layer')
+    return parser
+
+
+def build(layer_class, input_shape, nb_filter, nb_row, nb_col, subsample, bias):
+    from keras.layers import Input
+    from keras.models import Model
+
+    x = Input(shape=input_shape)
+    model = Model(x, layer_class(nb_filter, nb_row, nb_col,
+                                 subsample=subsample, bias=bias)(x))
+    model.compile(optimizer='sgd', loss='mse')
+    return model
+
+
+def time_per_batch(fn, nb_batches):
+    fn()  # warm up
+    start = time.time()
+    for _ in range(nb_batches):
+        fn()
+    return (time.time() - start) / nb_batches
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+
+    import keras.backend as K
+
+    K.set_image_dim_ordering('tf')
+
+    from keras.layers.local import LocallyConnected2D
+    from networks.ops import FastLocallyConnected2D
+
+    print('{0:<22s} | {1:>12s} | {2:>12s} | {3:>12s} | {4:>12s} | {5:>9s}'.format(
+        'layer', 'stock fwd ms', 'fast fwd ms', 'stock upd ms', 'fast upd ms',
+        'max diff'))
+    print('-' * 94)
+
+    for name, input_shape, nb_filter, nb_row, nb_col, subsample, bias in LAGAN_LAYERS:
+        args = (input_shape, nb_filter, nb_row, nb_col, subsample, bias)
+        stock = build(LocallyConnected2D, *args)
+        fast = build(FastLocallyConnected2D, *args)
+
+        # the weight layout is shared, so the weights transfer as-is
+        fast.set_weights(stock.get_weights())
+
+        x = np.random.normal(0, 1, (results.batch_size, ) + input_shape)
+        y = np.random.normal(0, 1, (results.batch_size, ) + stock.output_shape[1:])
+
+        diff = np.abs(stock.predict(x) - fast.predict(x)).max()
+
+        timings = [
+            time_per_batch(lambda: model.predict_on_batch(x), results.nb_batches)
+            for model in (stock, fast)
+        ] + [
+            time_per_batch(lambda: model.train_on_batch(x, y), results.nb_batches)
+            for model in (stock, fast)
+        ]
+
+        print('{0:<22s} | {1:>12.2f} | {2:>12.2f} | {3:>12.2f} | {4:>12.2f} | '
+              '{5:>9.2g}'.format(name, *([1000 * t for t in timings] + [diff])))
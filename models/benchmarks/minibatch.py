@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: minibatch.py
+description: peak training memory (forward pass plus gradient) and time
+    per update of the dense and chunked minibatch discrimination features as
+    the batch size grows, and how fast each grows with it: the dense op is
+    quadratic in the batch size, the chunked one linear. Every measurement
+    runs in a fresh process so peak RSS is not shared. Run from models/ as
+    `python -m benchmarks.minibatch`
+"""
+
+from __future__ import print_function
+
+import argparse
+from multiprocessing import Process, Queue
+import resource
+import time
+
+import numpy as np
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Memory vs. batch size of minibatch discrimination.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--batch-sizes', action='store', type=int, nargs='+',
+                        default=[100, 200, 400, 800, 1600, 3200],
+                        help='Batch sizes to measure')
+    parser.add_argument('--chunk-size', action='store', type=int, default=64,
+                        help='Batch rows per block for the chunked op')
+    parser.add_argument('--nb-features', action='store', type=int, default=20,
+                        help='Number of minibatch features (as in networks/)')
+    parser.add_argument('--vspace-dim', action='store', type=int, default=10,
+                        help='Dimension of the kernel space (as in networks/)')
+    parser.add_argument('--nb-repeats', action='store', type=int, default=5,
+                        help='Number of timed forward + backward passes')
+    return parser
+
+
+def _maxrss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def _measure(chunk_size, batch_size, results, queue):
+    import keras.backend as K
+    from networks.ops import (minibatch_discriminator,
+                              chunked_minibatch_discriminator)
+
+    x = K.placeholder(shape=(None, results.nb_features, results.vspace_dim))
+    if chunk_size:
+        features = chunked_minibatch_discriminator(x, chunk_size)
+    else:
+        features = minibatch_discriminator(x)
+
+    # time the gradient too, since that is what training pays for; a random
+    # upstream gradient, as from a loss
+    upstream = K.placeholder(shape=(None, results.nb_features))
+    fn = K.function([x, upstream],
+                    [features] + K.gradients(K.sum(features * upstream), [x]))
+
+    # the same inputs for both ops, to compare their outputs
+    rng = np.random.RandomState(batch_size)
+    data = rng.normal(0, 1, (batch_size, results.nb_features,
+                             results.vspace_dim)).astype(np.float32)
+    weights = rng.normal(0, 1, (batch_size, results.nb_features)).astype(
+        np.float32)
+
+    baseline = _maxrss_mb()
+    start = time.time()
+    for _ in range(results.nb_repeats):
+        outputs = fn([data, weights])
+    queue.put(((time.time() - start) / results.nb_repeats,
+               _maxrss_mb() - baseline,
+               outputs if batch_size == results.batch_sizes[0] else None))
+
+
+def measure(chunk_size, batch_size, results):
+    queue = Queue()
+    p = Process(target=_measure, args=(chunk_size, batch_size, results, queue))
+    p.start()
+    out = queue.get()
+    p.join()
+    return out
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+
+    print('{0:>10s} | {1:>14s} | {2:>14s} | {3:>14s} | {4:>14s} | {5:>14s} | '
+          '{6:>14s}'.format('batch', 'full diffs MB', 'block diffs MB',
+                            'dense peak MB', 'chunked peak MB', 'dense ms',
+                            'chunked ms'))
+    print('-' * 112)
+
+    peaks = {'dense': [], 'chunked': []}
+    for batch_size in results.batch_sizes:
+        # size of the (B, F, V, B) float32 tensor the dense op materializes,
+        # and of the (chunk, F, V, B) block the chunked op works on
+        full_mb = 4. * batch_size ** 2 * results.nb_features * \
+            results.vspace_dim / 2 ** 20
+        block_mb = full_mb * min(results.chunk_size, batch_size) / batch_size
+
+        dense_t, dense_mb, dense_out = measure(None, batch_size, results)
+        chunked_t, chunked_mb, chunked_out = measure(results.chunk_size,
+                                                     batch_size, results)
+        if dense_out is not None:
+            # features, then their gradient
+            diffs = [np.abs(a - b).max() / np.abs(a).max()
+                     for a, b in zip(dense_out, chunked_out)]
+        peaks['dense'].append(dense_mb)
+        peaks['chunked'].append(chunked_mb)
+
+        print('{0:>10d} | {1:>14.1f} | {2:>14.1f} | {3:>14.1f} | {4:>14.1f} | '
+              '{5:>14.2f} | {6:>14.2f}'.format(
+                  batch_size, full_mb, block_mb, dense_mb, chunked_mb,
+                  1000 * dense_t, 1000 * chunked_t))
+
+    print('[INFO] chunked against dense: features differ by {:.2g}, '
+          'gradients by {:.2g} (relative)'.format(*diffs))
+
+    # slope of log(peak memory) against log(batch size) over the largest
+    # batches, where the fixed overheads matter least: 2 is quadratic
+    if len(results.batch_sizes) >= 3:
+        sizes = np.log(results.batch_sizes[-3:])
+        for op in ('dense', 'chunked'):
+            slope = np.polyfit(sizes, np.log(np.maximum(peaks[op][-3:], 1e-3)),
+                               1)[0]
+            print('[INFO] {} peak memory grows as batch size ^ {:.2f}'.format(
+                op, slope))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: noise.py
+description: steps per second of drawing the noise, labels and flipped
+    targets of a training step with sampling.NoiseSampler, against the
+    per-step np.random calls and bit_flip that train.py used before. Run from
+    models/ as `python -m benchmarks.noise`
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+import numpy as np
+
+from sampling import NoiseSampler
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Compare ways of drawing the random inputs of training '
+        'steps.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--nb-steps', action='store', type=int, default=2000,
+                        help='Training steps to draw per run')
+    parser.add_argument('--batch-size', action='store', type=int, default=100)
+    parser.add_argument('--latent-size', action='store', type=int, default=200)
+    parser.add_argument('--block-sizes', action='store', type=int, nargs='+',
+                        default=[16, 64, 256],
+                        help='NoiseSampler block sizes to try')
+    return parser
+
+
+def bit_flip(x, prob=0.05):
+    """ flips a int array's values with some probability """
+    x = np.array(x)
+    selection = np.random.uniform(0, 1, x.shape) < prob
+    x[selection] = 1 * np.logical_not(x[selection])
+    return x
+
+
+def per_step(nb_steps, batch_size, latent_size, nb_classes=2):
+    """ what a training step of train.py used to draw """
+    for _ in range(nb_steps):
+        noise = np.random.normal(0, 1, (batch_size, latent_size))
+        sampled_labels = np.random.randint(0, nb_classes, batch_size)
+        step = [noise, sampled_labels, bit_flip(np.ones(batch_size)),
+                bit_flip(np.zeros(batch_size)), bit_flip(sampled_labels)]
+        for _ in range(2):
+            noise = np.random.normal(0, 1, (batch_size, latent_size))
+            sampled_labels = np.random.randint(0, nb_classes, batch_size)
+            step += [noise, sampled_labels, bit_flip(sampled_labels, 0.09)]
+        yield step
+
+
+def rate(steps):
+    start = time.time()
+    nb_steps = 0
+    for _ in steps:
+        nb_steps += 1
+    return nb_steps / (time.time() - start)
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+    args = (results.nb_steps, results.batch_size, results.latent_size)
+
+    print('{0:<24s} | {1:>12s} | {2:>8s}'.format('method', 'steps/sec',
+                                                  'speedup'))
+    print('-' * 50)
+    baseline = rate(per_step(*args))
+    print('{0:<24s} | {1:>12.0f} | {2:>7.1f}x'.format('per-step np.random',
+                                                      baseline, 1))
+
+    for block_size in results.block_sizes:
+        sampler = NoiseSampler(results.batch_size, results.latent_size,
+                               seed=0, block_size=block_size)
+        r = rate(sampler.epoch(0, results.nb_steps))
+        print('{0:<24s} | {1:>12.0f} | {2:>7.1f}x'.format(
+            'NoiseSampler[{}]'.format(block_size), r, r / baseline))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: numerics.py
+description: checks that the vectorized tau1, tau2 and EMDs of manifolds.py
+    and metrics.py give the numbers of the original loop implementations,
+    kept here as references, and times both on synthetic jets. Exits 1 on a
+    mismatch. Run from models/ as `python -m benchmarks.numerics`
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import math
+import sys
+import time
+
+import numpy as np
+
+from manifolds import eta, phi
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Check and time the vectorized observables and EMDs '
+        'against the original implementations.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--nb-images', action='store', type=int, default=500)
+    parser.add_argument('--nb-points', action='store', type=int, default=20000,
+                        help='Number of observations per EMD')
+    parser.add_argument('--rtol', action='store', type=float, default=1e-9)
+    parser.add_argument('--no-emd', action='store_true',
+                        help='Skip the EMDs, e.g. without pyemd')
+    parser.add_argument('--seed', action='store', type=int, default=0)
+    return parser
+
+
+def tau1_loop(jet_image):
+    """ the original _tau1, with dphi on one pixel at a time """
+    tau1_axis_eta = eta.ravel()[np.argmax(jet_image)]
+    tau1_axis_phi = phi.ravel()[np.argmax(jet_image)]
+    dphi = [math.acos(math.cos(abs(tau1_axis_phi - p))) for p in phi.ravel()]
+    tau1 = np.sum(jet_image *
+                  np.sqrt(np.square(tau1_axis_eta - eta) +
+                          np.square(dphi).reshape(25, 25)))
+    return tau1 / np.sum(jet_image)
+
+
+def tau2_loop(jet_image):
+    """ the original _tau2, rebuilding every pair distance after each merge """
+    proto = np.array(list(zip(jet_image[jet_image != 0],
+                              eta[jet_image != 0],
+                              phi[jet_image != 0])))
+    while len(proto) > 2:
+        candidates = [
+            ((i, j), (min(pt1, pt2) ** 2) * ((eta1 - eta2) ** 2 + (phi1 - phi2) ** 2))
+            for i, (pt1, eta1, phi1) in enumerate(proto)
+            for j, (pt2, eta2, phi2) in enumerate(proto)
+            if j > i
+        ]
+        index, value = zip(*candidates)
+        pix1, pix2 = index[np.argmin(value)]
+        (pt1, eta1, phi1) = proto[pix1]
+        (pt2, eta2, phi2) = proto[pix2]
+        e1 = pt1 / np.cosh(eta1)
+        e2 = pt2 / np.cosh(eta2)
+        choice = e1 > e2
+        eta_add = (eta1 if choice else eta2)
+        phi_add = (phi1 if choice else phi2)
+        pt_add = (e1 + e2) * np.cosh(eta_add)
+        proto[pix1] = (pt_add, eta_add, phi_add)
+        proto = np.delete(proto, pix2, axis=0).tolist()
+
+    (_, eta1, phi1), (_, eta2, phi2) = proto
+    grid = np.array([
+        np.sqrt(np.square(eta - eta1) + np.square(phi - phi1)),
+        np.sqrt(np.square(eta - eta2) + np.square(phi - phi2))
+    ]).min(axis=0)
+    return np.sum(jet_image * grid) / np.sum(jet_image)
+
+
+def tau21_loop(images):
+    tau21 = []
+    for im in images:
+        tau1 = tau1_loop(im)
+        tau21.append(tau2_loop(im) / tau1 if tau1 > 0 else 0)
+    return np.array(tau21)
+
+
+def emd_2D_loop(D1, D2, bins=(40, 40)):
+    """ the original _calculate_emd_2D, with the ground distance every call """
+    from pyemd import emd
+    from scipy.spatial.distance import cdist
+
+    _, bx, by = np.histogram2d(*np.concatenate((D1, D2), axis=0).T, bins=bins)
+    H1, _, _ = np.histogram2d(*D1.T, bins=(bx, by))
+    H2, _, _ = np.histogram2d(*D2.T, bins=(bx, by))
+    H1 /= H1.sum()
+    H2 /= H2.sum()
+    _x, _y = np.indices(H1.shape)
+    coords = np.array(list(zip(_x.ravel(), _y.ravel())))
+    return emd(H1.ravel(), H2.ravel(), cdist(coords, coords))
+
+
+def emd_1D_loop(D1, D2, bins=40):
+    """ the original _calculate_emd_1D, on (n, 1) columns """
+    from pyemd import emd
+    from scipy.linalg import toeplitz
+
+    D1 = D1[np.isnan(D1).sum(axis=-1) < 1]
+    D2 = D2[np.isnan(D2).sum(axis=-1) < 1]
+    _, bx = np.histogram(np.concatenate((D1, D2), axis=0), bins=bins)
+    H1, _ = np.histogram(D1, bins=bx, density=True)
+    H2, _ = np.histogram(D2, bins=bx, density=True)
+    H1 /= H1.sum()
+    H2 /= H2.sum()
+    return emd(H1, H2, toeplitz(range(len(H1))).astype(float))
+
+
+def timed(func, *args):
+    start = time.time()
+    value = func(*args)
+    return value, time.time() - start
+
+
+def check(name, new, reference, time_new, time_reference, rtol):
+    """ prints one row of the report, returns whether the values agree """
+    new, reference = np.asarray(new), np.asarray(reference)
+    agree = np.allclose(new, reference, rtol=rtol, atol=0, equal_nan=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        diff = np.nanmax(np.abs(new - reference) / np.abs(reference))
+    print('{0:<20s} | {1:>9.4f}s | {2:>9.4f}s | {3:>7.1f}x | {4:>9.2g} | {5}'.format(
+        name, time_reference, time_new, time_reference / time_new, diff,
+        'ok' if agree else 'MISMATCH'))
+    return agree
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+    rng = np.random.RandomState(results.seed)
+
+    from benchmarks.observables import synthetic_images, synthetic_observations
+    from manifolds import _tau1, _tau2, tau21
+
+    images = synthetic_images(results.nb_images, rng)
+    # a few exact ties between pixel pairs, to check the merge order
+    images[:10] = np.round(images[:10])
+
+    print('{0:<20s} | {1:>10s} | {2:>10s} | {3:>8s} | {4:>9s} |'.format(
+        'function', 'original', 'vectorized', 'speedup', 'max rdiff'))
+    print('-' * 79)
+
+    agree = []
+    ref, t_ref = timed(lambda: [tau1_loop(im) for im in images])
+    new, t_new = timed(_tau1, images)
+    agree.append(check('_tau1', new, ref, t_new, t_ref, results.rtol))
+
+    ref, t_ref = timed(lambda: [tau2_loop(im) for im in images])
+    new, t_new = timed(lambda: [_tau2(im) for im in images])
+    agree.append(check('_tau2', new, ref, t_new, t_ref, results.rtol))
+
+    ref, t_ref = timed(tau21_loop, images)
+    new, t_new = timed(tau21, images)
+    agree.append(check('tau21', new, ref, t_new, t_ref, results.rtol))
+
+    if not results.no_emd:
+        from metrics import _calculate_emd_1D, _calculate_emd_2D
+
+        d1, _ = synthetic_observations(results.nb_points, rng)
+        d2, _ = synthetic_observations(results.nb_points // 2, rng)
+        d2[::100, 1] = np.nan
+
+        # the first call of each fills the ground distance cache
+        _calculate_emd_2D(d1, d2[~np.isnan(d2).any(axis=1)])
+        _calculate_emd_1D(d1[:, 0], d2[:, 1])
+
+        ref, t_ref = timed(emd_2D_loop, d1, d2[~np.isnan(d2).any(axis=1)])
+        new, t_new = timed(_calculate_emd_2D, d1, d2[~np.isnan(d2).any(axis=1)])
+        agree.append(check('_calculate_emd_2D', new, ref, t_new, t_ref,
+                           results.rtol))
+
+        ref, t_ref = timed(emd_1D_loop, d1[:, :1], d2[:, 1:])
+        new, t_new = timed(_calculate_emd_1D, d1[:, 0], d2[:, 1])
+        agree.append(check('_calculate_emd_1D', new, ref, t_new, t_ref,
+                           results.rtol))
+
+    if not all(agree):
+        print('[ERROR] The vectorized functions do not match the originals')
+        sys.exit(1)
+    print('[INFO] All functions match the originals')
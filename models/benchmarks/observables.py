@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: observables.py
+description: timings of the observables in manifolds.py and the EMDs in
+    metrics.py on synthetic jets of realistic sparsity, saved as JSON and
+    compared against a baseline to catch slowdowns. Run from models/ as
+    `python -m benchmarks.observables`
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import json
+import os
+import platform
+import socket
+import sys
+import time
+
+import numpy as np
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Time the observable and metric functions, and optionally '
+        'fail if any is slower than in a baseline.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--output', '-o', action='store', type=str,
+                        help='Where to save the timings as JSON')
+    parser.add_argument('--compare', action='store', type=str,
+                        help='Baseline JSON from an earlier run to compare with')
+    parser.add_argument('--threshold', action='store', type=float, default=0.25,
+                        help='Fail if a case is this fraction slower than the '
+                        'baseline')
+    parser.add_argument('--nb-repeats', action='store', type=int, default=5,
+                        help='Timed repeats per case, the best one counts')
+    parser.add_argument('--nb-jobs', action='store', type=int, nargs='+',
+                        default=[1, 2, 4], help='tau21 nb_jobs to try')
+    parser.add_argument('--quick', action='store_true',
+                        help='Only the smallest size of every case')
+    parser.add_argument('--filter', action='store', type=str, default='',
+                        help='Only run cases whose name contains this')
+    parser.add_argument('--seed', action='store', type=int, default=0)
+    return parser
+
+
+def synthetic_images(nb_images, rng):
+    """
+    jet images in GeV made by pixelize.py from two-prong synthetic jets, so
+    they have about the sparsity and layout of the real ones
+    """
+    from benchmarks.pixelize import synthetic_jets
+    from pixelize import pixelize
+
+    return pixelize(*synthetic_jets(nb_images, rng)).astype(np.float64)
+
+
+def synthetic_observations(nb_points, rng):
+    """ (mass, tau21) pairs and labels, roughly shaped like the real ones """
+    signal = rng.randint(0, 2, nb_points)
+    mass = np.where(signal, rng.normal(80, 8, nb_points),
+                    rng.gamma(6, 12, nb_points))
+    tau21 = np.clip(np.where(signal, rng.normal(0.35, 0.1, nb_points),
+                             rng.normal(0.6, 0.12, nb_points)), 0, 1)
+    return np.stack([mass, tau21], axis=1), signal
+
+
+def make_cases(sizes, nb_jobs, rng, pattern=''):
+    """
+    list of (name, size, function of no arguments) of the cases whose
+    '<name>@<size>' contains pattern. Only the data and the modules those
+    cases need are made and imported.
+    """
+    def wanted(names, n):
+        return any(pattern in '{}@{}'.format(name, n) for name in names)
+
+    # seeded separately, so the data of a case doesn't depend on the others
+    image_seed, emd_seed = rng.randint(2 ** 31, size=2)
+
+    image_names = ['discrete_mass', 'discrete_pt']
+    tau_names = ['_tau1', '_tau2'] + ['tau21[nb_jobs={}]'.format(jobs)
+                                      for jobs in nb_jobs]
+    emd_names = ['_calculate_emd_1D', '_calculate_emd_2D',
+                 'calculate_metric[1D]', 'calculate_metric[2D]']
+    image_sizes = [n for n in sizes['images'] if wanted(image_names, n)]
+    tau_sizes = [n for n in sizes['tau21'] if wanted(tau_names, n)]
+    emd_sizes = [n for n in sizes['emd'] if wanted(emd_names, n)]
+
+    cases = []
+    if image_sizes or tau_sizes:
+        from manifolds import _tau1, _tau2, discrete_mass, discrete_pt, tau21
+
+        images = synthetic_images(max(image_sizes + tau_sizes),
+                                  np.random.RandomState(image_seed))
+    for n in image_sizes:
+        x = images[:n]
+        cases.append(('discrete_mass', n, lambda x=x: discrete_mass(x)))
+        cases.append(('discrete_pt', n, lambda x=x: discrete_pt(x)))
+
+    # the per-image functions, looped over images as tau21 does
+    for n in tau_sizes:
+        x = images[:n]
+        cases.append(('_tau1', n, lambda x=x: [_tau1(im) for im in x]))
+        cases.append(('_tau2', n, lambda x=x: [_tau2(im) for im in x]))
+        for jobs in nb_jobs:
+            cases.append(('tau21[nb_jobs={}]'.format(jobs), n,
+                          lambda x=x, jobs=jobs: tau21(x, nb_jobs=jobs)))
+
+    if emd_sizes:
+        from metrics import _calculate_emd_1D, _calculate_emd_2D, \
+            calculate_metric
+
+    emd_rng = np.random.RandomState(emd_seed)
+    for n in emd_sizes:
+        d1, s1 = synthetic_observations(n, emd_rng)
+        d2, s2 = synthetic_observations(n, emd_rng)
+        cases.append(('_calculate_emd_1D', n,
+                      lambda a=d1[:, 0], b=d2[:, 0]: _calculate_emd_1D(a, b)))
+        cases.append(('_calculate_emd_2D', n,
+                      lambda a=d1, b=d2: _calculate_emd_2D(a, b)))
+        cases.append(('calculate_metric[1D]', n,
+                      lambda a=d1[:, 0], b=d2[:, 0], s1=s1, s2=s2:
+                      calculate_metric(a, s1, b, s2, bins=40)))
+        cases.append(('calculate_metric[2D]', n,
+                      lambda a=d1, b=d2, s1=s1, s2=s2:
+                      calculate_metric(a, s1, b, s2)))
+    return [case for case in cases if wanted([case[0]], case[1])]
+
+
+def time_case(func, nb_repeats):
+    # one untimed call, for imports, caches and worker start-up
+    func()
+    times = []
+    for _ in range(nb_repeats):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times), float(np.median(times))
+
+
+def compare(current, baseline, threshold):
+    """ prints current against baseline, returns the names of slower cases """
+    slower = []
+    print('\n{0:<32s} | {1:>10s} | {2:>10s} | {3:>7s}'.format(
+        'case', 'baseline', 'current', 'ratio'))
+    print('-' * 68)
+    for name in sorted(current):
+        if name not in baseline:
+            continue
+        ratio = current[name]['best'] / baseline[name]['best']
+        flag = ''
+        if ratio > 1 + threshold:
+            slower.append(name)
+            flag = '  SLOWER'
+        print('{0:<32s} | {1:>9.4f}s | {2:>9.4f}s | {3:>6.2f}x{4}'.format(
+            name, baseline[name]['best'], current[name]['best'], ratio, flag))
+    return slower
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+    rng = np.random.RandomState(results.seed)
+
+    sizes = {'images': [1000, 10000, 100000], 'tau21': [50, 200],
+             'emd': [1000, 10000, 100000]}
+    if results.quick:
+        sizes = {k: v[:1] for k, v in sizes.items()}
+
+    timings = {}
+    print('{0:<32s} | {1:>10s} | {2:>10s}'.format('case', 'best', 'median'))
+    print('-' * 58)
+    for name, size, func in make_cases(sizes, results.nb_jobs, rng,
+                                       results.filter):
+        key = '{}@{}'.format(name, size)
+        best, median = time_case(func, results.nb_repeats)
+        timings[key] = {'best': best, 'median': median, 'size': size}
+        print('{0:<32s} | {1:>9.4f}s | {2:>9.4f}s'.format(key, best, median))
+
+    report = {
+        'host': socket.gethostname(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'nb_cpus': os.cpu_count() if hasattr(os, 'cpu_count') else None,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seed': results.seed,
+        'timings': timings,
+    }
+    if results.output:
+        with open(results.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print('[INFO] Saved to {}'.format(results.output))
+
+    if results.compare:
+        with open(results.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('host') != report['host']:
+            print('[WARN] Baseline is from {}, timings may not be '
+                  'comparable'.format(baseline.get('host')))
+        slower = compare(timings, baseline['timings'], results.threshold)
+        if slower:
+            print('[ERROR] {} case(s) more than {:.0%} slower than the '
+                  'baseline: {}'.format(len(slower), results.threshold,
+                                        ', '.join(slower)))
+            sys.exit(1)
+        print('[INFO] No case more than {:.0%} slower than the '
+              'baseline'.format(results.threshold))
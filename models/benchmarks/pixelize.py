@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: pixelize.py
+description: jets/sec of pixelize.pixelize against pixelizing one jet at a
+    time with np.histogram2d, on synthetic two-prong jets, checking that both
+    give the same images. Run from models/ as `python -m benchmarks.pixelize`
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import time
+
+import numpy as np
+
+from pixelize import EXTENT, NB_PIXELS, pixelize, wrap
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Time batched against per-jet pixelization.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--nb-jets', action='store', type=int, default=20000)
+    parser.add_argument('--nb-loop', action='store', type=int, default=2000,
+                        help='Number of jets to run the per-jet loop on')
+    return parser
+
+
+def synthetic_jets(nb_jets, rng):
+    """ two prongs of exponentially falling constituents around random axes """
+    counts = rng.randint(20, 80, nb_jets)
+    jet = np.repeat(np.arange(nb_jets), counts)
+    axis_eta, axis_phi = rng.uniform(-2, 2, nb_jets), rng.uniform(-np.pi, np.pi, nb_jets)
+    angle, dr = rng.uniform(0, 2 * np.pi, nb_jets), rng.uniform(0.4, 0.8, nb_jets)
+    prong = rng.uniform(size=jet.shape[0]) < 0.3
+    eta = axis_eta[jet] + prong * (dr * np.cos(angle))[jet] + rng.normal(0, 0.08, jet.shape)
+    phi = wrap(axis_phi[jet] + prong * (dr * np.sin(angle))[jet] + rng.normal(0, 0.08, jet.shape))
+    pt = rng.exponential(10, jet.shape[0])
+    return pt, eta, phi, counts
+
+
+def pixelize_loop(pt, eta, phi, counts, subjet_r=0.3):
+    """ the same preprocessing, one jet at a time """
+    edges = np.linspace(-EXTENT, EXTENT, NB_PIXELS + 1)
+    images, start = [], 0
+    for n in counts:
+        p, e, f = pt[start:start + n], eta[start:start + n], phi[start:start + n]
+        start += n
+
+        def axis(i):
+            de, df = e - e[i], wrap(f - f[i])
+            w = p * (de ** 2 + df ** 2 < subjet_r ** 2)
+            return e[i] + np.sum(w * de) / np.sum(w), f[i] + np.sum(w * df) / np.sum(w)
+
+        e1, f1 = axis(np.argmax(p))
+        x, y = e - e1, wrap(f - f1)
+        outside = p * (x ** 2 + y ** 2 >= subjet_r ** 2)
+        if outside.max() > 0:
+            e2, f2 = axis(np.argmax(outside))
+            a = -np.pi / 2 - np.arctan2(wrap(f2 - f1), e2 - e1)
+            x, y = x * np.cos(a) - y * np.sin(a), x * np.sin(a) + y * np.cos(a)
+        if np.sum(p[x < 0]) > np.sum(p[x > 0]):
+            x = -x
+
+        # rows go down in phi
+        image, _, _ = np.histogram2d(-y, x, bins=[edges, edges], weights=p)
+        images.append(image)
+    return np.array(images, dtype=np.float32)
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+
+    pt, eta, phi, counts = synthetic_jets(results.nb_jets,
+                                          np.random.RandomState(0))
+
+    start = time.time()
+    images = pixelize(pt, eta, phi, counts)
+    rate = results.nb_jets / (time.time() - start)
+
+    nb_loop = min(results.nb_loop, results.nb_jets)
+    nb_constituents = counts[:nb_loop].sum()
+    start = time.time()
+    reference = pixelize_loop(pt[:nb_constituents], eta[:nb_constituents],
+                              phi[:nb_constituents], counts[:nb_loop])
+    loop_rate = nb_loop / (time.time() - start)
+
+    # constituents on a pixel edge may land on either side, so compare pT
+    # per jet as well as pixel by pixel
+    print('batched:  {:10.0f} jets/sec'.format(rate))
+    print('per jet:  {:10.0f} jets/sec'.format(loop_rate))
+    print('speedup:  {:10.1f}x'.format(rate / loop_rate))
+    print('max abs pixel difference: {:.3g} GeV'.format(
+        np.abs(images[:nb_loop] - reference).max()))
+    print('jets with a different total: {}'.format(np.sum(~np.isclose(
+        images[:nb_loop].sum(axis=(1, 2)), reference.sum(axis=(1, 2))))))
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: runtime.py
+description: startup time and images/sec of a generator run through Keras
+    against the same weights run through runtime.NumpyGenerator. Run from
+    models/ as `python -m benchmarks.runtime`
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+MODELS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# time from a cold interpreter to the first generated image
+KERAS_STARTUP = '''
+import numpy as np
+import keras.backend as K
+K.set_image_dim_ordering('tf')
+from networks.{model} import generator
+g = generator({latent_size})
+g.load_weights('{weights}')
+g.predict([np.random.normal(0, 1, (1, {latent_size})), np.zeros((1, 1))])
+'''
+
+NUMPY_STARTUP = '''
+import numpy as np
+from runtime import NumpyGenerator
+g = NumpyGenerator.load('{npz}')
+g.predict(np.random.normal(0, 1, (1, g.latent_size)), np.zeros((1, 1)))
+'''
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Compare the Keras and NumPy generator runtimes.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('weights', action='store', type=str,
+                        help='HDF5 generator weights written by train.py')
+    parser.add_argument('npz', action='store', type=str,
+                        help='The same weights exported with '
+                        '`export.py --format npz`')
+    parser.add_argument('--model', '-m', action='store', type=str,
+                        default='lagan', help='Model architecture to use.',
+                        choices=['lagan', 'fcn'])
+    parser.add_argument('--latent-size', action='store', type=int, default=200,
+                        help='size of random N(0, 1) latent space to sample')
+    parser.add_argument('--nb-points', action='store', type=int, default=10000,
+                        help='Number of images to generate for throughput')
+    parser.add_argument('--batch-size', action='store', type=int, default=256,
+                        help='batch size to generate with')
+    parser.add_argument('--nb-repeats', action='store', type=int, default=3,
+                        help='Number of cold starts to average over')
+    return parser
+
+
+def startup_time(script, nb_repeats):
+    times = []
+    for _ in range(nb_repeats):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', script], cwd=MODELS_DIR)
+        times.append(time.time() - start)
+    return np.mean(times)
+
+
+def throughput(predict, noise, labels):
+    predict(noise[:1], labels[:1])  # warm up
+    start = time.time()
+    predict(noise, labels)
+    return noise.shape[0] / (time.time() - start)
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+    weights, npz = os.path.abspath(results.weights), os.path.abspath(results.npz)
+
+    keras_startup = startup_time(KERAS_STARTUP.format(
+        model=results.model, latent_size=results.latent_size, weights=weights
+    ), results.nb_repeats)
+    numpy_startup = startup_time(NUMPY_STARTUP.format(npz=npz),
+                                 results.nb_repeats)
+
+    import keras.backend as K
+
+    K.set_image_dim_ordering('tf')
+
+    from networks.registry import build_network
+    from runtime import NumpyGenerator
+
+    generator = build_network(results.model, 'generator', results.latent_size)
+    generator.load_weights(weights)
+    runtime = NumpyGenerator.load(npz)
+
+    noise = np.random.normal(0, 1, (results.nb_points, results.latent_size))
+    labels = np.random.randint(0, 2, (results.nb_points, 1))
+
+    keras_rate = throughput(lambda z, c: generator.predict(
+        [z, c], batch_size=results.batch_size, verbose=False), noise, labels)
+    numpy_rate = throughput(lambda z, c: runtime.predict(
+        z, c, batch_size=results.batch_size), noise, labels)
+
+    print('{0:<8s} | {1:>20s} | {2:>12s}'.format('runtime', 'startup (s)',
+                                                 'images/sec'))
+    print('-' * 46)
+    print('{0:<8s} | {1:>20.2f} | {2:>12.1f}'.format('keras', keras_startup,
+                                                     keras_rate))
+    print('{0:<8s} | {1:>20.2f} | {2:>12.1f}'.format('numpy', numpy_startup,
+                                                     numpy_rate))
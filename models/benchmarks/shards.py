@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: shards.py
+description: random batch read throughput of a monolithic HDF5 jet image
+    file against the same data converted by shards.py, with one and several
+    reader processes. Run from models/ as `python -m benchmarks.shards FILE`
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from shards import ShardedDataset, convert
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Compare random batch reads from a monolithic and a '
+        'sharded dataset.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('datafile', action='store', type=str,
+                        help='HDF5 file with image and signal datasets')
+    parser.add_argument('--batch-size', action='store', type=int, default=100)
+    parser.add_argument('--nb-batches', action='store', type=int, default=500,
+                        help='Number of random batches to read')
+    parser.add_argument('--compression', action='store', type=str,
+                        default='lzf', choices=['lzf', 'gzip', 'none'])
+    parser.add_argument('--nb-workers', action='store', type=int, default=4,
+                        help='Reader processes for the parallel case')
+    return parser
+
+
+def monolithic_rate(datafile, batches, batch_size):
+    start = time.time()
+    with h5py.File(datafile, 'r') as f:
+        for i in batches:
+            f['image'][i * batch_size:(i + 1) * batch_size]
+            f['signal'][i * batch_size:(i + 1) * batch_size]
+    return len(batches) * batch_size / (time.time() - start)
+
+
+def sharded_rate(dataset, batches, nb_workers):
+    start = time.time()
+    nb_rows = sum(b[0].shape[0] for b in
+                  dataset.iter_batches(batches, nb_workers=nb_workers))
+    return nb_rows / (time.time() - start)
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+
+    directory = os.path.join(tempfile.mkdtemp(), 'shards')
+    try:
+        convert(results.datafile, directory, batch_size=results.batch_size,
+                compression=results.compression)
+        dataset = ShardedDataset(directory)
+
+        # full batches only, so both layouts read the same rows
+        nb_full = len(dataset) // results.batch_size
+        batches = np.sort(np.random.choice(
+            nb_full, min(results.nb_batches, nb_full), replace=False))
+
+        with h5py.File(results.datafile, 'r') as f:
+            chunks = f['image'].chunks
+
+        print('{0:<28s} | {1:>12s}'.format('layout', 'images/sec'))
+        print('-' * 43)
+        print('{0:<28s} | {1:>12.0f}'.format(
+            'monolithic (chunks {})'.format(chunks),
+            monolithic_rate(results.datafile, batches, results.batch_size)))
+        print('{0:<28s} | {1:>12.0f}'.format(
+            'sharded', sharded_rate(dataset, batches, 0)))
+        print('{0:<28s} | {1:>12.0f}'.format(
+            'sharded, {} readers'.format(results.nb_workers),
+            sharded_rate(dataset, batches, results.nb_workers)))
+        dataset.close()
+    finally:
+        shutil.rmtree(os.path.dirname(directory))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: shuffle.py
+description: read throughput of batches from a memmapped image array in
+    file order, in sampling.BlockShuffleSampler order and in a full random
+    permutation. Run from models/ as `python -m benchmarks.shuffle`
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from sampling import BlockShuffleSampler
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Compare read throughput of epoch orders.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--nb-rows', action='store', type=int, default=400000,
+                        help='Number of 25x25 float32 images in the test file')
+    parser.add_argument('--batch-size', action='store', type=int, default=100,
+                        help='batch size per read')
+    parser.add_argument('--block-size', action='store', type=int, default=1024,
+                        help='Rows per block of the block shuffle')
+    parser.add_argument('--buffer-blocks', action='store', type=int, default=8,
+                        help='Blocks per buffer of the block shuffle')
+    parser.add_argument('--dir', action='store', type=str, default=None,
+                        help='Where to write the test file (on the disk to '
+                        'test). Defaults to the system temp dir')
+    return parser
+
+
+def evict(filepath):
+    """ drops the file from the page cache, where the OS lets us """
+    if hasattr(os, 'posix_fadvise'):
+        fd = os.open(filepath, os.O_RDONLY)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        os.close(fd)
+
+
+def read_rate(filepath, batches):
+    evict(filepath)
+    X = np.load(filepath, mmap_mode='r')
+    start = time.time()
+    nb_rows = 0
+    for rows in batches:
+        nb_rows += np.array(X[rows]).shape[0]
+    return nb_rows / (time.time() - start)
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+
+    directory = tempfile.mkdtemp(dir=results.dir)
+    filepath = os.path.join(directory, 'images.npy')
+    try:
+        X = np.lib.format.open_memmap(filepath, mode='w+', dtype=np.float32,
+                                      shape=(results.nb_rows, 25, 25))
+        for start in range(0, results.nb_rows, 10000):
+            X[start:start + 10000] = np.random.exponential(
+                1, X[start:start + 10000].shape)
+        X.flush()
+        del X
+
+        bs = results.batch_size
+        stop = results.nb_rows - results.nb_rows % bs
+        sequential = np.arange(results.nb_rows)
+        permutation = np.random.permutation(results.nb_rows)
+        sampler = BlockShuffleSampler(results.nb_rows, results.block_size,
+                                      results.buffer_blocks)
+
+        orders = [
+            ('sequential', (sequential[i:i + bs] for i in range(0, stop, bs))),
+            ('block shuffle', sampler.batches(0, bs)),
+            ('full permutation', (np.sort(permutation[i:i + bs])
+                                  for i in range(0, stop, bs))),
+        ]
+
+        print('{0:<18s} | {1:>12s}'.format('order', 'images/sec'))
+        print('-' * 33)
+        for name, batches in orders:
+            print('{0:<18s} | {1:>12.0f}'.format(name, read_rate(filepath,
+                                                                 batches)))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: sparse.py
+description: images/sec and peak memory of the dense lagan generator
+    against the top-k sparse generator of networks/sparse.py and, given
+    trained weights, the EMDs of mass, pT and tau21 of their samples to
+    real jets. Every generator runs in a fresh process so peak RSS is not
+    shared. Run from models/ as `python -m benchmarks.sparse`
+"""
+
+from __future__ import division, print_function
+
+import argparse
+from multiprocessing import Process, Queue
+import resource
+import time
+
+import numpy as np
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Compare sampling speed, memory and quality of the dense '
+        'and the sparse generator.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--lagan-weights', action='store', type=str,
+                        help='Trained lagan generator weights, or '
+                        '<store>:<epoch>. Without them only speed and memory '
+                        'are compared')
+    parser.add_argument('--sparse-weights', action='store', type=str,
+                        help='Trained sparse generator weights, or '
+                        '<store>:<epoch>')
+    parser.add_argument('--dataset', action='store', type=str,
+                        help='Real jets to compare samples with. Defaults to '
+                        'the Zenodo dataset')
+    parser.add_argument('--latent-size', action='store', type=int, default=200)
+    parser.add_argument('--batch-sizes', action='store', type=int, nargs='+',
+                        default=[100, 1000])
+    parser.add_argument('--nb-points', action='store', type=int, default=20000,
+                        help='Number of images to time generation over')
+    parser.add_argument('--nb-eval', action='store', type=int, default=10000,
+                        help='Number of real and generated jets to compare')
+    parser.add_argument('--nb-jobs', action='store', type=int, default=1,
+                        help='Number of processes to compute tau21 with')
+    return parser
+
+
+def _maxrss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def _measure(model, weights, results, queue):
+    import keras.backend as K
+
+    K.set_image_dim_ordering('tf')
+
+    from checkpoints import load_weights
+    from networks.registry import build_network
+
+    generator = build_network(model, 'generator', results.latent_size,
+                              cache=False)
+    if weights:
+        load_weights(generator, weights)
+
+    rng = np.random.RandomState(0)
+    noise = rng.normal(0, 1, (results.nb_points, results.latent_size))
+    labels = rng.randint(0, 2, (results.nb_points, 1))
+
+    timings = {}
+    for batch_size in results.batch_sizes:
+        # one untimed batch, for graph setup
+        generator.predict([noise[:batch_size], labels[:batch_size]],
+                          batch_size=batch_size)
+        baseline = _maxrss_mb()
+        start = time.time()
+        images = generator.predict([noise, labels], batch_size=batch_size)
+        timings[batch_size] = (results.nb_points / (time.time() - start),
+                               _maxrss_mb() - baseline)
+
+    # the sample to score, thresholded as in training
+    images = 100 * images[:results.nb_eval]
+    images[images < 1e-3] = 0
+    queue.put((timings, images, labels[:results.nb_eval].ravel()))
+
+
+def measure(model, weights, results):
+    queue = Queue()
+    p = Process(target=_measure, args=(model, weights, results, queue))
+    p.start()
+    out = queue.get()
+    p.join()
+    return out
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+
+    runs = {}
+    for model in ('lagan', 'sparse'):
+        runs[model] = measure(model, getattr(results, model + '_weights'),
+                              results)
+
+    print('{0:>10s} | {1:>8s} | {2:>12s} | {3:>14s} | {4:>11s}'.format(
+        'batch', 'model', 'images/sec', 'peak +RSS MB', 'lit pixels'))
+    print('-' * 67)
+    for batch_size in results.batch_sizes:
+        for model in ('lagan', 'sparse'):
+            timings, images, _ = runs[model]
+            rate, rss = timings[batch_size]
+            print('{0:>10d} | {1:>8s} | {2:>12.0f} | {3:>14.1f} | {4:>11.1f}'.format(
+                batch_size, model, rate, rss,
+                np.mean(np.sum(images > 0, axis=(1, 2, 3)))))
+
+    if not (results.lagan_weights or results.sparse_weights):
+        print('[INFO] No weights given, skipping the EMDs')
+    else:
+        from data import get_datafile
+        from evaluation import (OBSERVABLES, emd_scores, jet_observables,
+                                real_observables)
+
+        real, y_real = real_observables(get_datafile(results.dataset),
+                                        results.nb_eval,
+                                        nb_jobs=results.nb_jobs)
+
+        print('\n{0:<8s} | '.format('model') +
+              ' | '.join('{0:>8s}'.format(name) for name in OBSERVABLES))
+        print('-' * (11 + 11 * len(OBSERVABLES)))
+        for model in ('lagan', 'sparse'):
+            if not getattr(results, model + '_weights'):
+                continue
+            _, images, labels = runs[model]
+            scores = emd_scores(real, y_real,
+                                jet_observables(images, results.nb_jobs),
+                                labels)
+            print('{0:<8s} | '.format(model) + ' | '.join(
+                '{0:>8.4f}'.format(scores[name]) for name in OBSERVABLES))
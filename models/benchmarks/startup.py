@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: startup.py
+description: time to build, compile and take one training step with the
+    GAN of each architecture, from a cold interpreter, with and without the
+    architecture cache of networks/registry.py. Run from models/ as
+    `python -m benchmarks.startup`
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+MODELS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# prints the phases of one cold start as JSON
+STARTUP = '''
+import json
+import numpy as np
+from networks.registry import PhaseTimer
+timer = PhaseTimer()
+with timer.phase('import keras'):
+    import keras.backend as K
+K.set_image_dim_ordering('tf')
+from networks.gan import build_gan
+from networks.registry import builders
+g, d, c = build_gan(*builders('{model}', cache={cache}),
+                    latent_size={latent_size}, adam_lr=0.0002,
+                    adam_beta_1=0.5, timer=timer)
+with timer.phase('first step'):
+    noise = np.random.normal(0, 1, ({batch_size}, {latent_size}))
+    labels = np.random.randint(0, 2, ({batch_size}, 1))
+    images = g.predict([noise, labels])
+    d.train_on_batch(images, [np.zeros({batch_size}), labels.ravel()])
+    c.train_on_batch([noise, labels], [np.ones({batch_size}), labels.ravel()])
+print(json.dumps(timer.phases))
+'''
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Compare cold startup with and without cached '
+        'architectures.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--models', action='store', type=str, nargs='+',
+                        default=['lagan', 'fcn', 'hybrid', 'dcgan'])
+    parser.add_argument('--latent-size', action='store', type=int, default=200)
+    parser.add_argument('--batch-size', action='store', type=int, default=100)
+    parser.add_argument('--nb-repeats', action='store', type=int, default=3,
+                        help='Number of cold starts to average over')
+    return parser
+
+
+def cold_start(model, cache, latent_size, batch_size):
+    """ {phase: seconds} of one start in a fresh interpreter """
+    script = STARTUP.format(model=model, cache=cache, latent_size=latent_size,
+                            batch_size=batch_size)
+    with open(os.devnull, 'w') as devnull:
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         cwd=MODELS_DIR, stderr=devnull)
+    return dict(json.loads(output.decode('utf-8').strip().splitlines()[-1]))
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+
+    for model in results.models:
+        # fills the cache, so the cached starts below all hit it
+        cold_start(model, True, results.latent_size, results.batch_size)
+
+        runs = {}
+        for cache in (False, True):
+            starts = [cold_start(model, cache, results.latent_size,
+                                 results.batch_size)
+                      for _ in range(results.nb_repeats)]
+            runs[cache] = {phase: np.mean([s[phase] for s in starts])
+                           for phase in starts[0]}
+
+        print('\n{0:<28s} | {1:>9s} | {2:>9s}'.format(
+            '{} phase'.format(model), 'built', 'cached'))
+        print('-' * 52)
+        for phase in runs[False]:
+            print('{0:<28s} | {1:>8.2f}s | {2:>8.2f}s'.format(
+                phase, runs[False][phase], runs[True][phase]))
+        print('{0:<28s} | {1:>8.2f}s | {2:>8.2f}s'.format(
+            'total', sum(runs[False].values()), sum(runs[True].values())))
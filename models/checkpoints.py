@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: checkpoints.py
+description: a checkpoint store for the weights of one network over many
+    epochs: a full keyframe every few epochs and, in between, the XOR of
+    each epoch's weights with the previous one, byte-shuffled and zlib
+    compressed. Any epoch can be restored, into a model or as a Keras HDF5
+    weight file.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import glob
+import json
+import os
+import time
+import zlib
+
+import h5py
+import numpy as np
+
+INDEX_FILE = 'index.json'
+
+# '<store directory>:<epoch>' refers to one epoch of a store, anywhere a path
+# to HDF5 weights is accepted by load_weights
+SEPARATOR = ':'
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Convert, inspect and export delta-compressed checkpoint '
+        'stores.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    convert = subparsers.add_parser(
+        'convert', help='Pack the per-epoch HDF5 files of a prefix into a store')
+    convert.add_argument('prefix', action='store', type=str,
+                         help='e.g. params_generator_epoch_')
+    convert.add_argument('store', action='store', type=str)
+    convert.add_argument('--keyframe-every', action='store', type=int,
+                         default=10)
+
+    report = subparsers.add_parser(
+        'report', help='Storage per epoch and restore latency of a store')
+    report.add_argument('store', action='store', type=str)
+
+    export = subparsers.add_parser(
+        'export', help='Write one epoch as a Keras HDF5 weight file')
+    export.add_argument('store', action='store', type=str)
+    export.add_argument('epoch', action='store', type=int)
+    export.add_argument('output', action='store', type=str)
+    return parser
+
+
+def _shuffle(buf, itemsize):
+    """ groups the k-th bytes of every item, which zlib compresses better """
+    return buf.reshape(-1, itemsize).T.ravel()
+
+
+def _unshuffle(buf, itemsize):
+    return buf.reshape(itemsize, -1).T.ravel()
+
+
+def model_layers(model):
+    """
+    [(layer name, [(weight name, value), ...]), ...] of a Keras model, named and
+    ordered as Model.save_weights does
+    """
+    import keras.backend as K
+
+    layers = []
+    for layer in model.layers:
+        values = K.batch_get_value(layer.weights)
+        names = [str(w.name) if getattr(w, 'name', None) else 'param_{}'.format(i)
+                 for i, w in enumerate(layer.weights)]
+        layers.append((layer.name, list(zip(names, values))))
+    return layers
+
+
+def _decode(x):
+    return x.decode('utf8') if isinstance(x, bytes) else str(x)
+
+
+def read_hdf5_layers(filepath):
+    """ the same structure as model_layers, from a Keras HDF5 weight file """
+    with h5py.File(filepath, 'r') as f:
+        layers = []
+        for layer in f.attrs['layer_names']:
+            g = f[_decode(layer)]
+            names = [_decode(n) for n in g.attrs['weight_names']]
+            layers.append((_decode(layer), [(n, g[n][:]) for n in names]))
+    return layers
+
+
+def write_hdf5_layers(layers, filepath):
+    """ writes the structure of model_layers as Keras HDF5 weights """
+    with h5py.File(filepath, 'w') as f:
+        f.attrs['layer_names'] = [name.encode('utf8') for name, _ in layers]
+        for layer, weights in layers:
+            g = f.create_group(layer)
+            g.attrs['weight_names'] = [n.encode('utf8') for n, _ in weights]
+            for name, value in weights:
+                g.create_dataset(name, data=value)
+
+
+def _shapes(structure):
+    """ [shape, dtype] of each weight, of the layers of structure with any """
+    return [[[shape, dtype] for _, shape, dtype in weights]
+            for _, weights in structure if weights]
+
+
+class CheckpointStore(object):
+
+    """
+    Weights of one network for any number of epochs, in a directory. An epoch
+    is either a keyframe (all weights) or a delta against the epoch saved
+    before it, and there is a keyframe at least every keyframe_every epochs,
+    so restoring reads at most that many files.
+
+    The float32 weights of neighbouring epochs share sign, exponent and the
+    top of the mantissa, so their XOR is mostly zero bytes; byte-shuffling
+    puts those together before zlib.
+    """
+
+    def __init__(self, directory, keyframe_every=10, level=1):
+        self.directory = directory
+        self.level = level
+        path = os.path.join(directory, INDEX_FILE)
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {'keyframe_every': keyframe_every, 'layers': None,
+                          'epochs': {}}
+        # the last epoch saved or restored, to delta against / restore from
+        self._last = None
+
+    @property
+    def epochs(self):
+        return sorted(int(e) for e in self.index['epochs'])
+
+    @property
+    def nbytes(self):
+        """ bytes on disk """
+        return sum(e['nbytes'] for e in self.index['epochs'].values())
+
+    @property
+    def raw_nbytes(self):
+        """ bytes of one epoch's weights, uncompressed """
+        return sum(int(np.prod(shape)) * np.dtype(dtype).itemsize
+                   for _, weights in self.index['layers']
+                   for _, shape, dtype in weights)
+
+    def _flatten(self, layers):
+        # as it reads back from the JSON index
+        structure = [[layer, [[name, list(np.shape(v)), np.asarray(v).dtype.str]
+                              for name, v in weights]]
+                     for layer, weights in layers]
+        if self.index['layers'] is None:
+            self.index['layers'] = structure
+        elif _shapes(structure) != _shapes(self.index['layers']):
+            # names are not compared, they can differ between processes
+            raise ValueError('Weights do not match the layers of this store')
+
+        return np.concatenate([
+            _shuffle(np.ascontiguousarray(v).view(np.uint8),
+                     np.asarray(v).dtype.itemsize)
+            for _, weights in layers for _, v in weights
+        ] or [np.zeros(0, np.uint8)])
+
+    def _unflatten(self, buf):
+        layers, offset = [], 0
+        for layer, weights in self.index['layers']:
+            values = []
+            for name, shape, dtype in weights:
+                dtype = np.dtype(dtype)
+                size = int(np.prod(shape)) * dtype.itemsize
+                chunk = _unshuffle(buf[offset:offset + size], dtype.itemsize)
+                values.append((name, chunk.view(dtype).reshape(shape).copy()))
+                offset += size
+            layers.append((layer, values))
+        return layers
+
+    def save_layers(self, epoch, layers):
+        """ adds epoch, given weights structured as model_layers returns them """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        buf = self._flatten(layers)
+        saved = self.epochs
+        previous = saved[-1] if saved else None
+        if previous is not None and previous >= epoch:
+            raise ValueError('Epochs must be saved in order: {} after {}'.format(
+                epoch, previous))
+
+        since_keyframe = 0
+        if previous is not None:
+            e = previous
+            while self.index['epochs'][str(e)]['base'] is not None:
+                since_keyframe += 1
+                e = self.index['epochs'][str(e)]['base']
+
+        if previous is None or since_keyframe + 1 >= self.index['keyframe_every']:
+            base, payload = None, buf
+        else:
+            if self._last is None or self._last[0] != previous:
+                self._last = (previous, self._restore_buffer(previous))
+            base, payload = previous, np.bitwise_xor(buf, self._last[1])
+
+        data = zlib.compress(payload.tobytes(), self.level)
+        filename = '{:05d}.z'.format(epoch)
+        with open(os.path.join(self.directory, filename), 'wb') as f:
+            f.write(data)
+
+        self.index['epochs'][str(epoch)] = {'file': filename, 'base': base,
+                                            'nbytes': len(data)}
+        self._last = (epoch, buf)
+        # the index is written last, so a crash never leaves it pointing at
+        # a missing file
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.rename(path + '.tmp', path)
+
+    def save(self, epoch, model):
+        self.save_layers(epoch, model_layers(model))
+
+    def _read(self, epoch):
+        entry = self.index['epochs'][str(epoch)]
+        with open(os.path.join(self.directory, entry['file']), 'rb') as f:
+            return entry['base'], np.frombuffer(zlib.decompress(f.read()),
+                                                dtype=np.uint8)
+
+    def _restore_buffer(self, epoch):
+        if self._last is not None and self._last[0] == epoch:
+            return self._last[1]
+        if str(epoch) not in self.index['epochs']:
+            raise KeyError('Epoch {} is not in {}'.format(epoch, self.directory))
+
+        # walk back to the keyframe, then apply the deltas forwards
+        chain = []
+        while epoch is not None:
+            base, payload = self._read(epoch)
+            chain.append(payload)
+            epoch = base
+        buf = chain.pop().copy()
+        while chain:
+            np.bitwise_xor(buf, chain.pop(), out=buf)
+        return buf
+
+    def load_layers(self, epoch):
+        buf = self._restore_buffer(epoch)
+        self._last = (epoch, buf)
+        return self._unflatten(buf)
+
+    def load_weights(self, model, epoch):
+        """
+        model.load_weights for one epoch of the store. As there, layers are
+        paired by their order among the layers that have weights, not by
+        name, since Keras numbers unnamed layers differently from one
+        process to the next.
+        """
+        import keras.backend as K
+
+        layers = [layer for layer in model.layers if layer.weights]
+        stored = [(name, weights) for name, weights in self.load_layers(epoch)
+                  if weights]
+        if len(layers) != len(stored):
+            raise ValueError('The model has {} layers with weights, the store '
+                             'has {}'.format(len(layers), len(stored)))
+
+        pairs = []
+        for layer, (name, weights) in zip(layers, stored):
+            values = [v for _, v in weights]
+            if len(values) != len(layer.weights):
+                raise ValueError('Layer {} has {} weights, its layer {} in the '
+                                 'store has {}'.format(
+                                     layer.name, len(layer.weights), name,
+                                     len(values)))
+            for w, v in zip(layer.weights, values):
+                if K.int_shape(w) != v.shape:
+                    raise ValueError('Layer {} has a weight of shape {}, its '
+                                     'layer {} in the store has {}'.format(
+                                         layer.name, K.int_shape(w), name,
+                                         v.shape))
+            pairs += list(zip(layer.weights, values))
+        K.batch_set_value(pairs)
+
+    def export(self, epoch, filepath):
+        """ writes one epoch as a Keras HDF5 weight file """
+        write_hdf5_layers(self.load_layers(epoch), filepath)
+
+
+def checkpoint_path(store, epoch):
+    """ how to refer to an epoch of a store in place of an HDF5 file """
+    return '{}{}{:03d}'.format(store, SEPARATOR, epoch)
+
+
+def load_weights(model, filepath):
+    """
+    model.load_weights that also accepts '<store>:<epoch>' for an epoch of a
+    CheckpointStore
+    """
+    store, _, epoch = filepath.rpartition(SEPARATOR)
+    if store and os.path.isfile(os.path.join(store, INDEX_FILE)):
+        CheckpointStore(store).load_weights(model, int(epoch))
+    else:
+        model.load_weights(filepath)
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+
+    if results.command == 'convert':
+        files = sorted(glob.glob('{}[0-9][0-9][0-9].hdf5'.format(results.prefix)))
+        if not files:
+            raise IOError('No files match {}NNN.hdf5'.format(results.prefix))
+        store = CheckpointStore(results.store, results.keyframe_every)
+        hdf5_bytes = 0
+        for filepath in files:
+            epoch = int(filepath[len(results.prefix):-len('.hdf5')])
+            store.save_layers(epoch, read_hdf5_layers(filepath))
+            hdf5_bytes += os.path.getsize(filepath)
+        print('[INFO] {} epochs: {:.1f} MB of HDF5 => {:.1f} MB'.format(
+            len(files), hdf5_bytes / 1e6, store.nbytes / 1e6))
+
+    elif results.command == 'export':
+        CheckpointStore(results.store).export(results.epoch, results.output)
+        print('[INFO] Saved to {}'.format(results.output))
+
+    else:
+        store = CheckpointStore(results.store)
+        print('{0:>5s} | {1:>5s} | {2:>10s} | {3:>7s} | {4:>11s}'.format(
+            'epoch', 'kind', 'size (kB)', 'ratio', 'restore (ms)'))
+        print('-' * 51)
+        for epoch in store.epochs:
+            entry = store.index['epochs'][str(epoch)]
+            # cold restore: nothing kept from the epoch before
+            store._last = None
+            start = time.time()
+            store.load_layers(epoch)
+            latency = time.time() - start
+            print('{0:>5d} | {1:>5s} | {2:>10.1f} | {3:>6.1f}x | {4:>11.1f}'.format(
+                epoch, 'key' if entry['base'] is None else 'delta',
+                entry['nbytes'] / 1e3, store.raw_nbytes / entry['nbytes'],
+                1000 * latency))
+        print('[INFO] {} epochs in {:.1f} MB, {:.1f} MB uncompressed ({:.1f}x)'.format(
+            len(store.epochs), store.nbytes / 1e6,
+            len(store.epochs) * store.raw_nbytes / 1e6,
+            len(store.epochs) * store.raw_nbytes / max(store.nbytes, 1)))
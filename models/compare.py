@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: compare.py
+description: trains several architectures side by side on one node and
+    compares them. The training split is sampled and preprocessed once into
+    shared memory and memory-mapped by every train.py process, the real jet
+    observables are computed once for all evaluations, and throughput and
+    the EMDs of mass, pT and tau21 of each architecture go into one report
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import time
+
+import numpy as np
+
+from networks.registry import MODELS
+from sweep import BackgroundEvaluator, Run, rss_mb
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Train architectures concurrently on one shared copy of '
+        'the data and compare their speed and physics metrics. Options not '
+        'listed here are passed on to every train.py.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--models', action='store', type=str, nargs='+',
+                        default=['lagan', 'fcn', 'hybrid', 'dcgan'],
+                        choices=MODELS)
+    parser.add_argument('--nb-epochs', action='store', type=int, default=50,
+                        help='Number of epochs to train each model for.')
+    parser.add_argument('--dataset', action='store', type=str,
+                        help='HDF5 or Numpy file, or a directory written by '
+                        'shards.py. Defaults to the Zenodo dataset')
+    parser.add_argument('--nb-points', action='store', type=int, default=90000,
+                        help='Number of jets to train and test on')
+    parser.add_argument('--balance', action='store_true',
+                        help='Sample as many signal as background jets')
+    parser.add_argument('--seed', action='store', type=int, default=0,
+                        help='Seed of the split, and of every run')
+    parser.add_argument('--output-dir', action='store', type=str,
+                        default='compare', help='Directory for runs and the '
+                        'report')
+    parser.add_argument('--shm-dir', action='store', type=str,
+                        default='/dev/shm',
+                        help='Where to put the shared preprocessed split; a '
+                        'tmpfs, so it is in memory once for all runs')
+    parser.add_argument('--keep-shm', action='store_true',
+                        help='Leave the shared split in place for later runs')
+
+    parser.add_argument('--threads-per-run', action='store', type=int,
+                        help='Thread budget of each run. Defaults to an even '
+                        'share of the cores')
+    parser.add_argument('--memory-per-run', action='store', type=float,
+                        default=8000, help='Resident memory budget of each '
+                        'run in MB. Runs over budget are killed')
+
+    parser.add_argument('--eval-every', action='store', type=int, default=5,
+                        help='Evaluate every this many epochs, and after the '
+                        'last')
+    parser.add_argument('--nb-eval', action='store', type=int, default=2000,
+                        help='Number of real and generated jets to compare')
+    parser.add_argument('--nb-jobs', action='store', type=int, default=1,
+                        help='Number of processes to compute tau21 with')
+    parser.add_argument('--poll', action='store', type=float, default=10,
+                        help='Seconds between checks on the runs')
+    return parser
+
+
+def get_train_parser():
+    """ the train.py options that compare.py has to know to evaluate runs """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--model', '-m', action='store', type=str)
+    parser.add_argument('--latent-size', action='store', type=int)
+    parser.add_argument('--checkpoint-store', action='store_true')
+    return parser
+
+
+def shared_split(datafile, nb_points, balance, seed, shm_dir):
+    """
+    Directory in shm_dir with the preprocessed split for these settings,
+    written by data.save_preprocessed unless an earlier comparison left it
+    """
+    from data import save_preprocessed
+
+    key = hashlib.md5('{}:{}:{}:{}:{}:{}'.format(
+        os.path.abspath(datafile), os.path.getsize(datafile),
+        os.path.getmtime(datafile), nb_points, balance, seed
+    ).encode('utf-8')).hexdigest()
+    directory = os.path.join(shm_dir, 'lagan-compare-{}'.format(key))
+
+    if not os.path.isfile(os.path.join(directory, 'meta.json')):
+        save_preprocessed(directory, datafile, nb_points, balance, seed)
+    return directory
+
+
+def epoch_times(run):
+    """
+    Wall time of each finished epoch of run, from the times its
+    discriminator checkpoints were written, and the time before the first
+    epoch started (startup)
+    """
+    files = sorted(glob.glob('{}[0-9][0-9][0-9].hdf5'.format(
+        run.prefix('discriminator'))))
+    written = [run.started] + [os.path.getmtime(f) for f in files]
+    times = np.diff(written)
+    if times.shape[0] < 2:
+        return times, None
+    # the first epoch also holds startup; take a typical epoch off it
+    typical = np.median(times[1:])
+    return times[1:], max(times[0] - typical, 0)
+
+
+def throughput(run, nb_train):
+    times, startup = epoch_times(run)
+    if times.shape[0] == 0:
+        return {}
+    return {'epochs': int(times.shape[0]) + (startup is not None),
+            'epoch_time': float(np.median(times)),
+            'images_per_sec': nb_train / float(np.median(times)),
+            'startup': startup}
+
+
+def report(runs, nb_train):
+    rows = []
+    for run in runs:
+        epoch, scores = run.best()
+        rows.append(dict(model=run.params['model'], status=run.status,
+                         directory=run.directory, best_epoch=epoch,
+                         scores={e: run.scores[e] for e in sorted(run.scores)},
+                         **dict(throughput(run, nb_train), **(scores or {}))))
+    return sorted(rows, key=lambda r: r.get('score', np.inf))
+
+
+def print_report(rows):
+    print('{0:<8s} | {1:<13s} | {2:>6s} | {3:>10s} | {4:>8s} | {5:>5s} | '
+          '{6:>8s} | {7:>8s} | {8:>8s} | {9:>8s}'.format(
+              'model', 'status', 'epochs', 'images/sec', 'startup', 'best',
+              'score', 'mass', 'pt', 'tau21'))
+    print('-' * 104)
+    for row in rows:
+        startup = row.get('startup')
+        print('{0:<8s} | {1:<13s} | {2:>6s} | {3:>10.1f} | {4:>8s} | {5:>5s} | '
+              '{6:>8.4f} | {7:>8.4f} | {8:>8.4f} | {9:>8.4f}'.format(
+                  row['model'], row['status'], str(row.get('epochs', 0)),
+                  row.get('images_per_sec', np.nan),
+                  '-' if startup is None else '{:.1f}s'.format(startup),
+                  str(row['best_epoch']),
+                  *[row.get(k, np.nan) for k in ('score', 'mass', 'pt', 'tau21')]))
+
+
+if __name__ == '__main__':
+
+    parser = get_parser()
+    results, passthrough = parser.parse_known_args()
+    train_options, passthrough = get_train_parser().parse_known_args(
+        passthrough)
+    if train_options.model is not None:
+        parser.error('Choose the architectures with --models')
+    if train_options.checkpoint_store:
+        parser.error('Runs are timed and evaluated from their per-epoch HDF5 '
+                     'checkpoints, which --checkpoint-store does not write')
+    # params of every run, so its generator can be rebuilt for evaluation
+    params = {}
+    if train_options.latent_size is not None:
+        params['latent-size'] = str(train_options.latent_size)
+
+    # before get_datafile, which can import Keras
+    evaluator = BackgroundEvaluator(nb_jobs=results.nb_jobs)
+
+    from data import get_datafile
+    from evaluation import real_observables
+
+    datafile = get_datafile(results.dataset)
+
+    print('[INFO] Preparing the shared split in {}'.format(results.shm_dir))
+    split_dir = shared_split(datafile, results.nb_points, results.balance,
+                             results.seed, results.shm_dir)
+    with open(os.path.join(split_dir, 'meta.json')) as f:
+        nb_train = json.load(f)['nb_train']
+
+    # once here, rather than in every run; real_observables also caches them
+    # on disk for later comparisons
+    print('[INFO] Computing real data observables')
+    evaluator.start(*real_observables(datafile, results.nb_eval,
+                                      nb_jobs=results.nb_jobs))
+
+    nb_threads = results.threads_per_run or max(
+        multiprocessing.cpu_count() // len(results.models), 1)
+    train_args = ['--nb-epochs', str(results.nb_epochs),
+                  '--preprocessed', split_dir,
+                  '--seed', str(results.seed)] + passthrough
+
+    eval_epochs = sorted(set(
+        list(range(results.eval_every, results.nb_epochs + 1,
+                   max(results.eval_every, 1))) + [results.nb_epochs]))
+
+    if not os.path.isdir(results.output_dir):
+        os.makedirs(results.output_dir)
+
+    runs = []
+    for i, model in enumerate(results.models):
+        run = Run(i, dict(params, model=model), results.output_dir)
+        print('[INFO] Starting {} ({} threads)'.format(model, nb_threads))
+        run.start(train_args, nb_threads)
+        runs.append(run)
+
+    def unscored(run):
+        """ epochs of run with a complete checkpoint but no scores yet """
+        # the discriminator is saved after the generator, so its file
+        # existing means the generator checkpoint is complete
+        return [epoch for epoch in eval_epochs if epoch not in run.scores and
+                os.path.isfile(run.checkpoint(epoch, 'discriminator'))]
+
+    # runs that are training, or whose last checkpoints are being evaluated
+    active = list(runs)
+    try:
+        while active:
+            for run in list(active):
+                # check before looking for checkpoints, so none of a finished
+                # run is missed
+                returncode = run.process.poll()
+
+                for epoch in unscored(run):
+                    evaluator.submit(run, epoch)
+
+                failed = False
+                for epoch in eval_epochs:
+                    if epoch in run.scores:
+                        continue
+                    try:
+                        scores = evaluator.result(run, epoch)
+                    except Exception as e:
+                        print('[WARN] Could not evaluate {} after epoch {}: '
+                              '{}'.format(run.params['model'], epoch, e))
+                        failed = True
+                        break
+                    if scores is None:
+                        break
+                    run.scores[epoch] = scores
+                    print('[INFO] {} after epoch {}: score {:.4f}'.format(
+                        run.params['model'], epoch, scores['score']))
+
+                if failed:
+                    if run.status == 'running':
+                        run.stop('failed')
+                    else:
+                        run.status = 'failed'
+                    evaluator.discard(run)
+                elif run.status == 'running':
+                    if rss_mb(run.process.pid) > results.memory_per_run:
+                        print('[WARN] {} is over its memory budget'.format(
+                            run.params['model']))
+                        run.stop('out of memory')
+                    elif returncode is not None:
+                        run.stop('finished' if returncode == 0 else 'failed')
+
+                if run.status != 'running' and (failed or not unscored(run)):
+                    active.remove(run)
+
+            with open(os.path.join(results.output_dir, 'report.json'), 'w') as f:
+                json.dump(report(runs, nb_train), f, indent=2)
+            if active:
+                time.sleep(results.poll)
+    finally:
+        for run in active:
+            if run.status == 'running':
+                run.stop('interrupted')
+        evaluator.close()
+        if not results.keep_shm:
+            shutil.rmtree(split_dir, ignore_errors=True)
+
+    rows = report(runs, nb_train)
+    with open(os.path.join(results.output_dir, 'report.json'), 'w') as f:
+        json.dump(rows, f, indent=2)
+    print_report(rows)
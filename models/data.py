@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: data.py
+description: locating and loading the jet image dataset for [arXiv/1701.05927]
+"""
+
+from __future__ import print_function
+
+from collections import defaultdict
+import json
+import os
+import tempfile
+from six.moves import range
+
+from h5py import File as HDF5File
+import numpy as np
+
+from shards import ShardedDataset, is_sharded
+
+# Info for downloading the dataset from Zenodo
+MD5_HASH = 'f9b11c46b6a0ff928bec2eccf865ecf0'
+DATAFILE = 'jet-images_Mass60-100_pT250-300_R1.25_Pix25.hdf5'
+URL_TEMPLATE = 'https://zenodo.org/record/{record}/files/{filename}'
+
+
+def get_datafile(datafile=None):
+    """
+    Returns datafile if it exists (a file, or a directory written by
+    shards.py), and otherwise the path to the Zenodo
+    dataset [10.5281/zenodo.268592] in the Keras cache, downloading it first
+    if it isn't there yet
+    """
+    if (datafile is not None) and (os.path.isfile(datafile) or
+                                   is_sharded(datafile)):
+        return datafile
+
+    from keras.utils.data_utils import get_file
+
+    print('[WARN] File not found or not specified. Downloading from '
+          'Zenodo. (Or, falling back to cache if present)')
+
+    print('[INFO] MD5 verification: {}'.format(MD5_HASH))
+
+    return get_file(
+        fname='lagan-jet-images.hdf5',
+        origin=URL_TEMPLATE.format(record=269622, filename=DATAFILE),
+        md5_hash=MD5_HASH
+    )
+
+
+def load_data(datafile, nb_points, return_rows=False):
+    """
+    Reads a random subset of nb_points jets from datafile.
+
+    Returns:
+    --------
+        X: (nb_points, 25, 25) images in GeV, with unphysical values removed
+        y: (nb_points, ) signal labels
+        rows: (nb_points, ) row of each jet in datafile, if return_rows
+    """
+    # You can pass in either HDF5 files or Numpy binary files - we default to
+    # HDF5, but can fallback to numpy. Sharded datasets are sampled by whole
+    # batches, so each read is one chunk
+    if is_sharded(datafile):
+        dataset = ShardedDataset(datafile)
+        X, y, ix = dataset.sample(nb_points, return_rows=True)
+        dataset.close()
+
+    else:
+        try:
+            d = HDF5File(datafile, 'r')
+
+            X, y = d['image'][:], d['signal'][:]
+
+            ix = list(range(X.shape[0]))
+            np.random.shuffle(ix)
+            ix = ix[:nb_points]
+
+            X, y = X[ix], y[ix]
+
+        except IOError:
+            print('[WARN] Failure to read as HDF5, falling back to numpy')
+
+            d = np.load(datafile, mmap_mode='r')
+            ix = list(range(d.shape[0]))
+            np.random.shuffle(ix)
+            ix = ix[:nb_points]
+            d = np.array(d[ix])
+
+            X, y = d['image'], d['signal']
+
+    # remove unphysical values
+    X[X < 1e-3] = 0
+
+    if return_rows:
+        return X, y, np.asarray(ix)
+    return X, y
+
+
+def _open(datafile):
+    """
+    (nb_rows, read, take, close) for an HDF5 file, a sharded dataset or a
+    numpy file, where read(start, stop, datasets) returns the arrays of rows
+    [start, stop) of each named dataset, and take(rows, datasets) those of
+    increasing, distinct rows
+    """
+    if is_sharded(datafile):
+        dataset = ShardedDataset(datafile)
+        return len(dataset), dataset.read, dataset.take, dataset.close
+
+    try:
+        f = HDF5File(datafile, 'r')
+        # a sorted index array is one HDF5 selection, so HDF5 merges the
+        # reads of nearby rows and skips the rest
+        read = lambda start, stop, datasets=('image', 'signal'): tuple(
+            f[name][start:stop] for name in datasets)
+        take = lambda rows, datasets=('image', 'signal'): tuple(
+            f[name][rows] for name in datasets)
+        return f['signal'].shape[0], read, take, f.close
+
+    except IOError:
+        d = np.load(datafile, mmap_mode='r')
+        read = lambda start, stop, datasets=('image', 'signal'): tuple(
+            np.array(d[start:stop][name]) for name in datasets)
+        take = lambda rows, datasets=('image', 'signal'): tuple(
+            np.array(d[rows][name]) for name in datasets)
+        return d.shape[0], read, take, lambda: None
+
+
+def _class_index_file(datafile):
+    if is_sharded(datafile):
+        return os.path.join(datafile, 'classes.npz'), os.path.join(
+            datafile, 'index.json')
+    return datafile + '.classes.npz', datafile
+
+
+def class_index(datafile, chunk_size=1000000, cache=True):
+    """
+    The rows of each class of datafile, from its signal column alone, read a
+    chunk at a time. The index is cached next to datafile (as
+    <datafile>.classes.npz, or classes.npz in a sharded dataset) and rebuilt
+    if datafile changes.
+
+    Returns:
+    --------
+        index: {label: increasing array of rows}, as uint32 where that fits
+    """
+    cachefile, stampfile = _class_index_file(datafile)
+    stamp = [os.path.getsize(stampfile), int(os.path.getmtime(stampfile))]
+
+    if cache and os.path.isfile(cachefile):
+        try:
+            with np.load(cachefile) as f:
+                if f['stamp'].tolist() == stamp:
+                    return {int(c): f['class_{}'.format(c)]
+                            for c in f['classes']}
+        except Exception as e:
+            # rebuilt and written over below
+            print('[WARN] Could not read the class index in {}: {}'.format(
+                cachefile, e))
+
+    nb_rows, read, _, close = _open(datafile)
+    dtype = np.uint32 if nb_rows < 2 ** 32 else np.int64
+    rows = defaultdict(list)
+    try:
+        for start in range(0, nb_rows, chunk_size):
+            labels, = read(start, min(start + chunk_size, nb_rows), ('signal', ))
+            labels = np.asarray(labels).ravel()
+            for c in np.unique(labels):
+                rows[int(c)].append(
+                    (start + np.flatnonzero(labels == c)).astype(dtype))
+    finally:
+        close()
+    index = {c: np.concatenate(r) for c, r in rows.items()}
+
+    if cache:
+        try:
+            # a temporary file of its own, as runs started together on one
+            # datafile all build the index
+            fd, tmpfile = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(cachefile)), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, stamp=stamp, classes=sorted(index), **{
+                    'class_{}'.format(c): r for c, r in index.items()})
+            os.rename(tmpfile, cachefile)
+        except (IOError, OSError):
+            print('[WARN] Could not cache the class index in {}'.format(
+                cachefile))
+    return index
+
+
+def stratified_rows(index, nb_points, test_fraction=0.1, balance=False,
+                    seed=None):
+    """
+    Draws nb_points rows without replacement, with each class in the
+    proportion it has in index (or in equal numbers if balance), and splits
+    every class between train and test in the same ratio.
+
+    Args:
+    -----
+        index: as returned by class_index
+        nb_points: total number of train and test rows
+        test_fraction: fraction of each class that goes to test
+        balance: draw as many rows of every class
+        seed: for the draw and the order
+
+    Returns:
+    --------
+        rows_train, rows_test: in random order
+    """
+    rng = np.random.RandomState(seed)
+    classes = sorted(index)
+    sizes = np.array([len(index[c]) for c in classes])
+    nb_points = min(nb_points, sizes.sum())
+
+    if balance:
+        wanted = np.full(len(classes), nb_points // len(classes), dtype=int)
+        wanted[:nb_points % len(classes)] += 1
+        short = [c for c, n, size in zip(classes, wanted, sizes) if n > size]
+        if short:
+            raise ValueError('Not enough jets of class {} for {} balanced '
+                             'points'.format(short[0], nb_points))
+    else:
+        # largest remainders, so the counts add up to nb_points
+        quota = nb_points * sizes / float(sizes.sum())
+        wanted = np.floor(quota).astype(int)
+        wanted[np.argsort(wanted - quota)[:nb_points - wanted.sum()]] += 1
+
+    train, test = [], []
+    for c, n in zip(classes, wanted):
+        picked = index[c][rng.choice(len(index[c]), n, replace=False)]
+        nb_test = int(round(n * test_fraction))
+        test.append(picked[:nb_test])
+        train.append(picked[nb_test:])
+
+    train, test = np.concatenate(train), np.concatenate(test)
+    return (train[rng.permutation(len(train))].astype(np.int64),
+            test[rng.permutation(len(test))].astype(np.int64))
+
+
+def load_split(datafile, nb_points, test_fraction=0.1, balance=False,
+               seed=None, return_rows=False):
+    """
+    Reads a stratified random subset of nb_points jets from datafile, split
+    into train and test (see stratified_rows). Only the signal column and the
+    chosen jets are read, so this stays fast on files much larger than
+    nb_points.
+
+    Returns:
+    --------
+        X_train, X_test, y_train, y_test: as load_data, in random order
+        rows_train, rows_test: row of each jet in datafile, if return_rows
+    """
+    rows_train, rows_test = stratified_rows(
+        class_index(datafile), nb_points, test_fraction, balance, seed)
+
+    X, y = read_rows(datafile, np.concatenate([rows_train, rows_test]))
+    nb_train = rows_train.shape[0]
+    split = (X[:nb_train], X[nb_train:], y[:nb_train], y[nb_train:])
+
+    if return_rows:
+        return split + (rows_train, rows_test)
+    return split
+
+
+def preprocess(X):
+    """
+    What the networks see of images in GeV: tensorflow ordering, and pT
+    levels scaled by 100 (help neural nets w/ dynamic range - they need all
+    the help they can get)
+    """
+    return np.expand_dims(X, axis=-1).astype(np.float32) / 100
+
+
+# the arrays written by save_preprocessed, one .npy each
+PREPROCESSED = ('X_train', 'X_test', 'y_train', 'y_test', 'rows_train',
+                'rows_test')
+
+
+def save_preprocessed(directory, datafile, nb_points, balance=False,
+                      seed=None):
+    """
+    load_split, with the images preprocessed, written to directory as .npy
+    files that load_preprocessed memory-maps. In a tmpfs such as /dev/shm,
+    any number of training processes then share one copy.
+    """
+    X_train, X_test, y_train, y_test, rows_train, rows_test = load_split(
+        datafile, nb_points, balance=balance, seed=seed, return_rows=True)
+    arrays = dict(X_train=preprocess(X_train), X_test=preprocess(X_test),
+                  y_train=y_train, y_test=y_test, rows_train=rows_train,
+                  rows_test=rows_test)
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for name in PREPROCESSED:
+        np.save(os.path.join(directory, name + '.npy'), arrays[name])
+    # written last: its presence means the arrays are complete
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({'datafile': os.path.abspath(datafile),
+                   'nb_points': nb_points, 'balance': balance, 'seed': seed,
+                   'nb_train': len(y_train), 'nb_test': len(y_test)}, f)
+
+
+def load_preprocessed(directory):
+    """
+    The arrays written by save_preprocessed, memory-mapped read-only, in the
+    order of PREPROCESSED, and the dict of what they were made from
+    """
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    return tuple(np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+                 for name in PREPROCESSED) + (meta, )
+
+
+def read_rows(datafile, rows, chunk_size=10000):
+    """
+    Reads the jets at the given rows of datafile in one sequential pass,
+    selecting up to chunk_size sorted rows per read. Only the parts of the
+    file holding those rows are read, which is much faster than reading it
+    all or fancy indexing in an arbitrary order.
+
+    Returns:
+    --------
+        X: (len(rows), 25, 25) images in GeV, with unphysical values removed,
+            in the order of rows
+        y: (len(rows), ) signal labels
+    """
+    unique_rows, inverse = np.unique(np.asarray(rows), return_inverse=True)
+
+    _, _, take, close = _open(datafile)
+
+    X, y = [], []
+    try:
+        for start in range(0, unique_rows.shape[0], chunk_size):
+            images, labels = take(unique_rows[start:start + chunk_size])
+            X.append(images)
+            y.append(labels)
+    finally:
+        close()
+
+    X, y = np.concatenate(X), np.concatenate(y)
+    X[X < 1e-3] = 0
+
+    # back to the order of rows
+    return X[inverse], y[inverse]
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: evaluation.py
+description: physics observables of jet images, and their EMD between two
+    samples, built on manifolds.py and metrics.py
+"""
+
+from __future__ import print_function
+
+import hashlib
+import json
+from multiprocessing import Pool
+import os
+import tempfile
+
+import numpy as np
+
+from lazy import LazyDataset
+from manifolds import discrete_mass, discrete_pt, tau21
+from metrics import calculate_metric
+
+OBSERVABLES = ('mass', 'pt', 'tau21')
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.keras', 'lagan')
+
+
+def jet_observables(images, nb_jobs=1):
+    """
+    Args:
+    -----
+        images: (nb_images, 25, 25) or (nb_images, 25, 25, 1) array of jet
+            images in GeV, i.e. generator outputs need to be multiplied by
+            100, or a LazyDataset of them, which is read once, a chunk at a
+            time
+        nb_jobs: number of processes to compute tau21 with
+    Returns:
+    --------
+        dict of observable name => (nb_images, ) array
+    """
+    if isinstance(images, LazyDataset):
+        observables = [jet_observables(chunk, nb_jobs)
+                       for chunk in images.arrays()]
+        return {name: np.concatenate(
+            [np.zeros(0)] + [o[name] for o in observables])
+            for name in OBSERVABLES}
+
+    images = np.asarray(images, dtype=np.float64).reshape(-1, 25, 25)
+    return {
+        'mass': discrete_mass(images),
+        'pt': discrete_pt(images),
+        'tau21': tau21(images, nb_jobs=nb_jobs)
+    }
+
+
+def emd_scores(obs1, signal1, obs2, signal2, bins=40):
+    """
+    Args:
+    -----
+        obs1, obs2: dicts of observables, as returned by jet_observables
+        signal1, signal2: arrays of 1 or 0, indicating the class of each jet
+        bins: number of histogram bins per observable
+    Returns:
+    --------
+        dict of observable name => calculate_metric EMD, the worse of the
+            signal and background EMDs
+    """
+    signal1, signal2 = np.ravel(signal1), np.ravel(signal2)
+    return {
+        name: calculate_metric(obs1[name], signal1, obs2[name], signal2,
+                               bins=bins)
+        for name in OBSERVABLES
+    }
+
+
+def real_observables(datafile, nb_points, cache_dir=CACHE_DIR, nb_jobs=1):
+    """
+    Observables and signal labels of a random sample of nb_points real jets
+    from datafile, with the classes in the proportions of the file. They are
+    cached in cache_dir, keyed by the file and the sample size, as computing
+    tau21 is slow.
+    """
+    key = hashlib.md5('{}:{}:{}:{}'.format(
+        os.path.abspath(datafile), os.path.getsize(datafile),
+        os.path.getmtime(datafile), nb_points).encode('utf-8')).hexdigest()
+    cachefile = os.path.join(cache_dir, 'real-observables-{}.npz'.format(key))
+
+    if os.path.isfile(cachefile):
+        with np.load(cachefile) as f:
+            return {name: f[name] for name in OBSERVABLES}, f['signal']
+
+    from data import load_split
+
+    # only the signal column and the sampled jets are read
+    X, _, y, _ = load_split(datafile, nb_points, test_fraction=0)
+    obs = jet_observables(X, nb_jobs=nb_jobs)
+
+    try:
+        os.makedirs(cache_dir)
+    except OSError:
+        if not os.path.isdir(cache_dir):
+            raise
+    # written aside and renamed, as other processes may be reading the cache
+    fd, tmpfile = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, signal=y, **obs)
+    os.rename(tmpfile, cachefile)
+
+    return obs, y
+
+
+def _score_sample(images, labels, real, y_real):
+    scores = emd_scores(real, y_real, jet_observables(images), labels)
+    scores['score'] = sum(scores[name] for name in OBSERVABLES)
+    return scores
+
+
+class BackgroundValidator(object):
+
+    """
+    Scores generated samples against real jets in a worker process while
+    training goes on. Every result is logged to logfile, and bestfile always
+    points at the checkpoints of the best epoch so far, by the sum of the
+    mass, pT and tau21 EMDs.
+
+    Create it before Keras is imported, so the worker is forked from a
+    process without a backend session.
+    """
+
+    def __init__(self, logfile, bestfile):
+        self.logfile = logfile
+        self.bestfile = bestfile
+        self.pool = Pool(1)
+        self.history = []
+        self.best = None
+        self.pending = []
+        self.reference = None
+        self._reference = None
+
+    def set_reference(self, datafile, nb_points, cache_dir=CACHE_DIR):
+        """ starts computing the real observables to compare against """
+        self._reference = self.pool.apply_async(
+            real_observables, (datafile, nb_points, cache_dir))
+
+    def submit(self, epoch, images, labels, checkpoints):
+        """
+        Queues a sample generated after epoch for scoring.
+
+        Args:
+        -----
+            epoch: number of epochs trained
+            images: (nb_points, 25, 25) generated images in GeV
+            labels: (nb_points, ) classes the images were generated for
+            checkpoints: dict of network => weight file for this epoch
+        """
+        if self.reference is None:
+            self.reference = self._reference.get()
+        self.pending.append((epoch, checkpoints, self.pool.apply_async(
+            _score_sample, (images, labels) + self.reference)))
+
+    def collect(self, wait=False):
+        """ records the results that are ready, or all of them if wait """
+        pending = []
+        for epoch, checkpoints, result in self.pending:
+            if wait or result.ready():
+                self._record(epoch, checkpoints, result.get())
+            else:
+                pending.append((epoch, checkpoints, result))
+        self.pending = pending
+
+    def close(self):
+        self.collect(wait=True)
+        self.pool.close()
+        self.pool.join()
+
+    def _record(self, epoch, checkpoints, scores):
+        entry = dict(epoch=epoch, checkpoints=checkpoints, **scores)
+        self.history.append(entry)
+
+        print('[INFO] Validation after epoch {}: {} (sum {:.4f})'.format(
+            epoch, ', '.join('{} EMD {:.4f}'.format(name, scores[name])
+                             for name in OBSERVABLES), scores['score']))
+
+        with open(self.logfile, 'w') as f:
+            json.dump(self.history, f, indent=2)
+
+        if self.best is None or entry['score'] < self.best['score']:
+            self.best = entry
+            print('[INFO] New best epoch: {}'.format(epoch))
+            with open(self.bestfile, 'w') as f:
+                json.dump(self.best, f, indent=2)
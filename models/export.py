@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: export.py
+description: export trained [arXiv/1701.05927] networks for inference,
+    either as a slimmer Keras model or (generators only) as a flat .npz for
+    the NumPy runtime in runtime.py
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from networks.registry import MODELS
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Export a trained generator or discriminator as a slimmer '
+        'inference model, with frozen BatchNormalization folded into the '
+        'surrounding layers and Dropout removed.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('weights', action='store', type=str,
+                        help='HDF5 weights written by train.py, or <store>:<epoch>')
+    parser.add_argument('--model', '-m', action='store', type=str,
+                        default='lagan', help='Model architecture to use.',
+                        choices=MODELS)
+    parser.add_argument('--network', action='store', type=str,
+                        default='generator', help='Which network to export.',
+                        choices=['generator', 'discriminator'])
+    parser.add_argument('--latent-size', action='store', type=int, default=200,
+                        help='size of random N(0, 1) latent space to sample')
+    parser.add_argument('--output', '-o', action='store', type=str,
+                        required=True, help='Where to save the exported model')
+    parser.add_argument('--format', action='store', type=str, default='keras',
+                        choices=['keras', 'npz'],
+                        help='keras: a model to load with '
+                        'networks.inference.load_inference_model. npz: '
+                        'weights for runtime.NumpyGenerator (lagan and fcn '
+                        'generators only)')
+
+    parser.add_argument('--nb-check', action='store', type=int, default=1000,
+                        help='Number of random inputs to compare the exported '
+                        'model against the original on')
+    parser.add_argument('--tolerance', action='store', type=float,
+                        default=1e-4,
+                        help='Largest absolute difference to accept')
+    parser.add_argument('--batch-size', action='store', type=int, default=100,
+                        help='batch size to use when checking / timing')
+
+    return parser
+
+
+def random_inputs(network, nb_points, latent_size):
+    if network == 'generator':
+        return [np.random.normal(0, 1, (nb_points, latent_size)),
+                np.random.randint(0, 2, (nb_points, 1))]
+    # something with the sparsity of a real image, in train.py units
+    images = np.random.exponential(1, (nb_points, 25, 25, 1))
+    images *= np.random.uniform(0, 1, images.shape) < 0.1
+    return images.astype(np.float32)
+
+
+def timed_predict(model, x, batch_size):
+    # warm up, so graph compilation isn't part of the timing
+    model.predict([a[:batch_size] for a in x] if isinstance(x, list)
+                  else x[:batch_size], verbose=False)
+    start = time.time()
+    y = model.predict(x, batch_size=batch_size, verbose=False)
+    return (y if isinstance(y, list) else [y]), time.time() - start
+
+
+if __name__ == '__main__':
+
+    parser = get_parser()
+    results = parser.parse_args()
+
+    if results.format == 'npz' and results.network != 'generator':
+        parser.error('--format npz is only available for generators')
+
+    import keras.backend as K
+
+    K.set_image_dim_ordering('tf')
+
+    from networks.inference import optimize_for_inference
+    from networks.registry import build_network
+
+    print('[INFO] Building the {} {}'.format(results.model, results.network))
+    model = build_network(results.model, results.network, results.latent_size)
+    from checkpoints import load_weights
+    load_weights(model, results.weights)
+
+    optimized = optimize_for_inference(model)
+    print('[INFO] {} layers => {} layers'.format(
+        len(model.layers), len(optimized.layers)))
+
+    x = random_inputs(results.network, results.nb_check, results.latent_size)
+    y, t = timed_predict(model, x, results.batch_size)
+    y_opt, t_opt = timed_predict(optimized, x, results.batch_size)
+
+    print('[INFO] original: {:.1f} samples/sec, exported: {:.1f} samples/sec'.format(
+        results.nb_check / t, results.nb_check / t_opt))
+
+    diff = max(np.abs(a - b).max() for a, b in zip(y, y_opt))
+    print('[INFO] max abs difference over {} samples: {:.3g}'.format(
+        results.nb_check, diff))
+
+    if diff > results.tolerance:
+        raise ValueError('Exported model differs from the original by {:.3g} '
+                         '> {:.3g}'.format(diff, results.tolerance))
+
+    if results.format == 'keras':
+        optimized.save(results.output)
+    else:
+        from networks.inference import save_npz
+        from runtime import NumpyGenerator
+
+        save_npz(optimized, results.output)
+
+        runtime = NumpyGenerator.load(results.output)
+        start = time.time()
+        y_np = runtime.predict(*x, batch_size=results.batch_size)
+        t_np = time.time() - start
+
+        diff = np.abs(y[0] - y_np).max()
+        print('[INFO] NumPy runtime: {:.1f} samples/sec, max abs difference: '
+              '{:.3g}'.format(results.nb_check / t_np, diff))
+
+        if diff > results.tolerance:
+            os.remove(results.output)
+            raise ValueError('NumPy runtime differs from the original by '
+                             '{:.3g} > {:.3g}'.format(diff, results.tolerance))
+
+    print('[INFO] Saved to {}'.format(results.output))
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: latent.py
+description: sweeps through the latent space of a trained generator:
+    interpolations between latent vectors, traversals of single latent
+    dimensions and the same vectors under every class label, declared in a
+    JSON spec, expanded into large noise / label arrays, generated in bulk
+    and reduced to mass, pT and tau21 in a table with one row per image
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from networks.registry import MODELS
+
+SWEEP_TYPES = ('interpolate', 'traverse', 'classes')
+
+# the columns of the table that not every sweep type sets, and their
+# placeholder values
+OPTIONAL_COLUMNS = {'t': np.nan, 'dim': -1, 'value': np.nan}
+
+EXAMPLE_SPEC = '''
+{
+  "seed": 0,
+  "sweeps": [
+    {"name": "slerp", "type": "interpolate", "nb_pairs": 500,
+     "nb_steps": 21, "method": "slerp", "labels": [0, 1]},
+    {"name": "dims", "type": "traverse", "dims": [0, 1, 2, 3],
+     "values": [-3, 3], "nb_steps": 25, "nb_base": 100, "labels": [0, 1]},
+    {"name": "classes", "type": "classes", "nb_points": 20000,
+     "labels": [0, 1]}
+  ]
+}
+'''
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Run the latent space sweeps of a JSON spec through a '
+        'generator and tabulate the jet observables of every image. Example '
+        'spec:\n' + EXAMPLE_SPEC,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('spec', action='store', type=str,
+                        help='JSON sweep spec, as in the example above')
+    parser.add_argument('weights', action='store', type=str,
+                        help='Generator weights written by train.py, or '
+                        '<store>:<epoch>')
+    parser.add_argument('--model', '-m', action='store', type=str,
+                        default='lagan', help='Model architecture to use.',
+                        choices=MODELS)
+    parser.add_argument('--latent-size', action='store', type=int, default=200,
+                        help='size of random N(0, 1) latent space to sample')
+    parser.add_argument('--output', '-o', action='store', type=str,
+                        default='latent-sweep.npz',
+                        help='Where to save the table, as columns in an npz')
+    parser.add_argument('--batch-size', action='store', type=int, default=1000,
+                        help='Images per generator forward pass')
+    parser.add_argument('--chunk-size', action='store', type=int,
+                        default=20000,
+                        help='Images generated and reduced at a time')
+    parser.add_argument('--nb-jobs', action='store', type=int, default=1,
+                        help='Number of processes to compute tau21 with')
+    return parser
+
+
+def interpolate(z0, z1, t, method='slerp'):
+    """
+    Points between rows of z0 and z1, at fractions t of the way.
+
+    slerp follows the great circle, which keeps the norm of Gaussian latent
+    vectors typical all the way; linear goes through the low-norm middle of
+    the latent space.
+
+    Returns:
+    --------
+        (len(z0), len(t), latent_size) array
+    """
+    t = np.asarray(t, dtype=np.float64)[np.newaxis, :, np.newaxis]
+    a, b = z0[:, np.newaxis], z1[:, np.newaxis]
+    if method == 'linear':
+        return (1 - t) * a + t * b
+    if method != 'slerp':
+        raise ValueError('Unknown interpolation {}'.format(method))
+
+    norms = np.linalg.norm(z0, axis=1) * np.linalg.norm(z1, axis=1)
+    cos = np.clip(np.sum(z0 * z1, axis=1) / norms, -1, 1)
+    omega = np.arccos(cos)[:, np.newaxis, np.newaxis]
+    sin = np.sin(omega)
+    # (anti)parallel pairs have no unique great circle, fall back to linear
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slerp = (np.sin((1 - t) * omega) * a + np.sin(t * omega) * b) / sin
+    return np.where(sin > 1e-6, slerp, (1 - t) * a + t * b)
+
+
+def expand_sweep(sweep, latent_size, rng):
+    """
+    The latent vectors of one sweep, before labels are applied.
+
+    Returns:
+    --------
+        noise: (n, latent_size) array
+        columns: dict of name => (n, ) array, always with 'base' (which
+            pair or base vector each row comes from), plus 't' for
+            interpolations and 'dim' and 'value' for traversals
+    """
+    kind = sweep.get('type')
+    if kind == 'interpolate':
+        nb_pairs, nb_steps = sweep['nb_pairs'], sweep.get('nb_steps', 11)
+        t = np.linspace(0, 1, nb_steps)
+        z0 = rng.normal(0, 1, (nb_pairs, latent_size))
+        z1 = rng.normal(0, 1, (nb_pairs, latent_size))
+        noise = interpolate(z0, z1, t, sweep.get('method', 'slerp'))
+        return noise.reshape(-1, latent_size), {
+            'base': np.repeat(np.arange(nb_pairs), nb_steps),
+            't': np.tile(t, nb_pairs)
+        }
+
+    if kind == 'traverse':
+        dims = sweep.get('dims', 'all')
+        dims = np.arange(latent_size) if dims == 'all' else np.asarray(dims)
+        if dims.size and (dims.min() < 0 or dims.max() >= latent_size):
+            raise ValueError('Sweep {} traverses dimensions outside the '
+                             'latent space'.format(sweep.get('name')))
+        low, high = sweep.get('values', [-3, 3])
+        values = np.linspace(low, high, sweep.get('nb_steps', 13))
+        nb_base = sweep.get('nb_base', 10)
+        base = rng.normal(0, 1, (nb_base, latent_size))
+
+        # (base, dim, value) => one latent vector
+        noise = np.repeat(base, len(dims) * len(values), axis=0)
+        grid_base, grid_dim, grid_value = [g.ravel() for g in np.meshgrid(
+            np.arange(nb_base), dims, values, indexing='ij')]
+        noise[np.arange(noise.shape[0]), grid_dim] = grid_value
+        return noise, {'base': grid_base, 'dim': grid_dim, 'value': grid_value}
+
+    if kind == 'classes':
+        nb_points = sweep['nb_points']
+        return rng.normal(0, 1, (nb_points, latent_size)), {
+            'base': np.arange(nb_points)}
+
+    raise ValueError('Sweep {} has type {}, expected one of {}'.format(
+        sweep.get('name'), kind, ', '.join(SWEEP_TYPES)))
+
+
+def expand(spec, latent_size):
+    """
+    All the sweeps of spec, each latent vector repeated under each of the
+    sweep's labels (default: 0 and 1), so class pairs sit next to each other.
+
+    Returns:
+    --------
+        noise: (n, latent_size) float32 array
+        labels: (n, ) int array
+        columns: dict of name => (n, ) array, with 'sweep' indexing names
+        names: the sweep names
+    """
+    rng = np.random.RandomState(spec.get('seed', 0))
+    noise, labels, columns, names = [], [], [], []
+
+    for i, sweep in enumerate(spec['sweeps']):
+        names.append(sweep.get('name', '{}{}'.format(sweep.get('type'), i)))
+        z, cols = expand_sweep(sweep, latent_size, rng)
+        sweep_labels = np.asarray(sweep.get('labels', [0, 1]))
+        nb_labels = len(sweep_labels)
+
+        noise.append(np.repeat(z, nb_labels, axis=0))
+        labels.append(np.tile(sweep_labels, z.shape[0]))
+        cols = {name: np.repeat(col, nb_labels) for name, col in cols.items()}
+        for name, fill in OPTIONAL_COLUMNS.items():
+            if name not in cols:
+                cols[name] = np.full(z.shape[0] * nb_labels, fill)
+        cols['sweep'] = np.full(z.shape[0] * nb_labels, i)
+        columns.append(cols)
+
+    columns = {name: np.concatenate([c[name] for c in columns])
+               for name in columns[0]}
+    return (np.concatenate(noise).astype(np.float32), np.concatenate(labels),
+            columns, names)
+
+
+def run(generator, noise, labels, batch_size=1000, chunk_size=20000,
+        nb_jobs=1):
+    """
+    Generates the images of noise and labels, chunk_size at a time, and
+    reduces each chunk to its observables, so only one chunk of images is
+    ever in memory.
+
+    Returns:
+    --------
+        dict of observable name => (n, ) array, as evaluation.jet_observables
+    """
+    from evaluation import jet_observables
+
+    observables = []
+    start_time = time.time()
+    for start in range(0, noise.shape[0], chunk_size):
+        stop = min(start + chunk_size, noise.shape[0])
+        images = 100 * generator.predict(
+            [noise[start:stop], labels[start:stop].reshape(-1, 1)],
+            batch_size=batch_size, verbose=False)
+        images[images < 1e-3] = 0
+        observables.append(jet_observables(images, nb_jobs=nb_jobs))
+        print('[INFO] {}/{} images, {:.0f} images/sec'.format(
+            stop, noise.shape[0], stop / (time.time() - start_time)))
+
+    return {name: np.concatenate([o[name] for o in observables])
+            for name in observables[0]}
+
+
+def summarize(table, names):
+    """ prints the mean and spread of each observable per sweep and label """
+    from evaluation import OBSERVABLES
+
+    print('\n{0:<16s} | {1:>5s} | {2:>7s} | '.format('sweep', 'label', 'images') +
+          ' | '.join('{0:>16s}'.format(name) for name in OBSERVABLES))
+    print('-' * (33 + 19 * len(OBSERVABLES)))
+    for i, name in enumerate(names):
+        for label in np.unique(table['label'][table['sweep'] == i]):
+            rows = (table['sweep'] == i) & (table['label'] == label)
+            print('{0:<16s} | {1:>5d} | {2:>7d} | '.format(
+                name, int(label), int(rows.sum())) + ' | '.join(
+                    '{0:>7.3g} +- {1:<5.2g}'.format(
+                        np.mean(table[obs][rows]), np.std(table[obs][rows]))
+                    for obs in OBSERVABLES))
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+
+    with open(results.spec) as f:
+        spec = json.load(f)
+
+    noise, labels, table, names = expand(spec, results.latent_size)
+    print('[INFO] {} sweeps, {} images'.format(len(names), noise.shape[0]))
+
+    import keras.backend as K
+
+    K.set_image_dim_ordering('tf')
+
+    from checkpoints import load_weights
+    from networks.registry import build_network
+
+    generator = build_network(results.model, 'generator', results.latent_size)
+    load_weights(generator, results.weights)
+
+    table.update(run(generator, noise, labels, results.batch_size,
+                     results.chunk_size, results.nb_jobs))
+    table['label'] = labels
+
+    np.savez(results.output, names=np.array(names), spec=json.dumps(spec),
+             weights=results.weights, **table)
+    print('[INFO] Saved to {}'.format(results.output))
+
+    summarize(table, names)
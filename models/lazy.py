@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: lazy.py
+description: datasets of jets that stay on disk (HDF5, sharded or numpy
+    files, or memmaps) and are read a chunk of rows at a time. Slicing,
+    class filtering and column projection only describe what to read, so
+    manifolds.py, metrics.py and evaluation.py can go through samples far
+    larger than memory.
+"""
+
+from __future__ import division
+
+import numpy as np
+
+# rows per chunk are picked so one chunk of the columns read is about this big
+CHUNK_BYTES = 64 * 2 ** 20
+
+
+def _clean_images(images):
+    # as data.read_rows
+    images[images < 1e-3] = 0
+    return images
+
+
+class LazyDataset(object):
+
+    """
+    Named columns with one row per jet, read chunk by chunk:
+
+        real = LazyDataset.open('jets.h5')
+        for images in real['image'].where('signal', 1).arrays():
+            ...
+
+    Every selection returns a new dataset and reads nothing:
+        dataset['image'], dataset.project('mass', 'tau21'): only these columns
+        dataset[start:stop]: only these rows
+        dataset.where('signal', 1): only the rows where signal == 1
+
+    Args:
+    -----
+        read: read(start, stop, names) => tuple of the arrays of rows
+            [start, stop) of the named columns
+        nb_rows: number of rows of every column
+        names: names of the columns
+        close: called by close(), e.g. to close the file
+        transforms: dict of name => function applied to each chunk read of
+            that column
+        chunk_size: rows per chunk. Defaults to about CHUNK_BYTES per chunk
+    """
+
+    def __init__(self, read, nb_rows, names, close=None, transforms=None,
+                 chunk_size=None):
+        self._read = read
+        self._nb_rows = nb_rows
+        self._all_names = tuple(names)
+        self._close = close
+        self._transforms = transforms or {}
+        self._chunk_size = chunk_size
+
+        self.names = self._all_names
+        self.start, self.stop = 0, nb_rows
+        self._where = ()
+        self._len = None
+        self._row_shapes = None
+
+    @classmethod
+    def open(cls, datafile, names=('image', 'signal'), chunk_size=None):
+        """
+        The named datasets of an HDF5 file, a directory written by shards.py
+        or a numpy file of jets, as data.py reads them. Images get the
+        unphysical values under 1e-3 GeV removed.
+        """
+        from data import _open
+
+        nb_rows, read, _, close = _open(datafile)
+        return cls(read, nb_rows, names, close, {'image': _clean_images},
+                   chunk_size)
+
+    @classmethod
+    def from_arrays(cls, chunk_size=None, **columns):
+        """
+        Columns of arrays that support slicing: np.memmap, h5py datasets
+        or plain arrays, e.g. from np.load(..., mmap_mode='r')
+        """
+        names = sorted(columns)
+        nb_rows = set(len(columns[name]) for name in names)
+        if len(nb_rows) != 1:
+            raise ValueError('Columns have different numbers of rows: '
+                             '{}'.format(', '.join('{} {}'.format(
+                                 name, len(columns[name])) for name in names)))
+
+        def read(start, stop, names):
+            return tuple(np.array(columns[name][start:stop]) for name in names)
+
+        return cls(read, nb_rows.pop(), names, chunk_size=chunk_size)
+
+    @classmethod
+    def from_npy(cls, chunk_size=None, **filepaths):
+        """ columns memory-mapped from .npy files, e.g. image='x.npy' """
+        return cls.from_arrays(chunk_size=chunk_size, **{
+            name: np.load(filepath, mmap_mode='r')
+            for name, filepath in filepaths.items()
+        })
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _copy(self, **changes):
+        dataset = object.__new__(LazyDataset)
+        dataset.__dict__.update(self.__dict__, _len=None, **changes)
+        return dataset
+
+    def project(self, *names):
+        """ the dataset with only the given columns """
+        missing = [name for name in names if name not in self._all_names]
+        if missing:
+            raise KeyError('No column {} in {}'.format(
+                ', '.join(missing), ', '.join(self._all_names)))
+        return self._copy(names=tuple(names))
+
+    def where(self, name, value):
+        """ the dataset with only the rows where column name == value """
+        if name not in self._all_names:
+            raise KeyError('No column {} in {}'.format(
+                name, ', '.join(self._all_names)))
+        return self._copy(_where=self._where + ((name, value), ))
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.project(key)
+        if isinstance(key, tuple) and all(isinstance(k, str) for k in key):
+            return self.project(*key)
+        if not isinstance(key, slice):
+            raise TypeError('LazyDataset takes column names or slices, not '
+                            '{}'.format(type(key).__name__))
+        if key.step not in (None, 1):
+            raise ValueError('LazyDataset only takes contiguous slices')
+        if self._where:
+            raise ValueError('Slice a LazyDataset before filtering it, the '
+                             'rows left by where() are only known once read')
+        start, stop, _ = key.indices(self.stop - self.start)
+        return self._copy(start=self.start + start,
+                          stop=self.start + max(start, stop))
+
+    def _shapes(self):
+        """ dict of name => (shape of one row, dtype) of every column """
+        if self._row_shapes is None:
+            first = self._read(0, 1, self._all_names)
+            self._row_shapes = {
+                name: (column.shape[1:], column.dtype)
+                for name, column in zip(self._all_names, first)
+            }
+        return self._row_shapes
+
+    @property
+    def ndim(self):
+        """
+        ndim of the arrays of arrays(): that of the column if there is one,
+        2 for several side by side
+        """
+        if len(self.names) == 1:
+            return 1 + len(self._shapes()[self.names[0]][0])
+        return 2
+
+    @property
+    def chunk_size(self):
+        if self._chunk_size:
+            return self._chunk_size
+        shapes = self._shapes()
+        row_bytes = sum(
+            int(np.prod(shapes[name][0])) * shapes[name][1].itemsize
+            for name in self._read_names())
+        return max(CHUNK_BYTES // max(row_bytes, 1), 1)
+
+    def _read_names(self):
+        return self.names + tuple(name for name, _ in self._where
+                                  if name not in self.names)
+
+    def __len__(self):
+        if not self._where:
+            return self.stop - self.start
+        if self._len is None:
+            # only the filtered columns need to be read to count
+            self._len = sum(len(chunk[self._where[0][0]]) for chunk in
+                            self.project(self._where[0][0]).chunks())
+        return self._len
+
+    def chunks(self, chunk_size=None):
+        """ dicts of name => array, for chunk_size rows at a time """
+        chunk_size = chunk_size or self.chunk_size
+        names = self._read_names()
+        for start in range(self.start, self.stop, chunk_size):
+            stop = min(start + chunk_size, self.stop)
+            chunk = dict(zip(names, self._read(start, stop, names)))
+            for name in names:
+                if name in self._transforms:
+                    chunk[name] = self._transforms[name](chunk[name])
+
+            if self._where:
+                keep = np.ones(stop - start, dtype=bool)
+                for name, value in self._where:
+                    keep &= np.ravel(chunk[name]) == value
+                if not keep.any():
+                    continue
+                if not keep.all():
+                    chunk = {name: column[keep]
+                             for name, column in chunk.items()}
+            yield {name: chunk[name] for name in self.names}
+
+    def arrays(self, chunk_size=None):
+        """
+        The chunks as arrays: the column itself if there is one, and
+        (rows, nb_columns) arrays of the columns side by side otherwise
+        """
+        for chunk in self.chunks(chunk_size):
+            if len(self.names) == 1:
+                yield chunk[self.names[0]]
+            else:
+                yield np.stack([chunk[name] for name in self.names], axis=1)
+
+    def read(self):
+        """ the whole dataset in memory, as a dict of name => array """
+        chunks = list(self.chunks())
+        if not chunks:
+            shapes = self._shapes()
+            return {name: np.zeros((0, ) + shapes[name][0], shapes[name][1])
+                    for name in self.names}
+        return {name: np.concatenate([chunk[name] for chunk in chunks])
+                for name in self.names}
@@ -1,6 +1,6 @@
-from joblib import Parallel, delayed
 import numpy as np
-import math
+
+from lazy import LazyDataset
 
 
 # form the grids you need to represent the eta, phi coordinates
@@ -9,6 +9,16 @@ eta = np.tile(grid, (25, 1))
 phi = np.tile(grid[::-1].reshape(-1, 1), (1, 25))
 
 
+def _per_chunk(func, jet_images, **kwargs):
+    '''
+    func of the images of a LazyDataset, one chunk at a time, concatenated
+    '''
+    return np.concatenate([np.zeros(0)] + [
+        func(np.asarray(images, np.float64).reshape(-1, 25, 25), **kwargs)
+        for images in jet_images.arrays()
+    ])
+
+
 def discrete_mass(jet_image):
     '''
     Calculates the jet mass from a pixelated jet image
@@ -19,6 +29,8 @@ def discrete_mass(jet_image):
     --------
         M: float, jet mass
     '''
+    if isinstance(jet_image, LazyDataset):
+        return _per_chunk(discrete_mass, jet_image)
     Px = np.sum(jet_image * np.cos(phi), axis=(1, 2))
     Py = np.sum(jet_image * np.sin(phi), axis=(1, 2))
     Pz = np.sum(jet_image * np.sinh(eta), axis=(1, 2))
@@ -39,6 +51,8 @@ def discrete_pt(jet_image):
     --------
         float, jet transverse momentum
     '''
+    if isinstance(jet_image, LazyDataset):
+        return _per_chunk(discrete_pt, jet_image)
     Px = np.sum(jet_image * np.cos(phi), axis=(1, 2))
     Py = np.sum(jet_image * np.sin(phi), axis=(1, 2))
     return np.sqrt(np.square(Px) + np.square(Py))
@@ -47,9 +61,9 @@ def discrete_pt(jet_image):
 def dphi(phi1, phi2):
     '''
     Calculates the difference between two angles avoiding |phi1 - phi2| > 180 degrees
+    Works elementwise on arrays as well as on floats
     '''
-    import math
-    return math.acos(math.cos(abs(phi1 - phi2)))
+    return np.arccos(np.cos(np.abs(phi1 - phi2)))
 
 
 def _tau1(jet_image):
@@ -57,19 +71,23 @@ def _tau1(jet_image):
     Calculates the normalized tau1 from a pixelated jet image
     Args:
     -----
-        jet_image: numpy ndarray of dim (1, 25, 25)
+        jet_image: numpy ndarray of dim (25, 25), or (n, 25, 25) for n images
+            at once
     Returns:
     --------
-        float, normalized jet tau1
+        float, normalized jet tau1, or (n, ) array of them
     '''
+    images = jet_image.reshape(-1, 25, 25)
     # find coordinate of most energetic pixel, then use formula to compute tau1
-    tau1_axis_eta = eta.ravel()[np.argmax(jet_image)]
-    tau1_axis_phi = phi.ravel()[np.argmax(jet_image)]
-    tau1 = np.sum(jet_image *
+    axis = np.argmax(images.reshape(images.shape[0], -1), axis=1)
+    tau1_axis_eta = eta.ravel()[axis][:, np.newaxis, np.newaxis]
+    tau1_axis_phi = phi.ravel()[axis][:, np.newaxis, np.newaxis]
+    tau1 = np.sum(images *
                   np.sqrt(np.square(tau1_axis_eta - eta) +
-                          np.square([dphi(tau1_axis_phi, p) for p in phi.ravel()]).reshape(25, 25))
-                  )
-    return tau1 / np.sum(jet_image)  # normalize by the total intensity
+                          np.square(dphi(tau1_axis_phi, phi))),
+                  axis=(1, 2))
+    tau1 /= np.sum(images, axis=(1, 2))  # normalize by the total intensity
+    return tau1 if jet_image.ndim == 3 else tau1[0]
 
 
 def _tau2(jet_image):
@@ -77,66 +95,78 @@ def _tau2(jet_image):
     Calculates the normalized tau2 from a pixelated jet image
     Args:
     -----
-        jet_image: numpy ndarray of dim (1, 25, 25)
+        jet_image: numpy ndarray of dim (25, 25)
     Returns:
     --------
         float, normalized jet tau2
     Notes:
     ------
-        slow implementation
+        merges the closest pair of pixels (kt-like distance) until two are
+        left. The pair distances are kept in a matrix, upper triangle only,
+        and only the row and column of the merged pixel are recomputed after
+        a merge; ties go to the first pair in (i, j) order, as they always
+        have
     '''
-    proto = np.array(zip(jet_image[jet_image != 0],
-                         eta[jet_image != 0],
-                         phi[jet_image != 0]))
-    while len(proto) > 2:
-        candidates = [
-            (
-                (i, j),
-                (min(pt1, pt2) ** 2) * ((eta1 - eta2) ** 2 + (phi1 - phi2) ** 2)
-            )
-            for i, (pt1, eta1, phi1) in enumerate(proto)
-            for j, (pt2, eta2, phi2) in enumerate(proto)
-            if j > i
-        ]
-        index, value = zip(*candidates)
-        pix1, pix2 = index[np.argmin(value)]
-        if pix1 > pix2:
-            # swap
-            pix1, pix2 = pix2, pix1
-        (pt1, eta1, phi1) = proto[pix1]
-        (pt2, eta2, phi2) = proto[pix2]
-        e1 = pt1 / np.cosh(eta1)
-        e2 = pt2 / np.cosh(eta2)
-        choice = e1 > e2
-        eta_add = (eta1 if choice else eta2)
-        phi_add = (phi1 if choice else phi2)
-        pt_add = (e1 + e2) * np.cosh(eta_add)
-        proto[pix1] = (pt_add, eta_add, phi_add)
-        proto = np.delete(proto, pix2, axis=0).tolist()
-
-    (_, eta1, phi1), (_, eta2, phi2) = proto
-    np.sqrt(np.square(eta - eta1) + np.square(phi - phi1))
-    grid = np.array([
+    nonzero = jet_image != 0
+    pt = jet_image[nonzero].astype(np.float64)
+    _eta, _phi = eta[nonzero], phi[nonzero]
+    nb_proto = pt.shape[0]
+
+    def distances(i):
+        return (np.square(np.minimum(pt[i], pt)) *
+                (np.square(_eta[i] - _eta) + np.square(_phi[i] - _phi)))
+
+    pairs = np.square(np.minimum(pt[:, np.newaxis], pt)) * (
+        np.square(_eta[:, np.newaxis] - _eta) +
+        np.square(_phi[:, np.newaxis] - _phi))
+    pairs[np.tril_indices(nb_proto)] = np.inf
+    alive = np.ones(nb_proto, dtype=bool)
+
+    for _ in range(nb_proto - 2):
+        pix1, pix2 = divmod(np.argmin(pairs), nb_proto)
+        e1 = pt[pix1] / np.cosh(_eta[pix1])
+        e2 = pt[pix2] / np.cosh(_eta[pix2])
+        if not e1 > e2:
+            _eta[pix1], _phi[pix1] = _eta[pix2], _phi[pix2]
+        pt[pix1] = (e1 + e2) * np.cosh(_eta[pix1])
+
+        alive[pix2] = False
+        pairs[pix2, :] = pairs[:, pix2] = np.inf
+        d = distances(pix1)
+        d[~alive] = np.inf
+        pairs[pix1, pix1 + 1:] = d[pix1 + 1:]
+        pairs[:pix1, pix1] = d[:pix1]
+
+    (eta1, eta2), (phi1, phi2) = _eta[alive], _phi[alive]
+    grid = np.minimum(
         np.sqrt(np.square(eta - eta1) + np.square(phi - phi1)),
         np.sqrt(np.square(eta - eta2) + np.square(phi - phi2))
-    ]).min(axis=0)
+    )
     # normalize by the total intensity
     return np.sum(jet_image * grid) / np.sum(jet_image)
 
 
-def tau21(jet_image, nb_jobs=1, verbose=False):
+def tau21(jet_image, nb_jobs=1, verbose=False, chunk_size=10000):
     '''
     Calculates the tau21 from a pixelated jet image using the functions above
     Args:
     -----
-        jet_image: numpy ndarray of dim (1, 25, 25)
+        jet_image: numpy ndarray of dim (25, 25), or (n, 25, 25), or a
+            LazyDataset of images, which is read a chunk at a time
+        nb_jobs: number of processes to compute tau2 with
+        chunk_size: images to compute tau1 for at a time
     Returns:
     --------
-        float, jet tau21
+        float, jet tau21, or (n, ) array of them
     Notes:
     ------
-        slow implementation
+        tau1 is vectorized over images, tau2 is computed one image at a
+        time, and only where tau1 > 0
     '''
+    if isinstance(jet_image, LazyDataset):
+        return _per_chunk(tau21, jet_image, nb_jobs=nb_jobs, verbose=verbose,
+                          chunk_size=chunk_size)
+
     if len(jet_image.shape) == 2:
         tau1 = _tau1(jet_image)
         if tau1 <= 0:
@@ -145,6 +175,19 @@ def tau21(jet_image, nb_jobs=1, verbose=False):
             tau2 = _tau2(jet_image)
             return tau2 / tau1
 
-    return np.array(Parallel(n_jobs=nb_jobs, verbose=verbose)(
-        delayed(tau21)(im) for im in jet_image
-    ))
+    tau1 = np.concatenate([np.zeros(0)] + [
+        _tau1(jet_image[start:start + chunk_size])
+        for start in range(0, jet_image.shape[0], chunk_size)
+    ])
+    (index, ) = np.nonzero(tau1 > 0)
+    if nb_jobs == 1:
+        tau2 = [_tau2(jet_image[i]) for i in index]
+    else:
+        from joblib import Parallel, delayed
+        tau2 = Parallel(n_jobs=nb_jobs, verbose=verbose)(
+            delayed(_tau2)(jet_image[i]) for i in index
+        )
+
+    ratio = np.zeros(jet_image.shape[0])
+    ratio[index] = np.asarray(tau2, dtype=np.float64) / tau1[index]
+    return ratio
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: memorization.py
+description: nearest neighbour audit of a generator: how close generated jets
+    are to the jets it was trained on, compared to how close held-out real
+    jets are. Searches a KD-tree over PCA-reduced training images, checked
+    against exact search on a subsample.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+
+import numpy as np
+
+from networks.registry import MODELS
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Check a generator for memorization of its training jets, '
+        'with approximate nearest neighbour search.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('generator', action='store', type=str,
+                        help='Generator weights written by train.py, or '
+                        '<store>:<epoch>')
+    parser.add_argument('split', action='store', type=str,
+                        help='<g-pfx>split.npz written by train.py, with the '
+                        'rows of the training and held-out jets')
+    parser.add_argument('--model', '-m', action='store', type=str,
+                        default='lagan', help='Model architecture to use.',
+                        choices=MODELS)
+    parser.add_argument('--latent-size', action='store', type=int, default=200,
+                        help='size of random N(0, 1) latent space to sample')
+    parser.add_argument('--dataset', action='store', type=str,
+                        help='Dataset the split refers to, if it has moved')
+
+    parser.add_argument('--nb-generated', action='store', type=int,
+                        default=10000, help='Number of jets to generate')
+    parser.add_argument('--nb-components', action='store', type=int,
+                        default=16, help='PCA dimensions to search in. KD-trees '
+                        'slow down quickly above ~20')
+    parser.add_argument('--eps', action='store', type=float, default=1.0,
+                        help='cKDTree approximation: candidates are within '
+                        '(1 + eps) of the true neighbours in PCA space')
+    parser.add_argument('--nb-candidates', action='store', type=int, default=20,
+                        help='Neighbours from the index to re-rank by exact '
+                        'distance')
+    parser.add_argument('--nb-exact', action='store', type=int, default=500,
+                        help='Number of queries to check against exact search')
+    parser.add_argument('--batch-size', action='store', type=int, default=2000,
+                        help='Queries per batch')
+    parser.add_argument('--nb-jobs', action='store', type=int, default=4,
+                        help='Number of threads to query with')
+    parser.add_argument('--output', '-o', action='store', type=str,
+                        default='memorization.npz',
+                        help='Where to save the distances')
+    return parser
+
+
+def flatten(images):
+    return np.asarray(images, dtype=np.float32).reshape(len(images), -1)
+
+
+class NeighbourIndex(object):
+
+    """
+    Approximate nearest neighbours of flattened jet images: a KD-tree over the
+    top nb_components principal components finds nb_candidates neighbours,
+    up to a factor (1 + eps) in distance, which are re-ranked by their
+    distance in the full pixel space.
+    """
+
+    def __init__(self, images, nb_components=16, nb_candidates=20, eps=1.0,
+                 nb_fit=20000):
+        from scipy.spatial import cKDTree
+
+        self.data = flatten(images)
+        self.nb_candidates = min(nb_candidates, self.data.shape[0])
+        self.eps = eps
+
+        # the principal axes of a subsample are plenty for 625 dimensions
+        fit = self.data[np.random.permutation(self.data.shape[0])[:nb_fit]]
+        self.center = fit.mean(axis=0)
+        _, _, vt = np.linalg.svd(fit - self.center, full_matrices=False)
+        self.components = vt[:nb_components].T
+
+        self.tree = cKDTree(self.project(self.data))
+
+    def project(self, x):
+        return np.dot(x - self.center, self.components)
+
+    def query(self, images):
+        """ (distance, index) of the nearest indexed image to each image """
+        x = flatten(images)
+        _, candidates = self.tree.query(self.project(x), k=self.nb_candidates,
+                                        eps=self.eps)
+        candidates = candidates.reshape(x.shape[0], -1)
+        distances = np.sqrt(np.square(
+            self.data[candidates] - x[:, np.newaxis]).sum(axis=-1))
+        best = distances.argmin(axis=1)
+        rows = np.arange(x.shape[0])
+        return distances[rows, best], candidates[rows, best]
+
+    def query_parallel(self, images, batch_size=2000, nb_jobs=1):
+        """ query in batches, in nb_jobs threads (cKDTree releases the GIL) """
+        from joblib import Parallel, delayed
+
+        batches = Parallel(n_jobs=nb_jobs, backend='threading')(
+            delayed(self.query)(images[i:i + batch_size])
+            for i in range(0, len(images), batch_size)
+        )
+        return tuple(np.concatenate(a) for a in zip(*batches))
+
+
+def exact_query(data, images, batch_size=500):
+    """ brute force (distance, index) of the nearest row of data to each image """
+    data = flatten(data)
+    sq_data = np.square(data).sum(axis=1)
+    distances, indices = [], []
+    for i in range(0, len(images), batch_size):
+        x = flatten(images[i:i + batch_size])
+        d2 = np.square(x).sum(axis=1)[:, np.newaxis] - 2 * np.dot(x, data.T) + sq_data
+        nearest = d2.argmin(axis=1)
+        indices.append(nearest)
+        distances.append(np.sqrt(np.square(data[nearest] - x).sum(axis=1)))
+    return np.concatenate(distances), np.concatenate(indices)
+
+
+def check_approximation(index, images, nb_exact):
+    """ recall of the exact nearest neighbour, and approximate / exact distance """
+    sample = images[np.random.permutation(len(images))[:nb_exact]]
+    approx, approx_ix = index.query(sample)
+    exact, exact_ix = exact_query(index.data, sample)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(exact > 0, approx / exact, 1)
+    return np.mean(approx_ix == exact_ix), ratio
+
+
+def describe(name, distances):
+    q = np.percentile(distances, [1, 5, 50, 95])
+    print('{0:<18s} | {1:>8.2f} | {2:>8.2f} | {3:>8.2f} | {4:>8.2f}'.format(
+        name, *q))
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+
+    import keras.backend as K
+
+    K.set_image_dim_ordering('tf')
+
+    from data import read_rows
+    from networks.registry import build_network
+
+    with np.load(results.split) as f:
+        datafile = results.dataset or str(f['datafile'])
+        rows_train, rows_test = f['train'], f['test']
+
+    print('[INFO] Reading {} training and {} held-out jets'.format(
+        len(rows_train), len(rows_test)))
+    X_train, _ = read_rows(datafile, rows_train)
+    X_test, _ = read_rows(datafile, rows_test)
+
+    print('[INFO] Indexing the training jets')
+    index = NeighbourIndex(X_train, results.nb_components,
+                           results.nb_candidates, results.eps)
+
+    generator = build_network(results.model, 'generator', results.latent_size)
+    from checkpoints import load_weights
+    load_weights(generator, results.generator)
+    X_gen = 100 * generator.predict(
+        [np.random.normal(0, 1, (results.nb_generated, results.latent_size)),
+         np.random.randint(0, 2, (results.nb_generated, 1))],
+        verbose=False, batch_size=100)
+    X_gen[X_gen < 1e-3] = 0
+
+    recall, ratio = check_approximation(index, X_gen, results.nb_exact)
+    print('[INFO] Approximate search: exact nearest neighbour found for '
+          '{:.1%} of {} queries, distance within {:.1%} of exact on '
+          'average (worst {:.1%})'.format(recall, len(ratio),
+                                          np.mean(ratio) - 1,
+                                          np.max(ratio) - 1))
+
+    d_gen, ix_gen = index.query_parallel(X_gen, results.batch_size,
+                                         results.nb_jobs)
+    d_test, _ = index.query_parallel(X_test, results.batch_size,
+                                     results.nb_jobs)
+
+    print('\nnearest training jet distance (GeV), percentiles')
+    print('{0:<18s} | {1:>8s} | {2:>8s} | {3:>8s} | {4:>8s}'.format(
+        'queries', '1%', '5%', '50%', '95%'))
+    print('-' * 59)
+    describe('generated', d_gen)
+    describe('held-out real', d_test)
+
+    # a memorizing generator puts many jets closer to the training set than
+    # unseen real jets ever get
+    threshold = np.percentile(d_test, 1)
+    print('\n[INFO] {:.2%} of generated jets are closer to a training jet than '
+          '99% of held-out jets ({:.2f} GeV)'.format(np.mean(d_gen < threshold),
+                                                     threshold))
+
+    np.savez(results.output, generated=d_gen, test=d_test,
+             nearest_train_row=rows_train[ix_gen], recall=recall,
+             distance_ratio=ratio)
+    print('[INFO] Saved to {}'.format(results.output))
@@ -1,80 +1,140 @@
+from __future__ import print_function
+
 import numpy as np
 from scipy.spatial.distance import cdist as distance
 from pyemd import emd
-from scipy.linalg import toeplitz
+
+from lazy import LazyDataset
 
 
 class AnnoyingError(Exception):
     pass
 
 
+# ground distance matrices of the EMD, by histogram shape
+_ground_distances = {}
+
+
+def _ground_distance(shape):
+    """
+    Euclidean distance in bins between every pair of bins of a histogram of
+    shape, flattened as ndarray.ravel() does
+    """
+    if shape not in _ground_distances:
+        coords = np.indices(shape).reshape(len(shape), -1).T
+        _ground_distances[shape] = distance(coords, coords)
+    return _ground_distances[shape]
+
+
+def _chunks(D):
+    """ D itself if it is an array, the chunks of a LazyDataset otherwise """
+    return D.arrays() if isinstance(D, LazyDataset) else [D]
+
+
+def _drop_nan(D):
+    # drop the rows with a NaN; D may also be 1D
+    return D[~np.isnan(D).reshape(D.shape[0], -1).any(axis=1)]
+
+
+def _bin_edges(datasets, bins, drop_nan=False):
+    """
+    Edges of bins equal-width bins per column, spanning all the rows of
+    datasets as np.histogramdd picks them for the rows concatenated, found
+    in one pass over the chunks. Raises ValueError if the range is not finite.
+    """
+    low, high = [], []
+    for D in datasets:
+        for chunk in _chunks(D):
+            chunk = _drop_nan(chunk) if drop_nan else chunk
+            if chunk.shape[0]:
+                chunk = chunk.reshape(chunk.shape[0], -1)
+                low.append(chunk.min(axis=0))
+                high.append(chunk.max(axis=0))
+    if not low:
+        raise ValueError('no observations to bin')
+    low, high = np.min(low, axis=0), np.max(high, axis=0)
+    if not (np.all(np.isfinite(low)) and np.all(np.isfinite(high))):
+        raise ValueError('range of [{}, {}] is not finite'.format(low, high))
+
+    if np.ndim(bins) == 0:
+        bins = [bins] * low.shape[0]
+    equal = low == high
+    low = np.where(equal, low - 0.5, low)
+    high = np.where(equal, high + 0.5, high)
+    return [np.linspace(l, h, b + 1) for l, h, b in zip(low, high, bins)]
+
+
+def _histogram(D, edges, drop_nan=False):
+    """ histogram of the rows of D over edges, accumulated chunk by chunk """
+    H = np.zeros([len(e) - 1 for e in edges])
+    for chunk in _chunks(D):
+        chunk = _drop_nan(chunk) if drop_nan else chunk
+        H += np.histogramdd(chunk.reshape(chunk.shape[0], len(edges)),
+                            bins=edges)[0]
+    return H
+
+
 def _calculate_emd_2D(D1, D2, bins=(40, 40)):
     """
     Args:
     -----
         D1, D2: two np arrays with potentially differing 
-            numbers of rows, but two columns. The empirical 
-            distributions you want a similarity over
+            numbers of rows, but two columns, or LazyDatasets of two
+            columns. The empirical distributions you want a similarity over
         bins: number of bins in each dim
     """
 
     try:
-        _, bx, by = np.histogram2d(*np.concatenate((D1, D2), axis=0).T, bins=bins)
-    except ValueError, e:
-        print '[ERROR] found here'
+        edges = _bin_edges((D1, D2), bins)
+    except ValueError:
+        print('[ERROR] found here')
 
         raise AnnoyingError('Fuck this')
 
-    H1, _, _ = np.histogram2d(*D1.T, bins=(bx, by))
-    H2, _, _ = np.histogram2d(*D2.T, bins=(bx, by))
+    H1 = _histogram(D1, edges)
+    H2 = _histogram(D2, edges)
 
     H1 /= H1.sum()
     H2 /= H2.sum()
 
-    _x, _y = np.indices(H1.shape)
-
-    coords = np.array(zip(_x.ravel(), _y.ravel()))
-
-    D = distance(coords, coords)
-
-    return emd(H1.ravel(), H2.ravel(), D)
+    return emd(H1.ravel(), H2.ravel(), _ground_distance(H1.shape))
 
 
 def _calculate_emd_1D(D1, D2, bins=40):
     """
     Args:
     -----
-        D1, D2: two np arrays with potentially differing 
-            numbers of rows, but two columns. The empirical 
-            distributions you want a similarity over
+        D1, D2: two np arrays or one-column LazyDatasets with potentially
+            differing numbers of rows. Rows with NaNs are dropped.
+            The empirical distributions you want a similarity over
         bins: number of bins in each dim
     """
 
-    D1 = D1[np.isnan(D1).sum(axis=-1) < 1]
-    D2 = D2[np.isnan(D2).sum(axis=-1) < 1]
-
     try:
-        _, bx = np.histogram(np.concatenate((D1, D2), axis=0), bins=bins)
-    except ValueError, e:
-        print '[ERROR] found here'
+        edges = _bin_edges((D1, D2), [bins], drop_nan=True)
+    except ValueError:
+        print('[ERROR] found here')
 
         raise AnnoyingError('Fuck this')
 
-    H1, _ = np.histogram(D1, bins=bx, normed=True)
-    H2, _ = np.histogram(D2, bins=bx, normed=True)
+    H1 = _histogram(D1, edges, drop_nan=True)
+    H2 = _histogram(D2, edges, drop_nan=True)
 
     H1 /= H1.sum()
     H2 /= H2.sum()
 
-    # _x, _y = np.indices(H1.shape)
-
-    D = toeplitz(range(len(H1))).astype(float)
-
-    # print coords
+    return emd(H1, H2, _ground_distance(H1.shape))
 
-    # D = distance(coords, coords)
 
-    return emd(H1, H2, D)
+def _by_class(D, signal, value):
+    """
+    The rows of D of one class. For a LazyDataset, signal names its label
+    column, which is filtered on and left out.
+    """
+    if isinstance(D, LazyDataset):
+        return D.where(signal, value).project(
+            *[name for name in D.names if name != signal])
+    return D[signal == value]
 
 
 def calculate_metric(D1, signal1, D2, signal2, bins=(40, 40)):
@@ -89,23 +149,27 @@ def calculate_metric(D1, signal1, D2, signal2, bins=(40, 40)):
             second distribution
 
         bins: number of bins in each dim
+
+        D1 and D2 may also be LazyDatasets, with signal1 and signal2 the
+        names of their label columns; the EMD is then over their other
+        columns, and computed chunk by chunk
     """
 
     try:
-        if len(D1.shape) == 2:
-            sig_cond = _calculate_emd_2D(D1[signal1 == True], D2[
-                                         signal2 == True], bins=bins)
-            bkg_cond = _calculate_emd_2D(D1[signal1 == False], D2[
-                                         signal2 == False], bins=bins)
+        sig1 = _by_class(D1, signal1, True)
+        sig2 = _by_class(D2, signal2, True)
+        bkg1 = _by_class(D1, signal1, False)
+        bkg2 = _by_class(D2, signal2, False)
+        if sig1.ndim == 2:
+            sig_cond = _calculate_emd_2D(sig1, sig2, bins=bins)
+            bkg_cond = _calculate_emd_2D(bkg1, bkg2, bins=bins)
 
         else:
             if not isinstance(bins, int):
                 bins = bins[0]
-            sig_cond = _calculate_emd_1D(D1[signal1 == True], D2[
-                                         signal2 == True], bins=bins)
-            bkg_cond = _calculate_emd_1D(D1[signal1 == False], D2[
-                                         signal2 == False], bins=bins)
+            sig_cond = _calculate_emd_1D(sig1, sig2, bins=bins)
+            bkg_cond = _calculate_emd_1D(bkg1, bkg2, bins=bins)
 
         return max(sig_cond, bkg_cond)
-    except AnnoyingError, a:
+    except AnnoyingError:
         return 999
@@ -16,13 +16,14 @@ from keras.layers.local import LocallyConnected2D
 
 from keras.models import Model, Sequential
 
-from .ops import minibatch_discriminator, minibatch_output_shape, Dense3D
+from .ops import (minibatch_discriminator, chunked_minibatch_discriminator,
+                  minibatch_output_shape, Dense3D)
 
 
 K.set_image_dim_ordering('tf')
 
 
-def discriminator():
+def discriminator(minibatch_chunk_size=None):
 
     image = Input(shape=(25, 25, 1))
 
@@ -54,8 +55,16 @@ def discriminator():
     # creates the kernel space for the minibatch discrimination
     K_x = Dense3D(nb_features, vspace_dim)(dnn_out)
 
-    minibatch_featurizer = Lambda(minibatch_discriminator,
-                                  output_shape=minibatch_output_shape)
+    if minibatch_chunk_size:
+        # same features, bounded memory at large batch sizes
+        minibatch_featurizer = Lambda(
+            chunked_minibatch_discriminator,
+            output_shape=minibatch_output_shape,
+            arguments={'chunk_size': minibatch_chunk_size}
+        )
+    else:
+        minibatch_featurizer = Lambda(minibatch_discriminator,
+                                      output_shape=minibatch_output_shape)
 
     # concat the minibatch features with the normal ones
     features = merge([
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: gan.py
+description: assembles and compiles the generator, discriminator and combined
+    model of the ACGAN setup of [arXiv/1701.05927] for any architecture
+"""
+
+from __future__ import print_function
+
+from contextlib import contextmanager
+
+from keras.layers import Input
+from keras.models import Model
+from keras.optimizers import Adam
+
+
+@contextmanager
+def _untimed(name):
+    yield
+
+
+def build_gan(build_generator, build_discriminator, latent_size, adam_lr,
+              adam_beta_1, minibatch_chunk_size=None, timer=None):
+    """
+    Args:
+    -----
+        build_generator, build_discriminator: the generator and discriminator
+            functions of one of the networks/ modules, or of
+            networks.registry.builders
+        latent_size: size of the latent space
+        adam_lr, adam_beta_1: Adam settings of all three models
+        minibatch_chunk_size: passed on to build_discriminator
+        timer: a networks.registry.PhaseTimer to record the time spent
+            building and compiling in
+
+    Returns:
+    --------
+        generator, discriminator, combined: compiled models, where combined
+            trains the generator through a frozen discriminator
+    """
+    phase = _untimed if timer is None else timer.phase
+
+    # build the discriminator
+    print('[INFO] Building discriminator')
+    with phase('build discriminator'):
+        discriminator = build_discriminator(
+            minibatch_chunk_size=minibatch_chunk_size)
+    with phase('compile discriminator'):
+        discriminator.compile(
+            optimizer=Adam(lr=adam_lr, beta_1=adam_beta_1),
+            loss=['binary_crossentropy', 'binary_crossentropy']
+        )
+
+    # build the generator
+    print('[INFO] Building generator')
+    with phase('build generator'):
+        generator = build_generator(latent_size)
+    with phase('compile generator'):
+        generator.compile(
+            optimizer=Adam(lr=adam_lr, beta_1=adam_beta_1),
+            loss='binary_crossentropy'
+        )
+
+    with phase('build and compile combined'):
+        combined = _combine(generator, discriminator, latent_size, adam_lr,
+                            adam_beta_1)
+
+    return generator, discriminator, combined
+
+
+def _combine(generator, discriminator, latent_size, adam_lr, adam_beta_1):
+    """ the generator through a frozen discriminator, compiled """
+    image_class = Input(shape=(1, ), name='combined_aux', dtype='int32')
+    latent = Input(shape=(latent_size, ), name='combined_z')
+
+    # get a fake image
+    fake = generator([latent, image_class])
+
+    # we only want to be able to train generation for the combined model
+    discriminator.trainable = False
+    fake, aux = discriminator(fake)
+    combined = Model(
+        input=[latent, image_class],
+        output=[fake, aux],
+        name='combined_model'
+    )
+
+    combined.compile(
+        optimizer=Adam(lr=adam_lr, beta_1=adam_beta_1),
+        loss=['binary_crossentropy', 'binary_crossentropy']
+    )
+
+    return combined
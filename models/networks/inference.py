@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: inference.py
+description: inference-time graph optimization for [arXiv/1701.05927]
+    networks. Frozen BatchNormalization statistics are folded into the
+    weights of a neighbouring linear layer wherever that is exact, and
+    Dropout and other layers that are the identity at test time are removed.
+"""
+
+import json
+
+import numpy as np
+
+import keras.backend as K
+from keras.engine.topology import InputLayer, Container
+from keras.layers import (Input, Dense, Reshape, Flatten, Dropout,
+                          BatchNormalization, Activation, Embedding)
+from keras.layers.advanced_activations import LeakyReLU
+from keras.layers.convolutional import (Conv2D, Deconv2D, ZeroPadding2D,
+                                        UpSampling2D, AveragePooling2D)
+from keras.layers.local import LocallyConnected2D
+from keras.layers.noise import GaussianNoise, GaussianDropout
+from keras.models import Model, Sequential, load_model
+
+from .ops import (ChannelAffine, Dense3D, FastLocallyConnected2D,
+                  minibatch_discriminator, chunked_minibatch_discriminator,
+                  minibatch_output_shape, top_k_pixels,
+                  top_k_pixels_output_shape)
+
+
+# layers that are the identity when the learning phase is 0
+_INFERENCE_NOOPS = (Dropout, GaussianNoise, GaussianDropout)
+
+CUSTOM_OBJECTS = {
+    'ChannelAffine': ChannelAffine,
+    'Dense3D': Dense3D,
+    'FastLocallyConnected2D': FastLocallyConnected2D,
+    'minibatch_discriminator': minibatch_discriminator,
+    'chunked_minibatch_discriminator': chunked_minibatch_discriminator,
+    'minibatch_output_shape': minibatch_output_shape,
+    'top_k_pixels': top_k_pixels,
+    'top_k_pixels_output_shape': top_k_pixels_output_shape
+}
+
+
+class _Spec(object):
+
+    """
+    A layer in a chain that is being folded. `weights` is None as long as
+    the layer is untouched, in which case the original layer is reused.
+    """
+
+    def __init__(self, layer, weights=None):
+        self.layer = layer
+        self.weights = weights
+
+    def get_weights(self):
+        if self.weights is None:
+            self.weights = self.layer.get_weights()
+        return self.weights
+
+
+def _is_noop(layer):
+    if isinstance(layer, _INFERENCE_NOOPS):
+        return True
+    if isinstance(layer, Activation):
+        return layer.get_config()['activation'] == 'linear'
+    if isinstance(layer, ZeroPadding2D):
+        return not any(_padding(layer))
+    if isinstance(layer, UpSampling2D):
+        return tuple(layer.size) == (1, 1)
+    return False
+
+
+def _padding(layer):
+    return (layer.top_pad, layer.bottom_pad, layer.left_pad, layer.right_pad)
+
+
+def _bn_affine(layer):
+    """ returns the (scale, shift) a frozen BatchNormalization applies """
+    config = layer.get_config()
+    if config['mode'] != 0 or config['axis'] not in (-1, len(layer.input_shape) - 1):
+        return None
+    gamma, beta, mean, var = layer.get_weights()
+    scale = gamma / np.sqrt(var + config['epsilon'])
+    return scale, beta - mean * scale
+
+
+def _output_axis(layer):
+    """ axis of the kernel that indexes output channels, None if unknown """
+    if isinstance(layer, Deconv2D):
+        return 2 if layer.dim_ordering == 'tf' else None
+    if isinstance(layer, (Conv2D, LocallyConnected2D)):
+        return -1 if layer.dim_ordering == 'tf' else None
+    if isinstance(layer, Dense):
+        return -1
+    return None
+
+
+def _fold_backward(spec, scale, shift):
+    """ folds an affine transform applied directly to the output of spec """
+    axis = _output_axis(spec.layer)
+    if axis is None or not spec.layer.bias:
+        return False
+    # the transform comes after the layer's activation, so it can only move
+    # into the weights if there is none
+    if spec.layer.get_config().get('activation', 'linear') != 'linear':
+        return False
+    W, b = spec.get_weights()
+    bshape = [1] * W.ndim
+    bshape[axis] = -1
+    spec.weights = [W * scale.reshape(bshape), b * scale + shift]
+    return True
+
+
+def _patches(x, nb_row, nb_col, stride_row, stride_col, output_row, output_col):
+    """ (H, W, C) => (output_row * output_col, nb_row * nb_col * C) """
+    return np.array([
+        x[i * stride_row:i * stride_row + nb_row,
+          j * stride_col:j * stride_col + nb_col].ravel()
+        for i in range(output_row) for j in range(output_col)
+    ])
+
+
+def _fold_forward(specs, start, bn, scale, shift):
+    """
+    Folds an affine transform into the next linear layer after specs[start],
+    looking through channel-wise layers. `coverage` tracks, per spatial
+    position, how much of the shift reaches it (padding contributes none).
+    """
+    shape = bn.input_shape[1:]
+    coverage = np.ones(shape[:-1])
+    flat = False
+
+    for spec in specs[start:]:
+        layer = spec.layer
+        if isinstance(layer, ZeroPadding2D):
+            top, bottom, left, right = _padding(layer)
+            coverage = np.pad(coverage, ((top, bottom), (left, right)),
+                              mode='constant')
+        elif isinstance(layer, UpSampling2D):
+            coverage = np.repeat(np.repeat(coverage, layer.size[0], axis=0),
+                                 layer.size[1], axis=1)
+        elif isinstance(layer, AveragePooling2D):
+            if layer.border_mode != 'valid':
+                return False
+            (pr, pc), (sr, sc) = layer.pool_size, layer.strides
+            rows = (coverage.shape[0] - pr) // sr + 1
+            cols = (coverage.shape[1] - pc) // sc + 1
+            coverage = _patches(coverage[..., np.newaxis], pr, pc, sr, sc,
+                                rows, cols).mean(axis=-1).reshape(rows, cols)
+        elif isinstance(layer, Flatten):
+            flat = True
+        elif isinstance(layer, LocallyConnected2D) and not flat:
+            if layer.dim_ordering != 'tf' or not layer.bias:
+                return False
+            W, b = spec.get_weights()
+            output_row, output_col = layer.output_shape[1:3]
+            offset = _patches(coverage[..., np.newaxis] * shift,
+                              layer.nb_row, layer.nb_col,
+                              layer.subsample[0], layer.subsample[1],
+                              output_row, output_col)
+            W_scaled = W * np.tile(scale, layer.nb_row * layer.nb_col)[:, np.newaxis]
+            b_shifted = b + np.einsum('pk,pkf->pf', offset, W).reshape(b.shape)
+            spec.weights = [W_scaled, b_shifted]
+            return True
+        elif isinstance(layer, Conv2D) and not isinstance(layer, Deconv2D) and not flat:
+            # a shared bias is only correct if the shift reaches every
+            # input position in full, i.e. there is no padding anywhere
+            if (layer.dim_ordering != 'tf' or not layer.bias or
+                    layer.border_mode != 'valid' or not np.all(coverage == 1)):
+                return False
+            W, b = spec.get_weights()
+            spec.weights = [
+                W * scale.reshape(1, 1, -1, 1),
+                b + np.einsum('rcif,i->f', W, shift)
+            ]
+            return True
+        elif isinstance(layer, Dense) and (flat or len(shape) == 1):
+            if not layer.bias:
+                return False
+            W, b = spec.get_weights()
+            nb_positions = W.shape[0] // scale.shape[0]
+            spec.weights = [
+                W * np.tile(scale, nb_positions)[:, np.newaxis],
+                b + np.dot((coverage[..., np.newaxis] * shift).ravel(), W)
+            ]
+            return True
+        else:
+            return False
+
+    return False
+
+
+def _fold_chain(layers):
+    """ folds a linear chain of layers into a list of _Spec """
+    specs = [_Spec(layer) for layer in layers if not _is_noop(layer)]
+
+    folded = []
+    for i, spec in enumerate(specs):
+        if not isinstance(spec.layer, BatchNormalization):
+            folded.append(spec)
+            continue
+
+        bn = spec.layer
+        affine = _bn_affine(bn)
+        if affine is None:
+            folded.append(spec)
+            continue
+
+        scale, shift = affine
+        if folded and _fold_backward(folded[-1], scale, shift):
+            continue
+        if _fold_forward(specs, i + 1, bn, scale, shift):
+            continue
+
+        # nothing to fold into, so at least drop the batch statistics
+        folded.append(_Spec(ChannelAffine(name=bn.name), [scale, shift]))
+
+    return folded
+
+
+def _clone(layer):
+    if isinstance(layer, ChannelAffine):
+        return layer
+    return layer.__class__.from_config(layer.get_config())
+
+
+def _apply(spec, x):
+    """ calls the (possibly re-instantiated) layer of spec on x """
+    if spec.weights is None:
+        return spec.layer(x)
+    layer = _clone(spec.layer)
+    y = layer(x)
+    layer.set_weights(spec.weights)
+    return y
+
+
+def _as_chain(model):
+    """ the layers of model if its graph is a single linear chain """
+    if isinstance(model, Sequential):
+        return model.layers
+    if len(model.inputs) != 1 or len(model.outputs) != 1:
+        return None
+    layers = []
+    for depth in sorted(model.nodes_by_depth.keys(), reverse=True):
+        nodes = model.nodes_by_depth[depth]
+        if len(nodes) != 1 or len(nodes[0].input_tensors) > 1:
+            return None
+        if not isinstance(nodes[0].outbound_layer, InputLayer):
+            layers.append(nodes[0].outbound_layer)
+    return layers
+
+
+def optimize_for_inference(model):
+    """
+    Returns a slimmer copy of a trained model for test-time use only.
+
+    BatchNormalization layers are folded into the preceding (or, looking
+    through padding, upsampling, pooling and flattening, the following)
+    linear layer when the result is exact, and are otherwise replaced by a
+    ChannelAffine. Dropout-like layers are removed. Nested models are
+    optimized recursively. Layers that don't change are shared with model.
+    """
+    chain = _as_chain(model)
+
+    if chain is not None:
+        x = image = Input(batch_shape=model.input_shape,
+                          dtype=K.dtype(model.input))
+        for spec in _fold_chain(chain):
+            x = _apply(spec, x)
+        return Model(input=image, output=x, name=model.name)
+
+    tensors = {}
+    inputs = []
+    for x in model.inputs:
+        layer = x._keras_history[0]
+        inputs.append(Input(batch_shape=layer.batch_input_shape,
+                            dtype=layer.input_dtype, name=layer.name))
+        tensors[id(x)] = inputs[-1]
+
+    optimized = {}
+    for depth in sorted(model.nodes_by_depth.keys(), reverse=True):
+        for node in model.nodes_by_depth[depth]:
+            layer = node.outbound_layer
+            if isinstance(layer, InputLayer):
+                continue
+
+            if id(layer) not in optimized:
+                if isinstance(layer, Container):
+                    optimized[id(layer)] = optimize_for_inference(layer)
+                elif _is_noop(layer):
+                    optimized[id(layer)] = None
+                else:
+                    optimized[id(layer)] = _fold_chain([layer])[0]
+
+            x = [tensors[id(t)] for t in node.input_tensors]
+            x = x[0] if len(x) == 1 else x
+
+            replacement = optimized[id(layer)]
+            if replacement is None:
+                y = x
+            elif isinstance(replacement, _Spec):
+                y = _apply(replacement, x)
+            else:
+                y = replacement(x)
+
+            y = y if isinstance(y, list) else [y]
+            for t, t_new in zip(node.output_tensors, y):
+                tensors[id(t)] = t_new
+
+    return Model(input=inputs, output=[tensors[id(x)] for x in model.outputs],
+                 name=model.name)
+
+
+def load_inference_model(filepath):
+    """ loads a model written with .save() by export.py """
+    return load_model(filepath, custom_objects=CUSTOM_OBJECTS)
+
+
+def _describe(layer):
+    """ (op, weights) describing layer for runtime.NumpyGenerator """
+    config = layer.get_config()
+    if isinstance(layer, Dense):
+        return {'op': 'dense', 'activation': config['activation']}, \
+            zip(('W', 'b'), layer.get_weights())
+    if isinstance(layer, (Conv2D, LocallyConnected2D)) and \
+            not isinstance(layer, Deconv2D) and layer.dim_ordering == 'tf':
+        op = {'activation': config['activation'],
+              'subsample': list(layer.subsample)}
+        if isinstance(layer, Conv2D):
+            op.update(op='conv2d', border_mode=layer.border_mode)
+        else:
+            op.update(op='locally_connected2d', nb_row=layer.nb_row,
+                      nb_col=layer.nb_col,
+                      output_shape=list(layer.output_shape[1:3]))
+        return op, zip(('W', 'b'), layer.get_weights())
+    if isinstance(layer, Reshape):
+        return {'op': 'reshape', 'target_shape': list(layer.target_shape)}, []
+    if isinstance(layer, Flatten):
+        return {'op': 'reshape', 'target_shape': [-1]}, []
+    if isinstance(layer, UpSampling2D):
+        return {'op': 'upsampling2d', 'size': list(layer.size)}, []
+    if isinstance(layer, ZeroPadding2D):
+        return {'op': 'zeropadding2d', 'padding': list(_padding(layer))}, []
+    if isinstance(layer, LeakyReLU):
+        return {'op': 'leakyrelu', 'alpha': float(layer.alpha)}, []
+    if isinstance(layer, Activation):
+        return {'op': 'activation', 'activation': config['activation']}, []
+    if isinstance(layer, ChannelAffine):
+        return {'op': 'affine'}, zip(('scale', 'shift'), layer.get_weights())
+    raise ValueError('No NumPy runtime op for layer {} ({})'.format(
+        layer.name, layer.__class__.__name__))
+
+
+def save_npz(generator, filepath):
+    """
+    Writes an optimized generator built like those in lagan.py and fcn.py (a
+    class embedding in a hadamard product with z, followed by a chain of
+    layers) to the flat .npz format that runtime.NumpyGenerator reads.
+    """
+    embeddings = [l for l in generator.layers if isinstance(l, Embedding)]
+    chains = [l for l in generator.layers if isinstance(l, Container)]
+    if len(embeddings) != 1 or len(chains) != 1:
+        raise ValueError('Expected a generator with one class embedding and '
+                         'one sub-model')
+
+    chain = _as_chain(chains[0])
+    if chain is None:
+        raise ValueError('Sub-model {} is not a chain'.format(chains[0].name))
+
+    params = {'embedding/W': embeddings[0].get_weights()[0]}
+    ops = []
+    for i, layer in enumerate(chain):
+        op, weights = _describe(layer)
+        for name, w in weights:
+            op[name] = '{}/{}'.format(i, name)
+            params[op[name]] = w
+        ops.append(op)
+
+    params = {k: v.astype(np.float32) for k, v in params.items()}
+    # write through a file object so numpy doesn't append a .npz suffix
+    with open(filepath, 'wb') as f:
+        np.savez(f, __ops__=np.array(json.dumps(ops)), **params)
@@ -12,17 +12,17 @@ from keras.layers import (Input, Dense, Reshape, Flatten, Lambda, merge,
 from keras.layers.advanced_activations import LeakyReLU
 from keras.layers.convolutional import (UpSampling2D, Conv2D, ZeroPadding2D,
                                         AveragePooling2D)
-from keras.layers.local import LocallyConnected2D
 
 from keras.models import Model, Sequential
 
-from .ops import minibatch_discriminator, minibatch_output_shape, Dense3D
+from .ops import (minibatch_discriminator, chunked_minibatch_discriminator,
+                  minibatch_output_shape, Dense3D, FastLocallyConnected2D)
 
 
 K.set_image_dim_ordering('tf')
 
 
-def discriminator():
+def discriminator(minibatch_chunk_size=None):
 
     image = Input(shape=(25, 25, 1))
 
@@ -35,14 +35,15 @@ def discriminator():
     # block 2: 'same' bordered 5x5 locally connected block with batchnorm and
     # 2x2 subsampling
     x = ZeroPadding2D((2, 2))(x)
-    x = LocallyConnected2D(8, 5, 5, border_mode='valid', subsample=(2, 2))(x)
+    x = FastLocallyConnected2D(8, 5, 5,
+                               border_mode='valid', subsample=(2, 2))(x)
     x = LeakyReLU()(x)
     x = BatchNormalization()(x)
     x = Dropout(0.2)(x)
 
     # block 2: 'same' bordered 5x5 locally connected block with batchnorm
     x = ZeroPadding2D((2, 2))(x)
-    x = LocallyConnected2D(8, 5, 5, border_mode='valid')(x)
+    x = FastLocallyConnected2D(8, 5, 5, border_mode='valid')(x)
     x = LeakyReLU()(x)
     x = BatchNormalization()(x)
     x = Dropout(0.2)(x)
@@ -50,7 +51,8 @@ def discriminator():
     # block 3: 'same' bordered 3x3 locally connected block with batchnorm and
     # 2x2 subsampling
     x = ZeroPadding2D((1, 1))(x)
-    x = LocallyConnected2D(8, 3, 3, border_mode='valid', subsample=(2, 2))(x)
+    x = FastLocallyConnected2D(8, 3, 3,
+                               border_mode='valid', subsample=(2, 2))(x)
     x = LeakyReLU()(x)
     x = BatchNormalization()(x)
     x = Dropout(0.2)(x)
@@ -73,8 +75,16 @@ def discriminator():
     # creates the kernel space for the minibatch discrimination
     K_x = Dense3D(nb_features, vspace_dim)(dnn_out)
 
-    minibatch_featurizer = Lambda(minibatch_discriminator,
-                                  output_shape=minibatch_output_shape)
+    if minibatch_chunk_size:
+        # same features, bounded memory at large batch sizes
+        minibatch_featurizer = Lambda(
+            chunked_minibatch_discriminator,
+            output_shape=minibatch_output_shape,
+            arguments={'chunk_size': minibatch_chunk_size}
+        )
+    else:
+        minibatch_featurizer = Lambda(minibatch_discriminator,
+                                      output_shape=minibatch_output_shape)
 
     # concat the minibatch features with the normal ones
     features = merge([
@@ -105,15 +115,15 @@ def generator(latent_size, return_intermediate=False):
 
         # block 2: (None, 14, 14, 64) => (None, 28, 28, 6),
         ZeroPadding2D((2, 2)),
-        LocallyConnected2D(6, 5, 5, init='he_uniform'),
+        FastLocallyConnected2D(6, 5, 5, init='he_uniform'),
         LeakyReLU(),
         BatchNormalization(),
         UpSampling2D(size=(2, 2)),
 
         # block 3: (None, 28, 28, 6) => (None, 25, 25, 1),
-        LocallyConnected2D(6, 3, 3, init='he_uniform'),
+        FastLocallyConnected2D(6, 3, 3, init='he_uniform'),
         LeakyReLU(),
-        LocallyConnected2D(1, 2, 2, bias=False, init='glorot_normal'),
+        FastLocallyConnected2D(1, 2, 2, bias=False, init='glorot_normal'),
         Activation('relu')
     ])
 
@@ -6,9 +6,12 @@ description: ancillary ops for [arXiv/1701.05927]
 author: Luke de Oliveira (lukedeoliveira@lbl.gov)
 """
 
+import numpy as np
+
 import keras.backend as K
 from keras.engine import InputSpec, Layer
 from keras import initializations, regularizers, constraints, activations
+from keras.layers.local import LocallyConnected2D
 
 
 def minibatch_discriminator(x):
@@ -19,6 +22,74 @@ def minibatch_discriminator(x):
     return K.sum(K.exp(-l1_norm), axis=2)
 
 
+def chunked_minibatch_discriminator(x, chunk_size=64):
+    """
+    Computes the same features as minibatch_discriminator, for chunk_size
+    rows of the batch at a time, so the pairwise difference tensor only ever
+    exists as a (chunk_size, F, V, B) block: memory grows linearly with the
+    batch size B rather than quadratically.
+
+    The gradient is computed block by block in the same way. With the
+    difference tensor d and e_kjf = exp(-sum_v |d_kjfv|), the gradient of
+    sum_bf g_bf * features_bf with respect to x_kfv is
+
+        -sum_j (g_kf + g_jf) * e_kjf * sign(d_kjfv)
+
+    so nothing of the forward pass has to be kept for it. Needs the
+    TensorFlow backend (tf.custom_gradient, TensorFlow >= 1.7).
+
+    Everything is defined in here, as Lambda layers serialize only the
+    function itself.
+    """
+    import tensorflow as tf
+
+    _, nb_features, vspace_dim = K.int_shape(x)
+
+    def blocks(t):
+        """ t padded with zero rows and split into blocks of chunk_size """
+        nb_rows = tf.shape(t)[0]
+        padding = (chunk_size - nb_rows % chunk_size) % chunk_size
+        t = tf.pad(t, [[0, padding]] + [[0, 0]] * (len(t.shape) - 1))
+        return tf.reshape(t, tf.concat([[-1, chunk_size], tf.shape(t)[1:]], 0))
+
+    def unblock(t, nb_rows, shape):
+        return tf.reshape(t, [-1] + shape)[:nb_rows]
+
+    @tf.custom_gradient
+    def features(x):
+        nb_rows = tf.shape(x)[0]
+        # (F, V, B), every row the blocks are compared with
+        x_t = tf.transpose(x, [1, 2, 0])
+
+        def block_diffs(rows):
+            diffs = tf.expand_dims(rows, 3) - tf.expand_dims(x_t, 0)
+            return diffs, tf.exp(-tf.reduce_sum(tf.abs(diffs), axis=2))
+
+        def block_features(rows):
+            return tf.reduce_sum(block_diffs(rows)[1], axis=2)
+
+        out = unblock(tf.map_fn(block_features, blocks(x), back_prop=False),
+                      nb_rows, [nb_features])
+
+        def grad(g):
+            g_t = tf.transpose(g)
+
+            def block_grad(args):
+                rows, g_rows = args
+                diffs, e = block_diffs(rows)
+                w = (tf.expand_dims(g_rows, 2) + tf.expand_dims(g_t, 0)) * e
+                return -tf.reduce_sum(tf.expand_dims(w, 2) * tf.sign(diffs),
+                                      axis=3)
+
+            dx = tf.map_fn(block_grad, (blocks(x), blocks(g)), dtype=x.dtype,
+                           back_prop=False)
+            return unblock(dx, nb_rows, [nb_features, vspace_dim])
+
+        return out, grad
+
+    return features(x)
+
+
 def minibatch_output_shape(input_shape):
     """ Computes output shape for a minibatch discrimination layer"""
     shape = list(input_shape)
@@ -26,6 +97,33 @@ def minibatch_output_shape(input_shape):
     return tuple(shape[:2])
 
 
+def top_k_pixels(x, nb_pixels=64):
+    """
+    Sparse image from (batch, 2 * P) pixel logits followed by pixel
+    intensities: the intensities of the nb_pixels pixels with the largest
+    logits, gated by the sigmoid of their logit so the logits get gradients,
+    are scattered into an otherwise empty (batch, P) grid
+    """
+    import tensorflow as tf
+
+    nb_grid = K.int_shape(x)[1] // 2
+    logits, intensities = x[:, :nb_grid], x[:, nb_grid:]
+    _, pixels = tf.nn.top_k(logits, k=nb_pixels, sorted=False)
+
+    # (batch, nb_pixels, 2) indices of the kept pixels into the grid
+    rows = tf.tile(tf.expand_dims(tf.range(tf.shape(x)[0]), 1), [1, nb_pixels])
+    index = tf.stack([rows, pixels], axis=2)
+    values = tf.gather_nd(intensities * tf.sigmoid(logits), index)
+    return tf.scatter_nd(index, values, tf.shape(logits))
+
+
+def top_k_pixels_output_shape(input_shape):
+    """ Computes output shape for the top_k_pixels op """
+    shape = list(input_shape)
+    assert len(shape) == 2  # only valid for 2D tensors
+    return (shape[0], shape[1] // 2)
+
+
 class Dense3D(Layer):
 
     """
@@ -115,3 +213,90 @@ class Dense3D(Layer):
         }
         base_config = super(Dense3D, self).get_config()
         return dict(list(base_config.items()) + list(config.items()))
+
+
+class ChannelAffine(Layer):
+
+    """
+    A frozen per-channel affine transform, x * scale + shift, along the last
+    axis. Used to stand in for an inference-time BatchNormalization that
+    cannot be folded into a neighbouring linear layer.
+    """
+
+    def __init__(self, weights=None, **kwargs):
+        self.initial_weights = weights
+        super(ChannelAffine, self).__init__(**kwargs)
+
+    def build(self, input_shape):
+        nb_channels = input_shape[-1]
+
+        self.scale = self.add_weight(
+            (nb_channels, ),
+            initializer='one',
+            name='{}_scale'.format(self.name),
+            trainable=False
+        )
+        self.shift = self.add_weight(
+            (nb_channels, ),
+            initializer='zero',
+            name='{}_shift'.format(self.name),
+            trainable=False
+        )
+
+        if self.initial_weights is not None:
+            self.set_weights(self.initial_weights)
+            del self.initial_weights
+        self.built = True
+
+    def call(self, x, mask=None):
+        return x * self.scale + self.shift
+
+    def get_output_shape_for(self, input_shape):
+        return input_shape
+
+
+class FastLocallyConnected2D(LocallyConnected2D):
+
+    """
+    A drop-in LocallyConnected2D with identical weights, where the patches
+    for all output locations are extracted with a single gather and
+    contracted with one batched matmul, instead of being sliced out one
+    location at a time.
+    """
+
+    def build(self, input_shape):
+        super(FastLocallyConnected2D, self).build(input_shape)
+        if self.dim_ordering != 'tf':
+            return
+
+        _, rows, cols, channels = input_shape
+        stride_row, stride_col = self.subsample
+
+        # flat (row, col, channel) index of every element of every patch,
+        # laid out the same way LocallyConnected2D flattens them
+        r, c, ch = np.meshgrid(np.arange(self.nb_row), np.arange(self.nb_col),
+                               np.arange(channels), indexing='ij')
+        i, j = np.meshgrid(np.arange(self.output_row),
+                           np.arange(self.output_col), indexing='ij')
+        row = i.reshape(-1, 1) * stride_row + r.reshape(1, -1)
+        col = j.reshape(-1, 1) * stride_col + c.reshape(1, -1)
+        self.patch_index = ((row * cols + col) * channels +
+                            ch.reshape(1, -1)).astype('int32')
+
+    def call(self, x, mask=None):
+        if self.dim_ordering != 'tf':
+            return super(FastLocallyConnected2D, self).call(x, mask)
+
+        _, feature_dim, nb_filter = self.W_shape
+
+        # (batch, rows * cols * channels) => (locations, feature_dim, batch)
+        patches = K.gather(K.transpose(K.batch_flatten(x)), self.patch_index)
+
+        output = K.batch_dot(K.permute_dimensions(patches, (0, 2, 1)), self.W)
+        output = K.reshape(K.permute_dimensions(output, (1, 0, 2)),
+                           (-1, self.output_row, self.output_col, nb_filter))
+
+        if self.bias:
+            output += K.reshape(self.b, (1, self.output_row, self.output_col,
+                                         nb_filter))
+        return self.activation(output)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: registry.py
+description: looks up the architectures in networks/ by name, importing
+    their modules only when first asked for, and caches the built
+    architectures as Keras JSON so later runs skip the Python that builds
+    them. Also times the startup phases of scripts that build models.
+"""
+
+from __future__ import print_function
+
+from contextlib import contextmanager
+import hashlib
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+NETWORKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MODELS = ('lagan', 'fcn', 'hybrid', 'dcgan', 'sparse')
+
+# other network modules a model's module builds on
+DEPENDS = {'sparse': ('lagan', )}
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.keras', 'lagan',
+                         'architectures')
+
+_modules = {}
+
+
+def get_module(model):
+    """ networks.<model>, imported on first use """
+    if model not in MODELS:
+        raise ValueError('Unknown model {}, expected one of {}'.format(
+            model, ', '.join(MODELS)))
+    if model not in _modules:
+        _modules[model] = importlib.import_module('networks.{}'.format(model))
+    return _modules[model]
+
+
+def code_hash(model):
+    """
+    md5 of the source that defines model: its module, the modules it builds
+    on and ops.py. Cached architectures of older code are never used.
+    """
+    md5 = hashlib.md5()
+    for name in (model, ) + DEPENDS.get(model, ()) + ('ops', ):
+        with open(os.path.join(NETWORKS_DIR, '{}.py'.format(name)), 'rb') as f:
+            md5.update(f.read())
+    return md5.hexdigest()
+
+
+def _cache_file(model, network, **kwargs):
+    import keras
+    import keras.backend as K
+
+    # Lambda layers serialize their functions as bytecode, so the Python
+    # version is part of the key
+    key = json.dumps([model, network, sorted(kwargs.items()), code_hash(model),
+                      keras.__version__, K.backend(), K.image_dim_ordering(),
+                      K.floatx(), sys.version_info[:2]])
+    return os.path.join(CACHE_DIR, '{}-{}-{}.json'.format(
+        model, network, hashlib.md5(key.encode('utf-8')).hexdigest()))
+
+
+def build_network(model, network, latent_size=200, minibatch_chunk_size=None,
+                  cache=True):
+    """
+    An uncompiled, freshly initialized network from networks/<model>.py.
+
+    Args:
+    -----
+        model: one of MODELS
+        network: 'generator' or 'discriminator'
+        latent_size: for generators
+        minibatch_chunk_size: for discriminators
+        cache: load the architecture from CACHE_DIR if it was built before,
+            and save it there otherwise
+
+    Returns:
+    --------
+        the Keras model, as the module's generator or discriminator builds it
+    """
+    if network == 'generator':
+        kwargs = {'latent_size': latent_size}
+    elif network == 'discriminator':
+        kwargs = {'minibatch_chunk_size': minibatch_chunk_size}
+    else:
+        raise ValueError('network must be generator or discriminator, not '
+                         '{}'.format(network))
+
+    if not cache:
+        return getattr(get_module(model), network)(**kwargs)
+
+    from keras.models import model_from_json
+
+    from .inference import CUSTOM_OBJECTS
+
+    cachefile = _cache_file(model, network, **kwargs)
+    if os.path.isfile(cachefile):
+        try:
+            with open(cachefile) as f:
+                return model_from_json(f.read(), custom_objects=CUSTOM_OBJECTS)
+        except Exception as e:
+            # rebuilt and written over below
+            print('[WARN] Could not load the cached architecture in {}: '
+                  '{}'.format(cachefile, e))
+
+    built = getattr(get_module(model), network)(**kwargs)
+    try:
+        try:
+            os.makedirs(CACHE_DIR)
+        except OSError:
+            if not os.path.isdir(CACHE_DIR):
+                raise
+        # a temporary file of its own, as runs started together all write
+        # the same architectures
+        fd, tmpfile = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(built.to_json())
+        os.rename(tmpfile, cachefile)
+    except (IOError, OSError):
+        print('[WARN] Could not cache the architecture in {}'.format(cachefile))
+    return built
+
+
+def builders(model, cache=True):
+    """
+    build_generator(latent_size) and build_discriminator(minibatch_chunk_size)
+    for model, as networks.gan.build_gan takes them, going through the cache
+    """
+    def build_generator(latent_size):
+        return build_network(model, 'generator', latent_size=latent_size,
+                             cache=cache)
+
+    def build_discriminator(minibatch_chunk_size=None):
+        return build_network(model, 'discriminator',
+                             minibatch_chunk_size=minibatch_chunk_size,
+                             cache=cache)
+
+    return build_generator, build_discriminator
+
+
+class PhaseTimer(object):
+
+    """
+    Wall time of named phases, e.g. of a script's startup:
+
+        timer = PhaseTimer()
+        with timer.phase('build'):
+            ...
+        timer.report('startup')
+    """
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.time() - start))
+
+    def add(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    @property
+    def total(self):
+        return sum(t for _, t in self.phases)
+
+    def report(self, title='phases'):
+        print('[INFO] {} ({:.2f}s): {}'.format(
+            title, self.total,
+            ', '.join('{} {:.2f}s'.format(n, t) for n, t in self.phases)))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: sparse.py
+description: a generator that predicts a sparse set of pixels rather than a
+    dense image, for faster sampling, against the discriminator of lagan.py.
+    Jet images have a few dozen lit pixels, and train.py zeros every pixel
+    under 1e-3 anyway, so instead of a stack of locally connected layers
+    the generator has two dense heads, pixel logits and pixel intensities,
+    and only the top NB_PIXELS pixels by logit are scattered into the grid.
+"""
+
+import keras.backend as K
+from keras.layers import (Input, Dense, Reshape, Flatten, Lambda, merge,
+                          Embedding)
+from keras.layers.advanced_activations import LeakyReLU
+
+from keras.models import Model, Sequential
+
+from . import lagan
+from .ops import top_k_pixels, top_k_pixels_output_shape
+
+
+K.set_image_dim_ordering('tf')
+
+# most lit pixels a generated image can have
+NB_PIXELS = 64
+
+
+def discriminator(minibatch_chunk_size=None):
+    # the same critic as lagan, so the two generators are trained alike
+    return lagan.discriminator(minibatch_chunk_size)
+
+
+def generator(latent_size, nb_pixels=NB_PIXELS):
+
+    trunk = Sequential([
+        Dense(512, input_dim=latent_size),
+        LeakyReLU(),
+        Dense(1024),
+        LeakyReLU(),
+    ])
+
+    # this is the z space commonly refered to in GAN papers
+    latent = Input(shape=(latent_size, ))
+
+    # this will be our label
+    image_class = Input(shape=(1, ), dtype='int32')
+    emb = Flatten()(Embedding(2, latent_size, input_length=1,
+                              init='glorot_normal')(image_class))
+
+    # hadamard product between z-space and a class conditional embedding
+    h = merge([latent, emb], mode='mul')
+
+    features = trunk(h)
+
+    # which pixels are lit, and how bright they are if they are
+    logits = Dense(625, name='pixel_logits')(features)
+    intensities = Dense(625, activation='relu', init='he_uniform',
+                        name='pixel_intensities')(features)
+
+    pixels = Lambda(top_k_pixels, output_shape=top_k_pixels_output_shape,
+                    arguments={'nb_pixels': nb_pixels})(
+        merge([logits, intensities], mode='concat'))
+
+    fake_image = Reshape((25, 25, 1))(pixels)
+
+    return Model(input=[latent, image_class], output=fake_image)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: quantize.py
+description: post-training quantization of generators exported with
+    `export.py --format npz`, to int8 with per-channel scales or to float16,
+    with a report of the effect on the physics observables
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from runtime import NumpyGenerator, SCALE_SUFFIX
+
+# kernel axes that are reduced over to get one scale per output channel (and,
+# for locally connected layers, per location)
+REDUCTION_AXES = {
+    'dense': (0, ),
+    'conv2d': (0, 1, 2),
+    'locally_connected2d': (1, ),
+}
+
+
+def quantize_int8(W, axes):
+    """ symmetric int8 quantization with one float32 scale per channel """
+    scale = np.abs(W).max(axis=axes, keepdims=True) / 127.
+    scale[scale == 0] = 1
+    q = np.clip(np.round(W / scale), -127, 127).astype(np.int8)
+    return q, scale.astype(np.float32)
+
+
+def quantize(src, dst, mode='int8'):
+    """ writes a copy of the exported generator src with quantized kernels """
+    with np.load(src) as f:
+        ops = json.loads(str(f['__ops__']))
+        params = {k: f[k] for k in f.files if k != '__ops__'}
+
+    for op in ops:
+        if op['op'] not in REDUCTION_AXES:
+            continue
+        W = params[op['W']]
+        if mode == 'float16':
+            params[op['W']] = W.astype(np.float16)
+        else:
+            params[op['W']], params[op['W'] + SCALE_SUFFIX] = \
+                quantize_int8(W, REDUCTION_AXES[op['op']])
+
+    with open(dst, 'wb') as f:
+        np.savez(f, __ops__=np.array(json.dumps(ops)), **params)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Quantize an exported generator and report the impact '
+        'on mass, pT and tau21.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('generator', action='store', type=str,
+                        help='Generator written by `export.py --format npz`')
+    parser.add_argument('--output', '-o', action='store', type=str,
+                        required=True, help='Where to save the quantized '
+                        'generator')
+    parser.add_argument('--mode', action='store', type=str, default='int8',
+                        choices=['int8', 'float16'],
+                        help='How to store the kernels')
+    parser.add_argument('--nb-points', action='store', type=int, default=10000,
+                        help='Number of jets to compare observables on')
+    parser.add_argument('--nb-jobs', action='store', type=int, default=1,
+                        help='Number of processes to compute tau21 with')
+    return parser
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+
+    from evaluation import OBSERVABLES, jet_observables, emd_scores
+
+    quantize(results.generator, results.output, results.mode)
+
+    reference = NumpyGenerator.load(results.generator)
+    quantized = NumpyGenerator.load(results.output)
+
+    def sample():
+        return (np.random.normal(0, 1, (results.nb_points,
+                                        reference.latent_size)),
+                np.random.randint(0, 2, (results.nb_points, 1)))
+
+    noise, labels = sample()
+
+    start = time.time()
+    images = reference.predict(noise, labels)
+    reference_rate = results.nb_points / (time.time() - start)
+
+    start = time.time()
+    images_q = quantized.predict(noise, labels)
+    quantized_rate = results.nb_points / (time.time() - start)
+
+    print('[INFO] Computing observables')
+    obs = jet_observables(100 * images, nb_jobs=results.nb_jobs)
+    obs_q = jet_observables(100 * images_q, nb_jobs=results.nb_jobs)
+
+    # the EMD between two float32 samples with independent noise, to judge
+    # the quantized EMDs against
+    noise_2, labels_2 = sample()
+    obs_2 = jet_observables(100 * reference.predict(noise_2, labels_2),
+                            nb_jobs=results.nb_jobs)
+
+    emd = emd_scores(obs, labels, obs_q, labels)
+    emd_floor = emd_scores(obs, labels, obs_2, labels_2)
+
+    print('{0:<26s} | {1:>12s} | {2:>12s}'.format('', 'float32', results.mode))
+    print('-' * 56)
+    print('{0:<26s} | {1:>12.1f} | {2:>12.1f}'.format(
+        'file size (kB)', os.path.getsize(results.generator) / 1024.,
+        os.path.getsize(results.output) / 1024.))
+    print('{0:<26s} | {1:>12.1f} | {2:>12.1f}'.format(
+        'resident weights (kB)', reference.nbytes / 1024.,
+        quantized.nbytes / 1024.))
+    print('{0:<26s} | {1:>12.1f} | {2:>12.1f}'.format(
+        'images/sec', reference_rate, quantized_rate))
+    print('{0:<26s} | {1:>12s} | {2:>12.3g}'.format(
+        'max abs pixel diff (GeV)', '-', 100 * np.abs(images - images_q).max()))
+    for name in OBSERVABLES:
+        print('{0:<26s} | {1:>12.4f} | {2:>12.4f}'.format(
+            'EMD {} vs float32'.format(name), emd_floor[name], emd[name]))
+    print('\n(the float32 column is the EMD between two independent float32 '
+          'samples, i.e. the statistical floor)')
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: runtime.py
+description: a NumPy-only forward pass for the lagan and fcn generators of
+    [arXiv/1701.05927], loaded from the flat .npz written by
+    `export.py --format npz`. Importing this module does not import Keras.
+"""
+
+import json
+
+import numpy as np
+
+
+def _activation(x, name):
+    if name == 'linear':
+        return x
+    if name == 'relu':
+        return np.maximum(x, 0)
+    if name == 'sigmoid':
+        return 1 / (1 + np.exp(-x))
+    if name == 'tanh':
+        return np.tanh(x)
+    raise ValueError('Unsupported activation: {}'.format(name))
+
+
+def _same_padding(size, kernel, stride):
+    """ (before, after) padding of a 'same' convolution, as TensorFlow does it """
+    output = (size + stride - 1) // stride
+    total = max((output - 1) * stride + kernel - size, 0)
+    return total // 2, total - total // 2
+
+
+def _patch_index(rows, cols, channels, nb_row, nb_col, stride_row, stride_col,
+                 output_row, output_col):
+    """
+    flat index into a (rows, cols, channels) image of every element of every
+    patch, in the order LocallyConnected2D flattens patches
+    """
+    r, c, ch = np.meshgrid(np.arange(nb_row), np.arange(nb_col),
+                           np.arange(channels), indexing='ij')
+    i, j = np.meshgrid(np.arange(output_row), np.arange(output_col),
+                       indexing='ij')
+    row = i.reshape(-1, 1) * stride_row + r.reshape(1, -1)
+    col = j.reshape(-1, 1) * stride_col + c.reshape(1, -1)
+    return (row * cols + col) * channels + ch.reshape(1, -1)
+
+
+# suffix of the per-channel scales of an int8 quantized weight
+SCALE_SUFFIX = ':scale'
+
+
+class NumpyGenerator(object):
+
+    """
+    Runs a generator exported by export.py. `ops` is the list of layer
+    descriptions from the exported file, and `params` maps the names they
+    refer to onto weight arrays.
+
+    Weights may be stored quantized by quantize.py, either as float16 or as
+    int8 with a float32 per-channel scale under `name + SCALE_SUFFIX`. They
+    stay compact in memory and are expanded to float32 when used, unless
+    `cache_dequantized` trades the memory back for speed.
+    """
+
+    def __init__(self, ops, params, cache_dequantized=False):
+        self.ops = ops
+        self.params = params
+        self.cache_dequantized = cache_dequantized
+        self._patch_indices = {}
+        self._dequantized = {}
+        self.latent_size = self.param('embedding/W').shape[1]
+
+    @classmethod
+    def load(cls, filepath, cache_dequantized=False):
+        with np.load(filepath) as f:
+            ops = json.loads(str(f['__ops__']))
+            params = {k: f[k] for k in f.files if k != '__ops__'}
+        return cls(ops, params, cache_dequantized=cache_dequantized)
+
+    @property
+    def nbytes(self):
+        """ memory held by the weights """
+        return sum(v.nbytes for v in self.params.values())
+
+    def param(self, name):
+        if name in self._dequantized:
+            return self._dequantized[name]
+
+        value = self.params[name]
+        if name + SCALE_SUFFIX in self.params:
+            value = value.astype(np.float32) * self.params[name + SCALE_SUFFIX]
+        elif value.dtype != np.float32:
+            value = value.astype(np.float32)
+        else:
+            return value
+
+        if self.cache_dequantized:
+            self._dequantized[name] = value
+        return value
+
+    def _dense(self, x, op):
+        y = np.dot(x, self.param(op['W']))
+        if op.get('b'):
+            y += self.param(op['b'])
+        return _activation(y, op['activation'])
+
+    def _conv2d(self, x, op):
+        W = self.param(op['W'])
+        nb_row, nb_col = W.shape[:2]
+        stride_row, stride_col = op['subsample']
+        if op['border_mode'] == 'same':
+            x = np.pad(x, ((0, 0),
+                           _same_padding(x.shape[1], nb_row, stride_row),
+                           _same_padding(x.shape[2], nb_col, stride_col),
+                           (0, 0)), mode='constant')
+        output_row = (x.shape[1] - nb_row) // stride_row + 1
+        output_col = (x.shape[2] - nb_col) // stride_col + 1
+
+        # one GEMM per kernel offset keeps memory at the size of the output
+        y = 0
+        for r in range(nb_row):
+            for c in range(nb_col):
+                y = y + np.dot(
+                    x[:, r:r + (output_row - 1) * stride_row + 1:stride_row,
+                      c:c + (output_col - 1) * stride_col + 1:stride_col],
+                    W[r, c]
+                )
+        if op.get('b'):
+            y = y + self.param(op['b'])
+        return _activation(y, op['activation'])
+
+    def _locally_connected2d(self, x, op):
+        W = self.param(op['W'])
+        output_row, output_col = op['output_shape']
+        key = (x.shape[1:], op['W'])
+        if key not in self._patch_indices:
+            self._patch_indices[key] = _patch_index(
+                x.shape[1], x.shape[2], x.shape[3], op['nb_row'], op['nb_col'],
+                op['subsample'][0], op['subsample'][1], output_row, output_col)
+
+        # (batch, locations, feature_dim) => (locations, batch, nb_filter)
+        patches = x.reshape(x.shape[0], -1)[:, self._patch_indices[key]]
+        y = np.matmul(patches.transpose(1, 0, 2), W).transpose(1, 0, 2)
+        y = y.reshape(x.shape[0], output_row, output_col, -1)
+        if op.get('b'):
+            y += self.param(op['b'])
+        return _activation(y, op['activation'])
+
+    def _apply(self, x, op):
+        kind = op['op']
+        if kind == 'dense':
+            return self._dense(x, op)
+        if kind == 'conv2d':
+            return self._conv2d(x, op)
+        if kind == 'locally_connected2d':
+            return self._locally_connected2d(x, op)
+        if kind == 'reshape':
+            return x.reshape((x.shape[0], ) + tuple(op['target_shape']))
+        if kind == 'upsampling2d':
+            return np.repeat(np.repeat(x, op['size'][0], axis=1),
+                             op['size'][1], axis=2)
+        if kind == 'zeropadding2d':
+            top, bottom, left, right = op['padding']
+            return np.pad(x, ((0, 0), (top, bottom), (left, right), (0, 0)),
+                          mode='constant')
+        if kind == 'leakyrelu':
+            return np.where(x > 0, x, op['alpha'] * x)
+        if kind == 'activation':
+            return _activation(x, op['activation'])
+        if kind == 'affine':
+            return x * self.param(op['scale']) + self.param(op['shift'])
+        raise ValueError('Unsupported op: {}'.format(kind))
+
+    def predict(self, noise, labels, batch_size=256):
+        """
+        Same inputs and outputs as the Keras generator: noise of shape
+        (nb_points, latent_size) and labels of shape (nb_points, 1) give
+        images of shape (nb_points, 25, 25, 1), in train.py units (/100)
+        """
+        noise = np.asarray(noise, dtype=np.float32)
+        labels = np.asarray(labels).ravel()
+        return np.concatenate([
+            self._predict_batch(noise[i:i + batch_size],
+                                labels[i:i + batch_size])
+            for i in range(0, noise.shape[0], batch_size)
+        ])
+
+    def _predict_batch(self, noise, labels):
+        # hadamard product between z-space and a class conditional embedding
+        x = noise * self.param('embedding/W')[labels]
+        for op in self.ops:
+            x = self._apply(x, op)
+        return x
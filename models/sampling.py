@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: sampling.py
+description: per-epoch row orders for training, shuffled at the level of
+    contiguous blocks so that reads from disk or a memmap stay mostly
+    sequential, and the per-step latent noise, labels and label flips,
+    drawn a block of steps at a time from seeded streams
+"""
+
+from __future__ import division
+
+from collections import namedtuple
+
+import numpy as np
+
+try:
+    from numpy.random import default_rng
+except ImportError:  # numpy < 1.17: the legacy generator, same streams API
+    default_rng = None
+
+
+class BlockShuffleSampler(object):
+
+    """
+    A fresh order of the rows of a dataset every epoch, from a two-level
+    shuffle: contiguous blocks of block_size rows are shuffled, then rows are
+    shuffled within a buffer of buffer_blocks consecutive blocks. Any window
+    of the order therefore only touches a few contiguous regions of the data.
+
+    If labels are given, each class is shuffled on its own and the classes are
+    then interleaved evenly, so every batch has about the class proportions
+    of the whole dataset.
+
+    The order only depends on seed and the epoch, so a resumed run sees the
+    same batches.
+    """
+
+    def __init__(self, nb_rows, block_size=1024, buffer_blocks=8, labels=None,
+                 seed=None):
+        self.nb_rows = nb_rows
+        self.block_size = block_size
+        self.buffer_blocks = buffer_blocks
+        self.labels = None if labels is None else np.asarray(labels).ravel()
+        if seed is None:
+            seed = np.random.randint(2 ** 31)
+        self.seed = seed
+
+    def _shuffle(self, rows, rng):
+        """ two-level shuffle of an increasing array of row indices """
+        nb_blocks = -(-len(rows) // self.block_size)
+        order = np.concatenate([
+            rows[b * self.block_size:(b + 1) * self.block_size]
+            for b in rng.permutation(nb_blocks)
+        ]) if nb_blocks else rows
+
+        buffer_size = self.block_size * self.buffer_blocks
+        for start in range(0, len(order), buffer_size):
+            rng.shuffle(order[start:start + buffer_size])
+        return order
+
+    def epoch(self, epoch):
+        """ the row order to use for epoch """
+        rng = np.random.RandomState([self.seed, epoch])
+
+        if self.labels is None:
+            return self._shuffle(np.arange(self.nb_rows), rng)
+
+        orders, keys = [], []
+        for cls in np.unique(self.labels):
+            order = self._shuffle(np.flatnonzero(self.labels == cls), rng)
+            orders.append(order)
+            # evenly spaced positions in [0, 1), jittered to break ties
+            keys.append((np.arange(len(order)) + rng.uniform(size=len(order)))
+                        / len(order))
+
+        return np.concatenate(orders)[np.argsort(np.concatenate(keys),
+                                                 kind='mergesort')]
+
+    def batches(self, epoch, batch_size, drop_last=True):
+        """
+        Yields the row indices of each batch of epoch. Within a batch they
+        are sorted, which is what HDF5 fancy indexing needs and what keeps
+        memmap reads in file order.
+        """
+        order = self.epoch(epoch)
+        stop = len(order) - len(order) % batch_size if drop_last else len(order)
+        for start in range(0, stop, batch_size):
+            yield np.sort(order[start:start + batch_size])
+
+
+# ids of the independent streams of a NoiseSampler
+STREAMS = {'noise': 0, 'labels': 1, 'flips': 2, 'test': 3, 'validation': 4}
+
+# what one training step of train.py draws: the discriminator's fake batch
+# (noise, labels), its targets for the real and fake batches with flipped
+# bits (real, fake, fake_aux), and the generator's two batches (gen_noise,
+# gen_labels) with their flipped auxiliary targets (gen_aux)
+Step = namedtuple('Step', ['noise', 'labels', 'real', 'fake', 'fake_aux',
+                           'gen_noise', 'gen_labels', 'gen_aux'])
+
+
+def stream(*key):
+    """ an independent generator for a tuple of non-negative ints """
+    key = [int(k) for k in key]
+    return np.random.RandomState(key) if default_rng is None else default_rng(key)
+
+
+def _normal(rng, out):
+    if default_rng is None:
+        out[...] = rng.standard_normal(out.shape)
+    else:
+        rng.standard_normal(out=out, dtype=out.dtype)
+
+
+def _uniform(rng, out):
+    if default_rng is None:
+        out[...] = rng.random_sample(out.shape)
+    else:
+        rng.random(out=out, dtype=out.dtype)
+
+
+class NoiseSampler(object):
+
+    """
+    The random inputs and targets of every training step, drawn for
+    block_size steps at a time rather than with a handful of small calls per
+    step. Labels are flipped by XORing them with a Bernoulli mask into
+    preallocated buffers, like train.py's bit_flip did one array at a time.
+
+    Noise, labels and flips come from separate streams keyed by (seed,
+    worker, epoch), so they depend neither on what else drew random numbers
+    nor on block_size: any epoch can be regenerated on its own, by a resumed
+    run or by another worker.
+
+    The arrays of a Step are views into buffers that the next block
+    overwrites, so use them before moving on.
+    """
+
+    def __init__(self, batch_size, latent_size, nb_classes=2, seed=None,
+                 flip_prob=0.05, aux_flip_prob=0.09, block_size=64, worker=0):
+        self.batch_size = batch_size
+        self.latent_size = latent_size
+        self.nb_classes = nb_classes
+        if seed is None:
+            seed = np.random.randint(2 ** 31)
+        self.seed = seed
+        self.worker = worker
+        self.block_size = block_size
+
+        # flip probabilities of the real, fake, fake_aux and the two gen_aux
+        # targets
+        self.flip_probs = np.array([flip_prob] * 3 + [aux_flip_prob] * 2,
+                                   dtype=np.float32)[:, None]
+
+        self._noise = np.empty((block_size, 3, batch_size, latent_size),
+                               dtype=np.float32)
+        self._uniform = np.empty((block_size, 5, batch_size), dtype=np.float32)
+        self._label_uniform = np.empty((block_size, 3, batch_size),
+                                       dtype=np.float32)
+        self._labels = np.empty((block_size, 3, batch_size), dtype=np.uint8)
+        self._flips = np.empty((block_size, 5, batch_size), dtype=bool)
+        self._targets = np.empty((block_size, 5, batch_size), dtype=np.uint8)
+
+    def _fill(self, n, streams):
+        """ draws the next n steps into the first n rows of the buffers """
+        noise, uniform = self._noise[:n], self._uniform[:n]
+        label_uniform = self._label_uniform[:n]
+        labels, flips, targets = self._labels[:n], self._flips[:n], self._targets[:n]
+
+        _normal(streams['noise'], noise)
+
+        # one uniform per label rather than randint, whose bounded draws are
+        # buffered within a call and would make the labels depend on n
+        _uniform(streams['labels'], label_uniform)
+        np.multiply(label_uniform, self.nb_classes, out=label_uniform)
+        labels[...] = label_uniform
+        # float32 rounding can reach nb_classes itself
+        np.minimum(labels, self.nb_classes - 1, out=labels)
+
+        _uniform(streams['flips'], uniform)
+        np.less(uniform, self.flip_probs, out=flips)
+
+        targets[:, 0] = 1
+        targets[:, 1] = 0
+        targets[:, 2:] = labels
+        np.bitwise_xor(targets, flips, out=targets)
+
+    def epoch(self, epoch, nb_steps):
+        """ yields the Step of each of nb_steps training steps of epoch """
+        streams = {name: stream(self.seed, self.worker, epoch, STREAMS[name])
+                   for name in ('noise', 'labels', 'flips')}
+
+        for start in range(0, nb_steps, self.block_size):
+            n = min(self.block_size, nb_steps - start)
+            self._fill(n, streams)
+            for i in range(n):
+                yield Step(
+                    noise=self._noise[i, 0], labels=self._labels[i, 0],
+                    real=self._targets[i, 0], fake=self._targets[i, 1],
+                    fake_aux=self._targets[i, 2],
+                    gen_noise=self._noise[i, 1:], gen_labels=self._labels[i, 1:],
+                    gen_aux=self._targets[i, 3:]
+                )
+
+    def draw(self, epoch, name, nb_samples):
+        """
+        (noise, labels) for nb_samples generated jets, from the stream name
+        of epoch, e.g. for testing or validation after it
+        """
+        rng = stream(self.seed, self.worker, epoch, STREAMS[name])
+        noise = np.empty((nb_samples, self.latent_size), dtype=np.float32)
+        _normal(rng, noise)
+        uniform = np.empty(nb_samples, dtype=np.float32)
+        _uniform(rng, uniform)
+        labels = (uniform * self.nb_classes).astype(np.int32)
+        return noise, np.minimum(labels, self.nb_classes - 1)
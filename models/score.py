@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: score.py
+description: runs a trained discriminator over every jet of an HDF5 file, a
+    chunk at a time, and writes its generation (P(real)) and auxiliary
+    (P(signal)) outputs back as new datasets
+"""
+
+from __future__ import print_function
+
+import argparse
+import threading
+import time
+
+import h5py
+import numpy as np
+from six.moves import queue
+
+from networks.registry import MODELS
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Score every jet image of an HDF5 file with a trained '
+        'discriminator, in bounded memory.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('weights', action='store', type=str,
+                        help='Discriminator weights written by train.py, or '
+                        '<store>:<epoch>')
+    parser.add_argument('datafile', action='store', type=str,
+                        help='HDF5 file with an image dataset. The scores are '
+                        'written into it unless --output is given')
+    parser.add_argument('--output', '-o', action='store', type=str,
+                        help='HDF5 file to write the scores to instead')
+    parser.add_argument('--model', '-m', action='store', type=str,
+                        default='lagan', help='Model architecture to use.',
+                        choices=MODELS)
+    parser.add_argument('--minibatch-chunk-size', action='store', type=int,
+                        default=None, help='As passed to train.py')
+    parser.add_argument('--batch-size', action='store', type=int, default=100,
+                        help='Jets per forward pass. Minibatch discrimination '
+                        'makes scores depend on the batch, so use the batch '
+                        'size the discriminator was trained with')
+    parser.add_argument('--chunk-size', action='store', type=int, default=20000,
+                        help='Jets to read at once (rounded to a multiple of '
+                        '--batch-size)')
+    parser.add_argument('--prefix', action='store', type=str, default='score_',
+                        help='The scores go to <prefix>generation and '
+                        '<prefix>auxiliary')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='Replace existing score datasets')
+    return parser
+
+
+def plan_chunks(nb_rows, batch_size, chunk_size):
+    """
+    (read_start, read_stop, write_start) of each chunk. Batches are the
+    consecutive runs of batch_size rows in file order: rows [k * batch_size,
+    (k + 1) * batch_size). If nb_rows isn't a multiple of batch_size, the last
+    batch is the last batch_size rows of the file, overlapping the one before,
+    and only the scores of rows not scored yet are kept. So every row is
+    scored in a full batch, and in the same batch on every run. A file of
+    fewer than batch_size rows is scored as a single batch of all its rows.
+    """
+    batch_size = max(min(batch_size, nb_rows), 1)
+    chunk_size = max(chunk_size // batch_size, 1) * batch_size
+    nb_full = nb_rows - nb_rows % batch_size
+
+    chunks = [(start, min(start + chunk_size, nb_full), start)
+              for start in range(0, nb_full, chunk_size)]
+    if nb_full < nb_rows:
+        chunks.append((nb_rows - batch_size, nb_rows, nb_full))
+    return chunks
+
+
+def prefetch(dataset, chunks, depth=2):
+    """
+    Reads chunks of dataset in a background thread, at most depth chunks
+    ahead, so reading overlaps with inference. Yields (chunk, images).
+    """
+    q = queue.Queue(maxsize=depth)
+
+    def read():
+        try:
+            for chunk in chunks:
+                q.put((chunk, dataset[chunk[0]:chunk[1]]))
+        except Exception as e:
+            q.put((None, e))
+            return
+        q.put((None, None))
+
+    thread = threading.Thread(target=read)
+    thread.daemon = True
+    thread.start()
+
+    while True:
+        chunk, images = q.get()
+        if chunk is None:
+            if images is not None:
+                raise images
+            break
+        yield chunk, images
+    thread.join()
+
+
+def preprocess(images):
+    """ what train.py does to real images: remove unphysical values, /100, NHWC """
+    images = np.array(images, dtype=np.float32)
+    images[images < 1e-3] = 0
+    return np.expand_dims(images / 100, axis=-1)
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+
+    import keras.backend as K
+
+    K.set_image_dim_ordering('tf')
+
+    from networks.registry import build_network
+
+    discriminator = build_network(
+        results.model, 'discriminator',
+        minibatch_chunk_size=results.minibatch_chunk_size)
+    from checkpoints import load_weights
+    load_weights(discriminator, results.weights)
+
+    mode = 'r' if results.output else 'r+'
+    source = h5py.File(results.datafile, mode)
+    target = h5py.File(results.output, 'a') if results.output else source
+
+    images = source['image']
+    nb_rows = images.shape[0]
+    # the batch size scores depend on, as plan_chunks clamps it
+    batch_size = max(min(results.batch_size, nb_rows), 1)
+    chunks = plan_chunks(nb_rows, batch_size, results.chunk_size)
+
+    outputs = {}
+    for name in ('generation', 'auxiliary'):
+        key = results.prefix + name
+        if key in target:
+            if not results.overwrite:
+                raise ValueError('{} already has a {} dataset, use --overwrite '
+                                 'to replace it'.format(target.filename, key))
+            del target[key]
+        outputs[name] = target.create_dataset(
+            key, shape=(nb_rows, ), dtype=np.float32,
+            chunks=(min(results.chunk_size, nb_rows), ))
+        outputs[name].attrs['weights'] = results.weights
+        outputs[name].attrs['batch_size'] = batch_size
+
+    print('[INFO] Scoring {} jets in {} chunks'.format(nb_rows, len(chunks)))
+    start_time = time.time()
+    for (start, stop, write_start), chunk in prefetch(images, chunks):
+        generation, auxiliary = discriminator.predict(
+            preprocess(chunk), batch_size=batch_size, verbose=False)
+
+        keep = slice(write_start - start, None)
+        outputs['generation'][write_start:stop] = generation[keep].ravel()
+        outputs['auxiliary'][write_start:stop] = auxiliary[keep].ravel()
+
+        print('[INFO] {}/{} jets, {:.0f} jets/sec'.format(
+            stop, nb_rows, stop / (time.time() - start_time)))
+
+    if target is not source:
+        target.close()
+    source.close()
+    print('[INFO] Wrote {}generation and {}auxiliary to {}'.format(
+        results.prefix, results.prefix, results.output or results.datafile))
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: shards.py
+description: a sharded layout of the jet image dataset, where every HDF5
+    chunk holds exactly one batch, so any batch costs one chunk read. A
+    dataset is a directory of shard files and an index.json with the number
+    of rows and signal jets of each shard.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+
+import h5py
+import numpy as np
+
+INDEX_FILE = 'index.json'
+
+SHARD_TEMPLATE = 'shard_{:05d}.hdf5'
+
+COMPRESSION = {'lzf': ('lzf', None), 'gzip': ('gzip', 1), 'none': (None, None)}
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Convert a monolithic HDF5 jet image file (such as the '
+        'one from Zenodo) to a sharded, batch-aligned dataset, or describe '
+        'one.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    convert = subparsers.add_parser('convert', help='Write a sharded dataset')
+    convert.add_argument('source', action='store', type=str,
+                         help='HDF5 file with image and signal datasets. If '
+                         'not found, the Zenodo dataset is used')
+    convert.add_argument('output', action='store', type=str,
+                         help='Directory to write the shards and index to')
+    convert.add_argument('--batch-size', action='store', type=int, default=100,
+                         help='Rows per HDF5 chunk. Use the training batch size')
+    convert.add_argument('--shard-size', action='store', type=int,
+                         default=100000, help='Rows per shard file (rounded '
+                         'down to a multiple of --batch-size)')
+    convert.add_argument('--compression', action='store', type=str,
+                         default='lzf', choices=sorted(COMPRESSION),
+                         help='Chunk codec. gzip means gzip at level 1')
+    convert.add_argument('--datasets', action='store', type=str, nargs='+',
+                         default=['image', 'signal'],
+                         help='Per-jet datasets to copy over')
+
+    info = subparsers.add_parser('info', help='Describe a sharded dataset')
+    info.add_argument('directory', action='store', type=str)
+
+    return parser
+
+
+def is_sharded(path):
+    return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+
+def convert(source, output, batch_size=100, shard_size=100000,
+            compression='lzf', datasets=('image', 'signal')):
+    """
+    Copies datasets of the HDF5 file source into shards under the directory
+    output, reading and writing one shard at a time. Returns the index.
+    """
+    codec, level = COMPRESSION[compression]
+    shard_size = max(shard_size // batch_size, 1) * batch_size
+
+    # fails if the directory exists, so shards of two conversions never mix
+    os.makedirs(output)
+
+    index = {'batch_size': batch_size, 'compression': compression,
+             'datasets': {}, 'shards': []}
+
+    with h5py.File(source, 'r') as src:
+        nb_rows = src[datasets[0]].shape[0]
+        for name in datasets:
+            if src[name].shape[0] != nb_rows:
+                raise ValueError('{} has {} rows, expected {}'.format(
+                    name, src[name].shape[0], nb_rows))
+            index['datasets'][name] = {'shape': src[name].shape[1:],
+                                       'dtype': src[name].dtype.str}
+
+        for start in range(0, nb_rows, shard_size):
+            stop = min(start + shard_size, nb_rows)
+            filename = SHARD_TEMPLATE.format(len(index['shards']))
+
+            with h5py.File(os.path.join(output, filename), 'w') as dst:
+                for name in datasets:
+                    data = src[name][start:stop]
+                    dst.create_dataset(
+                        name, data=data, compression=codec,
+                        compression_opts=level,
+                        chunks=(min(batch_size, stop - start), ) + data.shape[1:]
+                    )
+                signal = np.asarray(dst['signal'][:]) if 'signal' in dst else None
+
+            index['shards'].append({
+                'file': filename, 'nb_rows': stop - start,
+                'nb_signal': None if signal is None else int(signal.sum())
+            })
+            print('[INFO] Wrote {} ({} rows)'.format(filename, stop - start))
+
+    index['nb_rows'] = nb_rows
+    with open(os.path.join(output, INDEX_FILE), 'w') as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+class ShardedDataset(object):
+
+    """
+    Reads a directory written by convert. Batches are numbered across shards
+    and each is one HDF5 chunk; only the last batch of a shard can be short.
+
+    Files are opened lazily and per process, so a dataset can be handed to
+    forked workers.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            self.index = json.load(f)
+
+        self.batch_size = self.index['batch_size']
+        self.shards = self.index['shards']
+        self.datasets = sorted(self.index['datasets'])
+
+        # first global batch of every shard, plus the total
+        batches = [-(-s['nb_rows'] // self.batch_size) for s in self.shards]
+        self.batch_offsets = np.concatenate([[0], np.cumsum(batches)])
+        self.row_offsets = np.concatenate(
+            [[0], np.cumsum([s['nb_rows'] for s in self.shards])])
+
+        self._files = {}
+        self._pid = None
+
+    def __len__(self):
+        return self.index['nb_rows']
+
+    @property
+    def nb_batches(self):
+        return int(self.batch_offsets[-1])
+
+    @property
+    def nb_signal(self):
+        """ number of signal jets, or None if they aren't labelled """
+        counts = [s['nb_signal'] for s in self.shards]
+        if any(c is None for c in counts):
+            return None
+        return sum(counts)
+
+    def _file(self, shard):
+        if self._pid != os.getpid():
+            self._files, self._pid = {}, os.getpid()
+        if shard not in self._files:
+            self._files[shard] = h5py.File(
+                os.path.join(self.directory, self.shards[shard]['file']), 'r')
+        return self._files[shard]
+
+    def close(self):
+        if self._pid == os.getpid():
+            for f in self._files.values():
+                f.close()
+        self._files = {}
+
+    def batch(self, i, datasets=('image', 'signal')):
+        """ batch i, as a tuple with one array per name in datasets """
+        if not 0 <= i < self.nb_batches:
+            raise IndexError('batch {} out of range'.format(i))
+        shard = int(np.searchsorted(self.batch_offsets, i, side='right')) - 1
+        start = (i - self.batch_offsets[shard]) * self.batch_size
+        f = self._file(shard)
+        return tuple(f[name][start:start + self.batch_size]
+                     for name in datasets)
+
+    def read(self, start, stop, datasets=('image', 'signal')):
+        """ rows [start, stop) across shards """
+        parts = []
+        first = int(np.searchsorted(self.row_offsets, start, side='right')) - 1
+        for shard in range(max(first, 0), len(self.shards)):
+            lo, hi = self.row_offsets[shard], self.row_offsets[shard + 1]
+            if lo >= stop:
+                break
+            f = self._file(shard)
+            parts.append([f[name][max(start - lo, 0):min(stop, hi) - lo]
+                          for name in datasets])
+        if not parts:
+            return tuple(np.empty((0, ) + tuple(self.index['datasets'][name]['shape']),
+                                  dtype=self.index['datasets'][name]['dtype'])
+                         for name in datasets)
+        return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+    def take(self, rows, datasets=('image', 'signal')):
+        """
+        rows (increasing, no repeats) across shards, with one selection per
+        shard so HDF5 reads only the chunks holding them
+        """
+        rows = np.asarray(rows)
+        bounds = np.searchsorted(rows, self.row_offsets)
+        parts = []
+        for shard in range(len(self.shards)):
+            wanted = rows[bounds[shard]:bounds[shard + 1]] - self.row_offsets[shard]
+            if wanted.shape[0]:
+                f = self._file(shard)
+                parts.append([f[name][wanted] for name in datasets])
+        if not parts:
+            return self.read(0, 0, datasets)
+        return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+    def iter_batches(self, batches=None, datasets=('image', 'signal'),
+                     nb_workers=0):
+        """
+        Yields the given batches (all of them by default) in order, read by
+        nb_workers processes if nb_workers > 0
+        """
+        if batches is None:
+            batches = range(self.nb_batches)
+        if nb_workers <= 0:
+            for i in batches:
+                yield self.batch(i, datasets)
+            return
+
+        # don't hand open files over to the workers
+        self.close()
+        pool = mp.Pool(nb_workers, initializer=_init_worker,
+                       initargs=(self.directory, ))
+        try:
+            for batch in pool.imap(_read_batch,
+                                   ((i, datasets) for i in batches)):
+                yield batch
+        finally:
+            pool.terminate()
+
+    def batch_rows(self, i):
+        """ row numbers of batch i, across shards """
+        shard = int(np.searchsorted(self.batch_offsets, i, side='right')) - 1
+        start = (i - self.batch_offsets[shard]) * self.batch_size
+        stop = min(start + self.batch_size, self.shards[shard]['nb_rows'])
+        return self.row_offsets[shard] + np.arange(start, stop)
+
+    def sample(self, nb_points, datasets=('image', 'signal'), seed=None,
+               return_rows=False):
+        """
+        About nb_points rows from whole batches picked at random, so every read
+        is one chunk. Returns exactly nb_points rows if there are enough, and
+        their row numbers too if return_rows.
+        """
+        rng = np.random.RandomState(seed)
+        sizes = np.diff(self.row_offsets)
+        batch_sizes = np.concatenate([
+            np.minimum(self.batch_size,
+                       n - self.batch_size * np.arange(-(-n // self.batch_size)))
+            for n in sizes
+        ])
+        order = rng.permutation(self.nb_batches)
+        nb_needed = np.searchsorted(np.cumsum(batch_sizes[order]), nb_points) + 1
+        picked = np.sort(order[:nb_needed])
+
+        arrays = [np.concatenate(a) for a in
+                  zip(*self.iter_batches(picked, datasets))]
+        ix = rng.permutation(arrays[0].shape[0])[:nb_points]
+        if return_rows:
+            rows = np.concatenate([self.batch_rows(i) for i in picked])
+            arrays.append(rows)
+        return tuple(a[ix] for a in arrays)
+
+
+_worker_dataset = None
+
+
+def _init_worker(directory):
+    global _worker_dataset
+    _worker_dataset = ShardedDataset(directory)
+
+
+def _read_batch(args):
+    i, datasets = args
+    return _worker_dataset.batch(i, datasets)
+
+
+if __name__ == '__main__':
+
+    results = get_parser().parse_args()
+
+    if results.command == 'convert':
+        from data import get_datafile
+
+        start = time.time()
+        index = convert(get_datafile(results.source), results.output,
+                        batch_size=results.batch_size,
+                        shard_size=results.shard_size,
+                        compression=results.compression,
+                        datasets=results.datasets)
+        print('[INFO] Converted {} rows into {} shards in {:.1f}s'.format(
+            index['nb_rows'], len(index['shards']), time.time() - start))
+
+    else:
+        dataset = ShardedDataset(results.directory)
+        size = sum(os.path.getsize(os.path.join(results.directory, s['file']))
+                   for s in dataset.shards)
+        print('rows: {}, batches of {}: {}, shards: {}, codec: {}, '
+              'size: {:.1f} MB'.format(len(dataset), dataset.batch_size,
+                                       dataset.nb_batches, len(dataset.shards),
+                                       dataset.index['compression'], size / 1e6))
+        for name in dataset.datasets:
+            print('  {}: {} {}'.format(name,
+                                       dataset.index['datasets'][name]['dtype'],
+                                       dataset.index['datasets'][name]['shape']))
+        for shard in dataset.shards:
+            print('  {file}: {nb_rows} rows, {nb_signal} signal'.format(**shard))
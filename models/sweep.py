@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+file: sweep.py
+description: concurrent hyperparameter sweeps over train.py on one node, with
+    successive-halving early stopping on the physics metrics
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import itertools
+import json
+from multiprocessing import Pool
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+MODELS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# the train.py defaults, needed to rebuild a run's generator for evaluation
+TRAIN_DEFAULTS = {'model': 'lagan', 'latent-size': '200'}
+
+# for the BLAS and OpenMP pools of NumPy and friends; TensorFlow's own pools
+# are sized with train.py's --intra-op-threads and --inter-op-threads
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Run a grid or random search over train.py options as '
+        'concurrent processes, stopping runs that fall behind on the EMD of '
+        'mass, pT and tau21 against real data (successive halving).',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--param', '-p', action='append', required=True,
+                        metavar='NAME=V1,V2,...',
+                        help='A train.py option and the values to try, e.g. '
+                        '--param adam-lr=0.0002,0.001. Can be repeated.')
+    parser.add_argument('--search', action='store', type=str, default='grid',
+                        choices=['grid', 'random'],
+                        help='Try every combination, or --nb-trials random ones')
+    parser.add_argument('--nb-trials', action='store', type=int, default=10,
+                        help='Number of runs for a random search')
+    parser.add_argument('--seed', action='store', type=int, default=0,
+                        help='Seed for the random search')
+
+    parser.add_argument('--nb-epochs', action='store', type=int, default=50,
+                        help='Number of epochs to train each run for.')
+    parser.add_argument('--dataset', action='store', type=str,
+                        help='Passed on to train.py, and used as real data')
+    parser.add_argument('--output-dir', action='store', type=str,
+                        default='sweep', help='Directory for runs and results')
+
+    parser.add_argument('--max-concurrent', action='store', type=int,
+                        default=2, help='Number of runs to train at once')
+    parser.add_argument('--threads-per-run', action='store', type=int,
+                        default=1, help='Thread budget of each run')
+    parser.add_argument('--memory-per-run', action='store', type=float,
+                        default=8000, help='Resident memory budget of each '
+                        'run in MB. Runs over budget are killed')
+
+    parser.add_argument('--rungs', action='store', type=int, nargs='+',
+                        default=[2, 6, 18],
+                        help='Epochs after which runs are compared')
+    parser.add_argument('--eta', action='store', type=int, default=3,
+                        help='Only the best 1 / eta of runs at a rung go on')
+    parser.add_argument('--nb-eval', action='store', type=int, default=2000,
+                        help='Number of real and generated jets to compare')
+    parser.add_argument('--nb-jobs', action='store', type=int, default=1,
+                        help='Number of processes to compute tau21 with')
+    parser.add_argument('--poll', action='store', type=float, default=10,
+                        help='Seconds between checks on the runs')
+    return parser
+
+
+def parse_space(params):
+    """ ['adam-lr=0.1,0.2', ...] => {'adam-lr': ['0.1', '0.2'], ...} """
+    space = {}
+    for param in params:
+        name, values = param.split('=', 1)
+        space[name.lstrip('-')] = values.split(',')
+    return space
+
+
+def make_trials(space, search, nb_trials, seed):
+    names = sorted(space)
+    if search == 'grid':
+        return [dict(zip(names, values))
+                for values in itertools.product(*[space[n] for n in names])]
+    rng = np.random.RandomState(seed)
+    return [{n: space[n][rng.randint(len(space[n]))] for n in names}
+            for _ in range(nb_trials)]
+
+
+def rss_mb(pid):
+    """ resident memory of a process in MB, from /proc (Linux only) """
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.
+    except IOError:
+        pass
+    return 0.
+
+
+class Run(object):
+
+    """ one train.py process of the sweep, and its evaluations so far """
+
+    def __init__(self, index, params, output_dir):
+        self.index = index
+        self.params = params
+        self.directory = os.path.join(output_dir, 'run_{:03d}'.format(index))
+        self.status = 'pending'
+        self.process = None
+        self.log = None
+        self.started = None
+
+        # epoch => dict of EMDs and their sum, 'score'
+        self.scores = {}
+
+    def option(self, name):
+        return self.params.get(name, TRAIN_DEFAULTS.get(name))
+
+    def prefix(self, network):
+        return os.path.join(self.directory, 'params_{}_epoch_'.format(network))
+
+    def checkpoint(self, epoch, network='generator'):
+        """ weights after `epoch` epochs (train.py counts from 0) """
+        return '{0}{1:03d}.hdf5'.format(self.prefix(network), epoch - 1)
+
+    def start(self, train_args, nb_threads):
+        # fails if the directory exists, so stale checkpoints can't be
+        # mistaken for this run's
+        os.makedirs(self.directory)
+
+        command = [sys.executable, os.path.join(MODELS_DIR, 'train.py')]
+        command += train_args
+        for name, value in sorted(self.params.items()):
+            command += ['--' + name, value]
+        command += ['--g-pfx', self.prefix('generator'),
+                    '--d-pfx', self.prefix('discriminator'),
+                    '--intra-op-threads', str(nb_threads),
+                    '--inter-op-threads', '1']
+
+        env = dict(os.environ)
+        for variable in THREAD_VARIABLES:
+            env[variable] = str(nb_threads)
+
+        self.log = open(os.path.join(self.directory, 'train.log'), 'w')
+        self.process = subprocess.Popen(command, stdout=self.log,
+                                        stderr=subprocess.STDOUT, env=env,
+                                        cwd=MODELS_DIR)
+        self.status = 'running'
+        self.started = time.time()
+
+    def stop(self, status):
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        self.log.close()
+        self.status = status
+
+    def best(self):
+        """ (epoch, scores) of the best evaluated epoch, or (None, None) """
+        if not self.scores:
+            return None, None
+        epoch = min(self.scores, key=lambda e: self.scores[e]['score'])
+        return epoch, self.scores[epoch]
+
+
+class SuccessiveHalving(object):
+
+    """
+    Asynchronous successive halving: a run reaching a rung goes on only if
+    its score is among the best 1 / eta of all scores seen at that rung, once
+    at least eta runs have got there.
+    """
+
+    def __init__(self, rungs, eta):
+        self.eta = eta
+        self.scores = {rung: [] for rung in rungs}
+
+    def promote(self, rung, score):
+        scores = self.scores[rung]
+        scores.append(score)
+        if len(scores) < self.eta:
+            return True
+        cutoff = np.sort(scores)[max(len(scores) // self.eta - 1, 0)]
+        return score <= cutoff
+
+
+class Evaluator(object):
+
+    """
+    scores a run's generator against a fixed sample of real jets, given as
+    their observables (see evaluation.real_observables)
+    """
+
+    def __init__(self, real, y_real, nb_jobs=1):
+        self.real = real
+        self.y_real = y_real
+        self.nb_jobs = nb_jobs
+        self.generators = {}
+
+    def __call__(self, run, epoch):
+        return self.score(run.option('model'), int(run.option('latent-size')),
+                          run.checkpoint(epoch))
+
+    def score(self, model, latent_size, weights):
+        """ EMDs, and their sum 'score', of a generator with these weights """
+        from checkpoints import load_weights
+        from evaluation import OBSERVABLES, jet_observables, emd_scores
+        from networks.registry import build_network
+
+        # generators of the same shape share one graph
+        key = (model, latent_size)
+        if key not in self.generators:
+            self.generators[key] = build_network(model, 'generator',
+                                                 latent_size)
+        generator = self.generators[key]
+        load_weights(generator, weights)
+
+        nb_points = self.y_real.shape[0]
+        labels = np.random.randint(0, 2, nb_points)
+        images = generator.predict(
+            [np.random.normal(0, 1, (nb_points, latent_size)),
+             labels.reshape(-1, 1)], verbose=False, batch_size=100)
+
+        scores = emd_scores(self.real, self.y_real,
+                            jet_observables(100 * images, nb_jobs=self.nb_jobs),
+                            labels)
+        scores['score'] = sum(scores[name] for name in OBSERVABLES)
+        return scores
+
+
+_evaluator = None
+
+
+def _start_evaluator(real, y_real, nb_jobs):
+    global _evaluator
+
+    import keras.backend as K
+
+    K.set_image_dim_ordering('tf')
+    _evaluator = Evaluator(real, y_real, nb_jobs=nb_jobs)
+
+
+def _evaluate(model, latent_size, weights):
+    return _evaluator.score(model, latent_size, weights)
+
+
+class BackgroundEvaluator(object):
+
+    """
+    Runs an Evaluator in a worker process, so a slow evaluation does not
+    hold up the checks on the other runs. Evaluations are done in the order
+    they are submitted.
+
+    Create it before Keras is imported, so the worker is forked from a
+    process without a backend session; data.get_datafile imports Keras to
+    download the dataset, so that includes finding the real data. Then give
+    it the real jets with start().
+    """
+
+    def __init__(self, nb_jobs=1):
+        self.nb_jobs = nb_jobs
+        self.pool = Pool(1)
+        # (run index, epoch) => AsyncResult
+        self.pending = {}
+
+    def start(self, real, y_real):
+        """ sets up the worker to score against these real jets """
+        self.pool.apply(_start_evaluator, (real, y_real, self.nb_jobs))
+
+    def submit(self, run, epoch):
+        """ queues the checkpoint of run after epoch, unless it already is """
+        key = (run.index, epoch)
+        if key not in self.pending:
+            self.pending[key] = self.pool.apply_async(_evaluate, (
+                run.option('model'), int(run.option('latent-size')),
+                run.checkpoint(epoch)))
+
+    def result(self, run, epoch):
+        """
+        the scores of a submitted evaluation, or None if not done yet.
+        Raises what the evaluation raised, e.g. for a checkpoint cut short
+        """
+        key = (run.index, epoch)
+        if key not in self.pending or not self.pending[key].ready():
+            return None
+        return self.pending.pop(key).get()
+
+    def discard(self, run):
+        """ forgets the evaluations of run that are still to come """
+        for key in [k for k in self.pending if k[0] == run.index]:
+            del self.pending[key]
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+def leaderboard(runs):
+    rows = []
+    for run in runs:
+        epoch, scores = run.best()
+        rows.append(dict(run=run.index, params=run.params, status=run.status,
+                         epochs_evaluated=sorted(run.scores), best_epoch=epoch,
+                         **(scores or {})))
+    return sorted(rows, key=lambda r: r.get('score', np.inf))
+
+
+def write_leaderboard(runs, output_dir):
+    with open(os.path.join(output_dir, 'leaderboard.json'), 'w') as f:
+        json.dump(leaderboard(runs), f, indent=2)
+
+
+def print_leaderboard(runs):
+    print('{0:>4s} | {1:<16s} | {2:>5s} | {3:>8s} | {4:>8s} | {5:>8s} | '
+          '{6:>8s} | {7}'.format('run', 'status', 'epoch', 'score', 'mass',
+                                 'pt', 'tau21', 'params'))
+    print('-' * 100)
+    for row in leaderboard(runs):
+        print('{0:>4d} | {1:<16s} | {2:>5s} | {3:>8.4f} | {4:>8.4f} | '
+              '{5:>8.4f} | {6:>8.4f} | {7}'.format(
+                  row['run'], row['status'], str(row['best_epoch']),
+                  *[row.get(k, np.nan) for k in ('score', 'mass', 'pt', 'tau21')]
+                  + [' '.join('{}={}'.format(*kv) for kv in sorted(row['params'].items()))]))
+
+
+if __name__ == '__main__':
+
+    parser = get_parser()
+    results = parser.parse_args()
+
+    from data import get_datafile
+    from evaluation import real_observables
+
+    trials = make_trials(parse_space(results.param), results.search,
+                         results.nb_trials, results.seed)
+    runs = [Run(i, params, results.output_dir) for i, params in enumerate(trials)]
+    print('[INFO] Sweeping over {} runs'.format(len(runs)))
+
+    train_args = ['--nb-epochs', str(results.nb_epochs)]
+    if results.dataset is not None:
+        train_args += ['--dataset', results.dataset]
+
+    evaluator = BackgroundEvaluator(nb_jobs=results.nb_jobs)
+
+    print('[INFO] Computing real data observables')
+    evaluator.start(*real_observables(get_datafile(results.dataset),
+                                      results.nb_eval, nb_jobs=results.nb_jobs))
+
+    rungs = sorted(r for r in results.rungs if r < results.nb_epochs)
+    halving = SuccessiveHalving(rungs, results.eta)
+    eval_epochs = rungs + [results.nb_epochs]
+
+    def unscored(run):
+        """ epochs of run with a complete checkpoint but no scores yet """
+        # the discriminator is saved after the generator, so its file
+        # existing means the generator checkpoint is complete
+        return [epoch for epoch in eval_epochs if epoch not in run.scores and
+                os.path.isfile(run.checkpoint(epoch, 'discriminator'))]
+
+    # runs that are training, or whose last checkpoints are being evaluated
+    pending, active = list(runs), []
+    # runs not to evaluate any further
+    halted = set()
+    try:
+        while pending or active:
+            while pending and sum(run.status == 'running' for run in
+                                  active) < results.max_concurrent:
+                run = pending.pop(0)
+                print('[INFO] Starting run {}: {}'.format(run.index, run.params))
+                run.start(train_args, results.threads_per_run)
+                active.append(run)
+
+            for run in list(active):
+                # check before looking for checkpoints, so none of a finished
+                # run is missed
+                returncode = run.process.poll()
+
+                for epoch in unscored(run):
+                    evaluator.submit(run, epoch)
+
+                # in order, so the rungs are decided in order
+                for epoch in eval_epochs:
+                    if epoch in run.scores:
+                        continue
+                    try:
+                        scores = evaluator.result(run, epoch)
+                    except Exception as e:
+                        print('[WARN] Could not evaluate run {} after epoch {}: '
+                              '{}'.format(run.index, epoch, e))
+                        if run.status == 'running':
+                            run.stop('failed')
+                        else:
+                            run.status = 'failed'
+                        halted.add(run.index)
+                        evaluator.discard(run)
+                        break
+                    if scores is None:
+                        break
+                    run.scores[epoch] = scores
+                    print('[INFO] Run {} after epoch {}: score {:.4f}'.format(
+                        run.index, epoch, scores['score']))
+
+                    if epoch in rungs and not halving.promote(
+                            epoch, scores['score']):
+                        print('[INFO] Stopping run {}'.format(run.index))
+                        if run.status == 'running':
+                            run.stop('stopped')
+                        else:
+                            run.status = 'stopped'
+                        halted.add(run.index)
+                        evaluator.discard(run)
+                        break
+
+                if run.status == 'running':
+                    if rss_mb(run.process.pid) > results.memory_per_run:
+                        print('[WARN] Run {} is over its memory budget'.format(
+                            run.index))
+                        run.stop('out of memory')
+                    elif returncode is not None:
+                        run.stop('finished' if returncode == 0 else 'failed')
+
+                if run.status != 'running' and (run.index in halted or
+                                                not unscored(run)):
+                    active.remove(run)
+                    write_leaderboard(runs, results.output_dir)
+
+            if active:
+                time.sleep(results.poll)
+    finally:
+        for run in active:
+            if run.status == 'running':
+                run.stop('interrupted')
+        evaluator.close()
+
+    write_leaderboard(runs, results.output_dir)
+    print_leaderboard(runs)
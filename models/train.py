@@ -15,20 +15,13 @@ except ImportError:
     import pickle
 
 import argparse
-import os
 from six.moves import range
 import sys
+import time
 
-from h5py import File as HDF5File
 import numpy as np
 
-
-def bit_flip(x, prob=0.05):
-    """ flips a int array's values with some probability """
-    x = np.array(x)
-    selection = np.random.uniform(0, 1, x.shape) < prob
-    x[selection] = 1 * np.logical_not(x[selection])
-    return x
+from networks.registry import MODELS
 
 
 def get_parser():
@@ -39,14 +32,44 @@ def get_parser():
     )
     parser.add_argument('--model', '-m', action='store', type=str,
                         default='lagan', help='Model architecture to use.',
-                        choices=['lagan', 'fcn', 'hybrid', 'dcgan'])
+                        choices=MODELS)
     parser.add_argument('--nb-epochs', action='store', type=int, default=50,
                         help='Number of epochs to train for.')
     parser.add_argument('--batch-size', action='store', type=int, default=100,
                         help='batch size per update')
+    parser.add_argument('--minibatch-chunk-size', action='store', type=int,
+                        help='If set, compute minibatch discrimination '
+                        'features for this many rows of the batch at a time, '
+                        'so their memory grows linearly rather than '
+                        'quadratically with the batch size (TensorFlow '
+                        'backend only)')
+    parser.add_argument('--no-build-cache', action='store_true',
+                        help='Build the networks from networks/<model>.py '
+                        'rather than from architectures cached by earlier '
+                        'runs (see networks/registry.py)')
+
     parser.add_argument('--latent-size', action='store', type=int, default=200,
                         help='size of random N(0, 1) latent space to sample')
 
+    parser.add_argument('--intra-op-threads', action='store', type=int,
+                        default=0, help='TensorFlow intra-op thread pool size '
+                        '(0: TensorFlow decides)')
+    parser.add_argument('--inter-op-threads', action='store', type=int,
+                        default=0, help='TensorFlow inter-op thread pool size '
+                        '(0: TensorFlow decides)')
+    parser.add_argument('--autotune', action='store_true',
+                        help='Before training, time short trials of every '
+                        '--autotune-batch-sizes and thread setting, and train '
+                        'with the fastest that fits in --autotune-memory. The '
+                        'choice is cached per model and host')
+    parser.add_argument('--autotune-batch-sizes', action='store', type=int,
+                        nargs='+', default=[50, 100, 200],
+                        help='Batch sizes for --autotune to consider')
+    parser.add_argument('--autotune-memory', action='store', type=float,
+                        default=8000, help='Memory ceiling in MB for --autotune')
+    parser.add_argument('--retune', action='store_true',
+                        help='Ignore a cached --autotune decision')
+
     # Adam parameters suggested in [arXiv/1511.06434]
     parser.add_argument('--adam-lr', action='store', type=float, default=0.0002,
                         help='Adam learning rate')
@@ -55,13 +78,44 @@ def get_parser():
                         help='Adam beta_1 parameter')
 
     parser.add_argument('--dataset', action='store', type=str,
-                        help='HDF5 or Numpy array to train from. If not '
+                        help='HDF5 or Numpy array, or a directory written '
+                        'by shards.py, to train from. If not '
                         'specified, will download directly from '
                         '[10.5281/zenodo.268592] into a Keras cache')
 
     parser.add_argument('--nb-points', action='store', type=int, default=90000,
                         help='Number points to use from the downloaded file')
 
+    parser.add_argument('--preprocessed', action='store', type=str,
+                        help='Train on the split written by '
+                        'data.save_preprocessed (e.g. by compare.py) to this '
+                        'directory, memory-mapped, instead of sampling '
+                        '--dataset')
+
+    parser.add_argument('--balance', action='store_true',
+                        help='Sample as many signal as background jets, '
+                        'rather than the proportions of the file')
+
+    parser.add_argument('--shuffle', action='store', type=str, default='block',
+                        choices=['none', 'block'],
+                        help='none: go through the data in the same order '
+                        'every epoch. block: reshuffle every epoch by '
+                        'shuffling contiguous blocks, then rows within a '
+                        'buffer of blocks')
+    parser.add_argument('--block-size', action='store', type=int, default=1024,
+                        help='Rows per block for --shuffle block')
+    parser.add_argument('--buffer-blocks', action='store', type=int, default=8,
+                        help='Blocks per shuffle buffer for --shuffle block')
+    parser.add_argument('--stratify', action='store_true',
+                        help='Keep the signal fraction of every batch close '
+                        'to that of the dataset')
+
+    parser.add_argument('--seed', action='store', type=int, default=None,
+                        help='Seed of the initial weights, dropout, the '
+                        'train/test split, the epoch orders and the noise, '
+                        'labels and label flips of every step. Random by '
+                        'default')
+
     parser.add_argument('--prog-bar', action='store_true',
                         help='Whether or not to use a progress bar')
 
@@ -73,6 +127,29 @@ def get_parser():
                         default='params_generator_epoch_',
                         help='Default prefix for generator network weights')
 
+    parser.add_argument('--checkpoint-store', action='store_true',
+                        help='Save the weights of every epoch into '
+                        'delta-compressed stores <g-pfx>store and <d-pfx>store '
+                        '(see checkpoints.py) instead of one HDF5 file per '
+                        'epoch. Epoch N is then loaded as <pfx>store:N')
+
+    parser.add_argument('--keyframe-every', action='store', type=int,
+                        default=10,
+                        help='With --checkpoint-store, save all weights every '
+                        'this many epochs and only deltas in between')
+
+    parser.add_argument('--validate-every', action='store', type=int,
+                        default=0,
+                        help='Every this many epochs, score mass, pT and tau21 '
+                        'of a generated sample against real data in the '
+                        'background, logging to <g-pfx>validation.json and '
+                        'pointing <g-pfx>best.json at the best epoch. 0 turns '
+                        'validation off')
+
+    parser.add_argument('--nb-validation', action='store', type=int,
+                        default=2000,
+                        help='Number of generated and real jets to validate on')
+
     return parser
 
 
@@ -81,19 +158,59 @@ if __name__ == '__main__':
     parser = get_parser()
     results = parser.parse_args()
 
+    if results.autotune:
+        # trials run in subprocesses, before this process loads the backend
+        import json
+        from autotune import autotune
+
+        print('[INFO] Autotuning the {} model'.format(results.model))
+        decision = autotune(results.model, results.latent_size,
+                            results.minibatch_chunk_size,
+                            results.autotune_batch_sizes,
+                            results.autotune_memory, retune=results.retune)
+        print('[INFO] autotune{}: batch size {}, {} intra-op / {} inter-op '
+              'threads, {:.1f} images/sec'.format(
+                  ' (cached)' if decision['cached'] else '',
+                  decision['batch_size'], decision['intra_op_threads'],
+                  decision['inter_op_threads'], decision['images_per_sec']))
+        with open('{}autotune.json'.format(results.g_pfx), 'w') as f:
+            json.dump(decision, f, indent=2, sort_keys=True)
+
+        results.batch_size = decision['batch_size']
+        results.intra_op_threads = decision['intra_op_threads']
+        results.inter_op_threads = decision['inter_op_threads']
+
+    validator = None
+    if results.validate_every > 0:
+        # start the worker before the backend is loaded
+        from evaluation import BackgroundValidator
+        validator = BackgroundValidator(
+            logfile='{}validation.json'.format(results.g_pfx),
+            bestfile='{}best.json'.format(results.g_pfx)
+        )
+
+    from networks.registry import PhaseTimer
+    timer = PhaseTimer()
+
     # delay the imports so running train.py -h doesn't take 50 years
-    import keras.backend as K
+    with timer.phase('import keras'):
+        import keras.backend as K
 
     K.set_image_dim_ordering('tf')
 
-    from keras.layers import Input
-    from keras.models import Model
-    from keras.optimizers import Adam
+    if results.intra_op_threads or results.inter_op_threads:
+        from autotune import set_threads
+        set_threads(results.intra_op_threads, results.inter_op_threads)
+
     from keras.utils.generic_utils import Progbar
-    from sklearn.cross_validation import train_test_split
 
-    exec('from networks.{} import generator as build_generator, '
-         'discriminator as build_discriminator'.format(results.model))
+    from data import get_datafile, load_preprocessed, load_split, preprocess
+    from networks.gan import build_gan
+    from networks.registry import builders
+    from sampling import BlockShuffleSampler, NoiseSampler
+
+    build_generator, build_discriminator = builders(
+        results.model, cache=not results.no_build_cache)
 
     print('[INFO] Building the {} model.'.format(results.model))
 
@@ -105,116 +222,90 @@ if __name__ == '__main__':
 
     nb_classes = 2
 
+    # the initial weights, dropout masks and everything sampled in training
+    # below derive from this, so a run can be repeated, up to the ordering of
+    # floating point sums in parallel ops
+    seed = results.seed
+    if seed is None:
+        seed = np.random.randint(2 ** 31)
+    print('[INFO] Seed: {}'.format(seed))
+
+    # Keras draws the seeds of its weight initializers from np.random, and
+    # with TensorFlow those of dropout from the graph seed
+    np.random.seed(seed)
+    if K.backend() == 'tensorflow':
+        import tensorflow as tf
+        tf.set_random_seed(seed)
+
     adam_lr = results.adam_lr
     adam_beta_1 = results.adam_beta
 
-    # build the discriminator
-    print('[INFO] Building discriminator')
-    discriminator = build_discriminator()
-    discriminator.compile(
-        optimizer=Adam(lr=adam_lr, beta_1=adam_beta_1),
-        loss=['binary_crossentropy', 'binary_crossentropy']
+    generator, discriminator, combined = build_gan(
+        build_generator, build_discriminator, latent_size, adam_lr,
+        adam_beta_1, minibatch_chunk_size=results.minibatch_chunk_size,
+        timer=timer
     )
 
-    # build the generator
-    print('[INFO] Building generator')
-    generator = build_generator(latent_size)
-    generator.compile(
-        optimizer=Adam(lr=adam_lr, beta_1=adam_beta_1),
-        loss='binary_crossentropy'
-    )
-
-    image_class = Input(shape=(1, ), name='combined_aux', dtype='int32')
-    latent = Input(shape=(latent_size, ), name='combined_z')
-
-    # get a fake image
-    fake = generator([latent, image_class])
-
-    # we only want to be able to train generation for the combined model
-    discriminator.trainable = False
-    fake, aux = discriminator(fake)
-    combined = Model(
-        input=[latent, image_class],
-        output=[fake, aux],
-        name='combined_model'
-    )
+    stores = None
+    if results.checkpoint_store:
+        from checkpoints import CheckpointStore, checkpoint_path
+        stores = {
+            'generator': CheckpointStore('{}store'.format(results.g_pfx),
+                                         results.keyframe_every),
+            'discriminator': CheckpointStore('{}store'.format(results.d_pfx),
+                                             results.keyframe_every)
+        }
 
-    combined.compile(
-        optimizer=Adam(lr=adam_lr, beta_1=adam_beta_1),
-        loss=['binary_crossentropy', 'binary_crossentropy']
-    )
-
-    datafile = results.dataset
-
-    # if we don't have the dataset, go fetch it from Zenodo, or re-find in the
-    # Keras cache
     print('[INFO] Loading data')
-    if (datafile is None) or (not os.path.isfile(datafile)):
-
-        from keras.utils.data_utils import get_file
-
-        print('[WARN] File not found or not specified. Downloading from '
-              'Zenodo. (Or, falling back to cache if present)')
+    if results.preprocessed is not None:
+        # already split and preprocessed, and shared with other runs
+        with timer.phase('load data'):
+            X_train, X_test, y_train, y_test, rows_train, rows_test, meta = \
+                load_preprocessed(results.preprocessed)
+        datafile = meta['datafile']
+
+    else:
+        # if we don't have the dataset, go fetch it from Zenodo, or re-find in
+        # the Keras cache
+        datafile = get_datafile(results.dataset)
+
+        # we don't really need validation data as it's a bit meaningless for
+        # GANs, but since we have an auxiliary task, it can be helpful to
+        # debug mode collapse to a particularly signal or background-like
+        # image. Both sets keep the signal fraction of the file (or are
+        # balanced, with --balance), and only the sampled jets are read
+        with timer.phase('load data'):
+            X_train, X_test, y_train, y_test, rows_train, rows_test = load_split(
+                datafile, results.nb_points, test_fraction=0.1,
+                balance=results.balance, seed=seed, return_rows=True)
+
+        X_train, X_test = preprocess(X_train), preprocess(X_test)
+
+    if validator is not None:
+        validator.set_reference(datafile, results.nb_validation)
+
+    # which jets the networks were trained on, for memorization.py
+    np.savez('{}split.npz'.format(results.g_pfx), datafile=datafile,
+             train=rows_train, test=rows_test, seed=seed)
 
-        # Info for downloading the dataset from Zenodo
-        MD5_HASH = 'f9b11c46b6a0ff928bec2eccf865ecf0'
-        DATAFILE = 'jet-images_Mass60-100_pT250-300_R1.25_Pix25.hdf5'
-        URL_TEMPLATE = 'https://zenodo.org/record/{record}/files/{filename}'
-
-        print('[INFO] MD5 verification: {}'.format(MD5_HASH))
+    nb_train, nb_test = X_train.shape[0], X_test.shape[0]
 
-        datafile = get_file(
-            fname='lagan-jet-images.hdf5',
-            origin=URL_TEMPLATE.format(record=269622, filename=DATAFILE),
-            md5_hash=MD5_HASH
+    sampler = None
+    if results.shuffle == 'block':
+        sampler = BlockShuffleSampler(
+            nb_train, block_size=results.block_size,
+            buffer_blocks=results.buffer_blocks,
+            labels=y_train if results.stratify else None, seed=seed
         )
 
-    # You can pass in either HDF5 files or Numpy binary files - we default to
-    # HDF5, but can fallback to numpy
-    try:
-        d = HDF5File(datafile, 'r')
-
-        X, y = d['image'][:], d['signal'][:]
-
-        ix = list(range(X.shape[0]))
-        np.random.shuffle(ix)
-        ix = ix[:results.nb_points]
-
-        X, y = X[ix], y[ix]
-
-    except IOError:
-        print('[WARN] Failure to read as HDF5, falling back to numpy')
-
-        d = np.load(datafile, mmap_mode='r')
-        ix = list(range(d.shape[0]))
-        np.random.shuffle(ix)
-        ix = ix[:results.nb_points]
-        d = np.array(d[ix])
-
-        X, y = d['image'], d['signal']
-
-    # remove unphysical values
-    X[X < 1e-3] = 0
-
-    # we don't really need validation data as it's a bit meaningless for GANs,
-    # but since we have an auxiliary task, it can be helpful to debug mode
-    # collapse to a particularly signal or background-like image
-    X_train, X_test, y_train, y_test = train_test_split(X, y, train_size=0.9)
-
-    # tensorflow ordering
-    X_train = np.expand_dims(X_train, axis=-1)
-    X_test = np.expand_dims(X_test, axis=-1)
-
-    nb_train, nb_test = X_train.shape[0], X_test.shape[0]
-
-    # scale the pT levels by 100 (help neural nets w/ dynamic range - they
-    # need all the help they can get)
-    X_train = X_train.astype(np.float32) / 100
-    X_test = X_test.astype(np.float32) / 100
+    noise_sampler = NoiseSampler(batch_size, latent_size, nb_classes, seed=seed)
 
     train_history = defaultdict(list)
     test_history = defaultdict(list)
 
+    # the first step also builds the Keras training functions
+    first_step_start = time.time()
+
     for epoch in range(nb_epochs):
         print('Epoch {} of {}'.format(epoch + 1, nb_epochs))
 
@@ -225,23 +316,29 @@ if __name__ == '__main__':
         epoch_gen_loss = []
         epoch_disc_loss = []
 
-        for index in range(nb_batches):
+        # the order to go through the training data in this epoch
+        order = None if sampler is None else sampler.epoch(epoch)
+
+        steps = noise_sampler.epoch(epoch, nb_batches)
+        for index, step in enumerate(steps):
             if verbose:
                 progress_bar.update(index)
             else:
                 if index % 100 == 0:
                     print('processed {}/{} batches'.format(index + 1, nb_batches))
 
-            # generate a new batch of noise
-            noise = np.random.normal(0, 1, (batch_size, latent_size))
-
             # get a batch of real images
-            image_batch = X_train[index * batch_size:(index + 1) * batch_size]
-            label_batch = y_train[index * batch_size:(index + 1) * batch_size]
+            if order is None:
+                image_batch = X_train[index * batch_size:(index + 1) * batch_size]
+                label_batch = y_train[index * batch_size:(index + 1) * batch_size]
+            else:
+                rows = np.sort(order[index * batch_size:(index + 1) * batch_size])
+                image_batch, label_batch = X_train[rows], y_train[rows]
 
-            # sample some labels from p_c (note: we have a flat prior here, so
-            # we can just sample randomly)
-            sampled_labels = np.random.randint(0, nb_classes, batch_size)
+            # noise and labels sampled from p_c (note: we have a flat prior
+            # here, so we can just sample randomly), drawn ahead by
+            # noise_sampler together with the label flips below
+            noise, sampled_labels = step.noise, step.labels
 
             # generate a batch of fake images, using the generated labels as a
             # conditioner. We reshape the sampled labels to be
@@ -252,7 +349,7 @@ if __name__ == '__main__':
 
             # see if the discriminator can figure itself out...
             real_batch_loss = discriminator.train_on_batch(
-                image_batch, [bit_flip(np.ones(batch_size)), label_batch]
+                image_batch, [step.real, label_batch]
             )
 
             # note that a given batch should have either *only* real or *only* fake,
@@ -260,7 +357,7 @@ if __name__ == '__main__':
             # of which rely on batch level stats
             fake_batch_loss = discriminator.train_on_batch(
                 generated_images,
-                [bit_flip(np.zeros(batch_size)), bit_flip(sampled_labels)]
+                [step.fake, step.fake_aux]
             )
 
             epoch_disc_loss.append([
@@ -276,32 +373,34 @@ if __name__ == '__main__':
 
             # we do this twice simply to match the number of batches per epoch used to
             # train the discriminator
-            for _ in range(2):
-                noise = np.random.normal(0, 1, (batch_size, latent_size))
-                sampled_labels = np.random.randint(0, nb_classes, batch_size)
-
+            for noise, sampled_labels, aux in zip(step.gen_noise,
+                                                  step.gen_labels, step.gen_aux):
                 gen_losses.append(combined.train_on_batch(
                     [noise, sampled_labels.reshape((-1, 1))],
-                    [trick, bit_flip(sampled_labels, 0.09)]
+                    [trick, aux]
                 ))
 
             epoch_gen_loss.append([
                 (a + b) / 2 for a, b in zip(*gen_losses)
             ])
 
-        print('\nTesting for epoch {}:'.format(epoch + 1))
+            if timer is not None:
+                timer.add('first step', time.time() - first_step_start)
+                timer.report('Startup')
+                timer = None
 
-        # generate a new batch of noise
-        noise = np.random.normal(0, 1, (nb_test, latent_size))
+        print('\nTesting for epoch {}:'.format(epoch + 1))
 
-        # sample some labels from p_c and generate images from them
-        sampled_labels = np.random.randint(0, nb_classes, nb_test)
+        # generate a new batch of noise, sample some labels from p_c and
+        # generate images from them
+        noise, sampled_labels = noise_sampler.draw(epoch, 'test', 3 * nb_test)
         generated_images = generator.predict(
-            [noise, sampled_labels.reshape((-1, 1))], verbose=False)
+            [noise[:nb_test], sampled_labels[:nb_test].reshape((-1, 1))],
+            verbose=False)
 
         X = np.concatenate((X_test, generated_images))
         y = np.array([1] * nb_test + [0] * nb_test)
-        aux_y = np.concatenate((y_test, sampled_labels), axis=0)
+        aux_y = np.concatenate((y_test, sampled_labels[:nb_test]), axis=0)
 
         # see if the discriminator can figure itself out...
         discriminator_test_loss = discriminator.evaluate(
@@ -310,8 +409,7 @@ if __name__ == '__main__':
         discriminator_train_loss = np.mean(np.array(epoch_disc_loss), axis=0)
 
         # make new noise
-        noise = np.random.normal(0, 1, (2 * nb_test, latent_size))
-        sampled_labels = np.random.randint(0, nb_classes, 2 * nb_test)
+        noise, sampled_labels = noise[nb_test:], sampled_labels[nb_test:]
 
         trick = np.ones(2 * nb_test)
 
@@ -345,7 +443,33 @@ if __name__ == '__main__':
                              *test_history['discriminator'][-1]))
 
         # save weights every epoch
-        generator.save_weights('{0}{1:03d}.hdf5'.format(results.g_pfx, epoch),
-                               overwrite=True)
-        discriminator.save_weights('{0}{1:03d}.hdf5'.format(results.d_pfx, epoch),
-                                   overwrite=True)
+        if stores is not None:
+            checkpoints = {}
+            for network, model in (('generator', generator),
+                                   ('discriminator', discriminator)):
+                stores[network].save(epoch, model)
+                checkpoints[network] = checkpoint_path(
+                    stores[network].directory, epoch)
+        else:
+            checkpoints = {
+                'generator': '{0}{1:03d}.hdf5'.format(results.g_pfx, epoch),
+                'discriminator': '{0}{1:03d}.hdf5'.format(results.d_pfx, epoch)
+            }
+            generator.save_weights(checkpoints['generator'], overwrite=True)
+            discriminator.save_weights(checkpoints['discriminator'],
+                                       overwrite=True)
+
+        if validator is not None:
+            if (epoch + 1) % results.validate_every == 0:
+                noise, sampled_labels = noise_sampler.draw(
+                    epoch, 'validation', results.nb_validation)
+                generated_images = generator.predict(
+                    [noise, sampled_labels.reshape((-1, 1))], verbose=False,
+                    batch_size=batch_size)
+
+                validator.submit(epoch + 1, 100 * generated_images.squeeze(-1),
+                                 sampled_labels, checkpoints)
+            validator.collect()
+
+    if validator is not None:
+        validator.close()